@@ -0,0 +1,109 @@
+import time
+
+from input_actions import format_latency, input_controller
+from tracing import tracer
+
+
+ACTIONS = ("click", "double_click", "right_click", "type", "key", "wait", "scroll")
+
+MAX_WAIT = 10  # seconds
+
+RUN_ACTIONS_TOOL = {
+    "name": "run_actions",
+    "description": "Run an ordered list of input actions in one go, e.g. click a field, type into it and press enter. "
+                   "Stops at the first failing step and reports a short result per step. Set screenshot to get one "
+                   "screenshot after the last step. Prefer this over separate tool calls for routine sequences.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "actions": {
+                "type": "array",
+                "description": "Actions to run in order",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "action": {
+                            "type": "string",
+                            "enum": list(ACTIONS),
+                            "description": "click/double_click/right_click need x and y; type needs text; key needs keys; wait needs seconds; scroll needs amount and optionally x and y"
+                        },
+                        "x": {"type": "integer", "description": "The x-coordinate, in screenshot coordinates"},
+                        "y": {"type": "integer", "description": "The y-coordinate, in screenshot coordinates"},
+                        "text": {"type": "string", "description": "Text to type"},
+                        "keys": {
+                            "type": "array",
+                            "items": {"type": "string"},
+                            "description": "Key or key combination pressed together, e.g. [\"enter\"] or [\"ctrl\", \"a\"]"
+                        },
+                        "seconds": {"type": "number", "description": f"How long to wait (max {MAX_WAIT})"},
+                        "amount": {"type": "integer", "description": "Scroll amount; positive scrolls up, negative down"}
+                    },
+                    "required": ["action"]
+                }
+            },
+            "screenshot": {
+                "type": "boolean",
+                "description": "Take one screenshot after the last action (optional, default: false)"
+            }
+        },
+        "required": ["actions"]
+    }
+}
+
+
+def _run_step(step, to_screen, move_duration):
+    action = step["action"]
+    if action in ("click", "double_click", "right_click"):
+        x, y = to_screen(step["x"], step["y"])
+        click = {"click": "single", "double_click": "double", "right_click": "right"}[action]
+        input_controller.click(x, y, click, move_duration)
+        return f"{action} ({step['x']}, {step['y']})"
+    if action == "type":
+        input_controller.type(step["text"])
+        return f"typed {len(step['text'])} chars"
+    if action == "key":
+        keys = step["keys"]
+        if isinstance(keys, str):
+            keys = [keys]
+        input_controller.hotkey(*keys)
+        return "pressed " + "+".join(keys)
+    if action == "wait":
+        seconds = min(float(step["seconds"]), MAX_WAIT)
+        time.sleep(seconds)
+        return f"waited {seconds:g}s"
+    if action == "scroll":
+        if "x" in step and "y" in step:
+            x, y = to_screen(step["x"], step["y"])
+            input_controller.scroll(step["amount"], x, y)
+        else:
+            input_controller.scroll(step["amount"])
+        return f"scrolled {step['amount']}"
+    raise ValueError(f"unknown action {action!r}")
+
+
+def run_action_sequence(actions, to_screen, take_screenshot=None, screenshot=False, move_duration=None):
+    # Runs the actions in order and stops at the first failure. to_screen maps
+    # the model's screenshot coordinates to screen coordinates. Returns a
+    # compact per-step report, followed by the screenshot blocks if requested.
+    lines = []
+    completed = 0
+    for number, step in enumerate(actions, 1):
+        start = time.perf_counter()
+        try:
+            with tracer.span("batch_step", action=step.get("action"), batch_step=number):
+                outcome = _run_step(step, to_screen, move_duration)
+        except Exception as e:
+            lines.append(f"{number}. {step.get('action')}: FAILED ({type(e).__name__}: {str(e)})")
+            break
+        lines.append(f"{number}. {outcome}: ok, {format_latency(time.perf_counter() - start)}")
+        completed += 1
+
+    if completed < len(actions):
+        lines.append(f"Stopped after step {completed + 1} of {len(actions)}; the remaining steps were not run.")
+    else:
+        lines.append(f"All {len(actions)} steps completed.")
+
+    summary = "\n".join(lines)
+    if screenshot and take_screenshot is not None:
+        return [{"type": "text", "text": summary}] + take_screenshot()
+    return summary
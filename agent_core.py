@@ -0,0 +1,161 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from agent_loop import SIDE_EFFECT_FREE_TOOLS, block_field, cut_off_result, run_tool_call, split_tool_uses
+from history import HistoryCompactor, ImageHistoryManager
+from prompt_cache import CacheStats, cached_system, cached_tools, with_history_breakpoints
+from streaming import StreamingTurn, print_text_delta
+from tracing import tracer
+
+
+MODEL = "claude-3-5-sonnet-20240620"
+MAX_TOKENS = 4000
+
+# Capture, resize, encode and pyautogui all block. They run on this shared
+# pool so the event loop keeps serving API streams (of any session) meanwhile.
+blocking_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="blocking")
+
+
+async def ainput(prompt=""):
+    # input() without blocking the event loop
+    return await asyncio.get_running_loop().run_in_executor(None, input, prompt)
+
+
+async def run_tool_calls_async(tool_uses, execute_tool, executor=blocking_executor, concurrent_tools=SIDE_EFFECT_FREE_TOOLS):
+    # Runs the tool_use blocks of a response and returns their tool_results
+    # in order: consecutive side-effect-free tools run together, everything
+    # else strictly in order
+    loop = asyncio.get_running_loop()
+    results = []
+    batch = []
+
+    async def flush_batch():
+        results.extend(await asyncio.gather(*(loop.run_in_executor(executor, run_tool_call, block, execute_tool) for block in batch)))
+        batch.clear()
+
+    for block in tool_uses:
+        if block_field(block, "name") in concurrent_tools:
+            batch.append(block)
+            continue
+        await flush_batch()
+        results.append(await loop.run_in_executor(executor, run_tool_call, block, execute_tool))
+    await flush_batch()
+    return results
+
+
+class AgentSession:
+    # One conversation with the model: its history, image eviction and cache
+    # statistics live here rather than in module globals. Sessions share the
+    # event loop and the blocking pool, so one process can drive several of
+    # them while each waits on the network.
+
+    def __init__(self, client, system_prompt, tools, execute_tool, history_manager=None, stream=True,
+                 model=MODEL, max_tokens=MAX_TOKENS, on_text=print_text_delta, name="main"):
+        # client is an AsyncAnthropic (or streaming.FakeAsyncClient)
+        self.client = client
+        self.system_prompt = system_prompt
+        self.tools = tools
+        self.execute_tool = execute_tool
+        self.history_manager = history_manager or ImageHistoryManager(max_images=3)
+        self.compactor = HistoryCompactor(self.history_manager)
+        self.stream = stream
+        self.model = model
+        self.max_tokens = max_tokens
+        self.on_text = on_text
+        self.name = name
+        self.messages = []
+        self.cache_stats = CacheStats()
+        # Seconds per step (one API round trip plus its tools)
+        self.step_latencies = []
+        # Optional session_trace.SessionRecorder (or anything with the same
+        # task/wrap_tool/turn methods) that sees every task, turn and tool call
+        self.recorder = None
+
+    def reset(self):
+        # Starts a new conversation; statistics keep accumulating
+        self.messages = []
+        self.compactor.reset()
+
+    def close(self):
+        # Detaches from the history manager; needed when the manager outlives
+        # the session, as the scripts' module-level one does
+        self.compactor.close()
+
+    def request(self):
+        # System prompt, tools and the stable part of the history carry cache
+        # breakpoints, so only the newest turns are processed from scratch.
+        # Old images go first, then old tasks once the history is too long.
+        # The stable point is taken before evicting: whatever the eviction
+        # rewrites comes after it, so the prefix up to it is still cached.
+        stable = self.history_manager.stable_message(self.messages)
+        self.history_manager.evict(self.messages)
+        if self.compactor.compact(self.messages):
+            stable = None
+        return {
+            "model": self.model,
+            "max_tokens": self.max_tokens,
+            "system": cached_system(self.system_prompt),
+            "messages": with_history_breakpoints([msg for msg in self.messages if msg.get("content")], stable=stable),
+            "tools": cached_tools(self.tools),
+            "tool_choice": {"type": "auto"},
+        }
+
+    async def send(self, user_input, execute_tool=None):
+        # Adds the user message and runs every tool call of each response,
+        # sending all results back together, until a response has no tool
+        # calls. Returns the final response (anything with .content).
+        execute_tool = execute_tool or self.execute_tool
+        if self.recorder is not None:
+            self.recorder.task(user_input)
+            execute_tool = self.recorder.wrap_tool(execute_tool)
+        self.messages.append({"role": "user", "content": user_input})
+        while True:
+            tracer.next_step()
+            started = time.perf_counter()
+            request = self.request()
+            api_started = time.perf_counter()
+            if self.stream:
+                response = await self._stream_turn(request, execute_tool)
+            else:
+                response = await self._create_turn(request)
+            if self.recorder is not None:
+                self.recorder.turn(request, response, time.perf_counter() - api_started, getattr(response, "first_event_s", None))
+            self.cache_stats.record(response.usage)
+            self.messages.append({"role": "assistant", "content": response.content})
+            # Every tool_use must be answered, also when the response stopped
+            # at max_tokens after some tools were already dispatched
+            tool_uses, cut_off = split_tool_uses(response)
+            if not tool_uses and not cut_off:
+                self.step_latencies.append(time.perf_counter() - started)
+                return response
+            if self.stream:
+                # The tools were dispatched while the response streamed in
+                results = await asyncio.to_thread(response.tool_results)
+            else:
+                results = await run_tool_calls_async(tool_uses, execute_tool)
+                results += [cut_off_result(block_field(block, "id")) for block in cut_off]
+            self.messages.append({"role": "user", "content": results})
+            self.step_latencies.append(time.perf_counter() - started)
+
+    async def _create_turn(self, request):
+        with tracer.span("api_round_trip", session=self.name) as span:
+            response = await self.client.messages.create(**request)
+            tracer.record_usage(span, response.usage)
+            span["stop_reason"] = response.stop_reason
+        return response
+
+    async def _stream_turn(self, request, execute_tool):
+        turn = StreamingTurn(execute_tool, self.on_text)
+        with tracer.span("api_round_trip", streamed=True, session=self.name) as span:
+            started = time.perf_counter()
+            async with await self.client.messages.create(stream=True, **request) as events:
+                async for event in events:
+                    if turn.first_event_s is None:
+                        turn.first_event_s = time.perf_counter() - started
+                    turn.handle(event)
+            turn.finish()
+            span["first_event_ms"] = round((turn.first_event_s or 0.0) * 1000, 3)
+            tracer.record_usage(span, turn.usage)
+            span["stop_reason"] = turn.stop_reason
+        return turn
@@ -0,0 +1,56 @@
+from tracing import tracer
+
+
+# Tools that only observe the screen. Consecutive calls to these within one
+# response run concurrently; everything else runs strictly in order. The
+# loop itself is AgentSession (agent_core.py); these helpers are shared by
+# its streamed and non-streamed paths.
+SIDE_EFFECT_FREE_TOOLS = {"take_screenshot", "zoom_region"}
+
+
+def block_field(block, name):
+    # Content blocks are SDK objects when they come from a response and plain
+    # dicts when we build them ourselves
+    return block.get(name) if isinstance(block, dict) else getattr(block, name, None)
+
+
+def response_text(content):
+    return "".join(block_field(block, "text") or "" for block in content if block_field(block, "type") == "text")
+
+
+def tool_result(tool_use_id, execute):
+    # Runs one tool and wraps its output. A failing tool still gets a
+    # tool_result so the tool_use/tool_result pairing stays valid.
+    try:
+        return {"type": "tool_result", "tool_use_id": tool_use_id, "content": execute()}
+    except Exception as e:
+        return {"type": "tool_result", "tool_use_id": tool_use_id, "content": f"Error: {str(e)}", "is_error": True}
+
+
+def cut_off_result(tool_use_id):
+    # For a tool_use the response was cut off in (stop_reason max_tokens). Its
+    # input may be incomplete, so it is not run, but it still needs a result.
+    return {"type": "tool_result", "tool_use_id": tool_use_id, "is_error": True,
+            "content": "Error: the response reached max_tokens before this tool call was complete, so it was not run. Issue it again if it is still needed."}
+
+
+def split_tool_uses(response):
+    # Returns (tool_use blocks to run, tool_use blocks that were cut off).
+    # Every tool_use needs a tool_result, whatever the stop reason; when the
+    # response hit max_tokens, a trailing tool_use may be incomplete.
+    content = list(response.content)
+    tool_uses = [block for block in content if block_field(block, "type") == "tool_use"]
+    if response.stop_reason == "max_tokens" and tool_uses and content[-1] is tool_uses[-1]:
+        return tool_uses[:-1], tool_uses[-1:]
+    return tool_uses, []
+
+
+def traced_tool(execute_tool, name, tool_input):
+    with tracer.span("tool_execution", tool=name):
+        return execute_tool(name, tool_input)
+
+
+def run_tool_call(block, execute_tool):
+    name = block_field(block, "name")
+    print(f"\nTool Used: {name}")
+    return tool_result(block_field(block, "id"), lambda: traced_tool(execute_tool, name, block_field(block, "input")))
@@ -0,0 +1,191 @@
+import asyncio
+import email.utils
+import os
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+from history import estimate_tokens
+from lazy_modules import lazy_import
+from tracing import tracer
+
+anthropic = lazy_import("anthropic")
+
+
+# One connection pool per process, shared by every session
+MAX_CONNECTIONS = 32
+MAX_KEEPALIVE_CONNECTIONS = 16
+KEEPALIVE_EXPIRY = 60  # seconds
+
+# Per-call timeouts: connecting should be quick; reading covers the gaps
+# between streamed events and the whole body of a non-streamed response
+CONNECT_TIMEOUT = 5.0
+READ_TIMEOUT = 120.0
+
+# Retries: at most MAX_ATTEMPTS calls and RETRY_BUDGET seconds of waiting per request
+MAX_ATTEMPTS = 5
+RETRY_BUDGET = 90.0
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 30.0
+
+# Client-side pacing shared by all sessions; 0 turns a limit off
+REQUESTS_PER_MINUTE = float(os.environ.get("REQUESTS_PER_MINUTE", 50))
+INPUT_TOKENS_PER_MINUTE = float(os.environ.get("INPUT_TOKENS_PER_MINUTE", 0))
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
+
+
+class TokenBucket:
+    # Refills at rate_per_minute up to capacity. acquire() waits until the
+    # amount is available. A thread lock guards the state so one bucket can
+    # be shared across event loops and threads in the process.
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self, amount):
+        # Returns 0 when taken, else the seconds to wait before trying again
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return 0.0
+            return (amount - self.tokens) / self.rate
+
+    async def acquire(self, amount=1):
+        # A request larger than the bucket would never fit; let it drain the bucket
+        amount = min(amount, self.capacity)
+        while True:
+            wait = self._take(amount)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+
+class RateLimiter:
+    def __init__(self, requests_per_minute=REQUESTS_PER_MINUTE, input_tokens_per_minute=INPUT_TOKENS_PER_MINUTE):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.input_tokens = TokenBucket(input_tokens_per_minute) if input_tokens_per_minute else None
+
+    async def acquire(self, request):
+        if self.requests is None and self.input_tokens is None:
+            return
+        with tracer.span("rate_limit_wait"):
+            if self.requests is not None:
+                await self.requests.acquire()
+            if self.input_tokens is not None:
+                tokens = sum(estimate_tokens(message["content"]) for message in request.get("messages", []))
+                await self.input_tokens.acquire(tokens)
+
+
+rate_limiter = RateLimiter()
+
+
+def retry_after(error):
+    # Seconds the server asked us to wait, from retry-after-ms or retry-after
+    # (seconds or an HTTP date), or None
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if value is None:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(error):
+    if isinstance(error, (anthropic.APIConnectionError, anthropic.APITimeoutError)):
+        return True
+    return isinstance(error, anthropic.APIStatusError) and error.status_code in RETRYABLE_STATUS
+
+
+def backoff(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    # Exponential backoff with full jitter
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class ResilientClient:
+    # Wraps an AsyncAnthropic client with pacing and retries. It exposes the
+    # same client.messages.create(**request) call, so AgentSession works with
+    # either. For streamed requests only opening the stream is retried; once
+    # events flow, tools may already be running. Given a factory instead of a
+    # client, the client is built on first use.
+
+    def __init__(self, client=None, limiter=rate_limiter, max_attempts=MAX_ATTEMPTS, retry_budget=RETRY_BUDGET, factory=None):
+        self._client = client
+        self._factory = factory
+        self._lock = threading.Lock()
+        self.limiter = limiter
+        self.max_attempts = max_attempts
+        self.retry_budget = retry_budget
+        self.retries = 0
+        self.retry_wait = 0.0
+        self.messages = SimpleNamespace(create=self.create)
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory()
+        return self._client
+
+    async def create(self, **request):
+        waited = 0.0
+        attempt = 0
+        while True:
+            await self.limiter.acquire(request)
+            try:
+                return await self.client.messages.create(**request)
+            except Exception as e:
+                attempt += 1
+                if not is_retryable(e) or attempt >= self.max_attempts:
+                    raise
+                delay = retry_after(e)
+                delay = backoff(attempt - 1) if delay is None else delay
+                if waited + delay > self.retry_budget:
+                    raise
+                status = getattr(e, "status_code", None)
+                print(f"API call failed ({type(e).__name__}{f' {status}' if status else ''}), "
+                      f"retry {attempt} of {self.max_attempts - 1} in {delay:.1f} s")
+                with tracer.span("api_retry_wait", attempt=attempt, status=status, error=type(e).__name__):
+                    await asyncio.sleep(delay)
+                waited += delay
+                self.retries += 1
+                self.retry_wait += delay
+
+
+def create_client(api_key=None, base_url=None, read_timeout=READ_TIMEOUT):
+    # AsyncAnthropic on a tuned connection pool, with the SDK's own retries
+    # off (ResilientClient does them). Importing anthropic and building the
+    # pool waits until the first request, so creating this is free. The pool
+    # is the SDK's own DefaultAsyncHttpxClient, and its Limits and Timeout
+    # types come from the SDK too, so the client always matches what the
+    # installed SDK expects.
+    def build():
+        limits_type = type(anthropic.DEFAULT_CONNECTION_LIMITS)
+        timeout = anthropic.Timeout(read_timeout, connect=CONNECT_TIMEOUT)
+        http_client = anthropic.DefaultAsyncHttpxClient(
+            limits=limits_type(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                               keepalive_expiry=KEEPALIVE_EXPIRY),
+            timeout=timeout,
+        )
+        return anthropic.AsyncAnthropic(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=0,
+                                        timeout=timeout)
+    return ResilientClient(factory=build)
@@ -0,0 +1,293 @@
+import argparse
+import base64
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+
+import numpy as np
+from PIL import Image
+
+
+# Offline microbenchmarks for the screenshot and input pipeline. No display,
+# network or API key is needed: frames are synthetic (or loaded from a
+# directory), capture goes through the fake backend and pyautogui is replaced
+# by a no-op module before the scripts are imported.
+#
+#   python bench.py --output bench.json
+#   python bench.py --compare bench.json
+
+RESOLUTIONS = {
+    "1080p": (1920, 1080),
+    "1440p": (2560, 1440),
+    "4k": (3840, 2160),
+    "5k": (5120, 2880),
+}
+
+
+def noop_pyautogui():
+    module = types.ModuleType("pyautogui")
+    module.FAILSAFE = False
+    module.size = lambda: (1728, 1117)
+    module.position = lambda: (0, 0)
+    for name in ("moveTo", "click", "doubleClick", "rightClick", "write", "typewrite", "press", "hotkey",
+                 "scroll", "keyDown", "keyUp", "mouseDown", "mouseUp"):
+        setattr(module, name, lambda *args, **kwargs: None)
+    return module
+
+
+def synthetic_frame(width, height, kind="ui", seed=0):
+    # "ui": flat panels, a title bar and rows of text-like strokes.
+    # "photo": smooth gradients with noise, the worst case for lossless coding.
+    rng = np.random.default_rng(seed)
+    if kind == "photo":
+        x = np.linspace(0, 1, width, dtype=np.float32)
+        y = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+        base = np.stack([x * 255 + 0 * y, y * 255 + 0 * x, (x + y) * 127], axis=2)
+        noise = rng.normal(0, 18, (height, width, 3))
+        return np.clip(base + noise, 0, 255).astype(np.uint8)
+
+    frame = np.full((height, width, 3), 236, dtype=np.uint8)
+    frame[:height // 30] = (48, 48, 52)
+    sidebar = width // 6
+    frame[:, :sidebar] = (245, 245, 247)
+    for _ in range(40):
+        x0, y0 = rng.integers(sidebar, width - 200), rng.integers(height // 30, height - 60)
+        frame[y0:y0 + rng.integers(20, 60), x0:x0 + rng.integers(80, 400)] = rng.integers(0, 255, 3)
+    line_height = max(height // 60, 12)
+    for top in range(height // 15, height - line_height, line_height * 2):
+        for left in range(sidebar + 20, width - 40, 9):
+            if rng.random() < 0.7:
+                frame[top:top + line_height - 4, left:left + 5] = 30
+    return frame
+
+
+def small_change(frame, seed):
+    # Simulates a dropdown or tooltip appearing
+    changed = frame.copy()
+    rng = np.random.default_rng(seed)
+    height, width = frame.shape[:2]
+    x0, y0 = int(rng.integers(0, width - 300)), int(rng.integers(0, height - 200))
+    changed[y0:y0 + 180, x0:x0 + 260] = (255, 255, 255)
+    changed[y0 + 10:y0 + 20, x0 + 10:x0 + 200] = 20
+    return changed
+
+
+def measure(fn, repeat, warmup=1):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+
+    def pct(p):
+        return ordered[min(int(round(p / 100 * (len(ordered) - 1))), len(ordered) - 1)]
+
+    return {
+        "n": len(ordered),
+        "mean_ms": round(statistics.fmean(ordered), 3),
+        "p50_ms": round(pct(50), 3),
+        "p90_ms": round(pct(90), 3),
+        "p99_ms": round(pct(99), 3),
+        "max_ms": round(ordered[-1], 3),
+    }
+
+
+def rss_kb():
+    # Current resident set size, which unlike tracemalloc includes the PIL
+    # and OpenCV pixel buffers; None where /proc is not available
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def bench_stage(results, name, fn, repeat):
+    # Latencies come from an untraced pass: allocation tracing slows the
+    # allocation-heavy stages down several times. One more call under
+    # tracemalloc gives the peak Python heap, which misses native buffers,
+    # so the process RSS after the stage is recorded next to it.
+    samples = measure(fn, repeat)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    results[name] = dict(summarize(samples), peak_traced_kb=round(peak / 1024, 1), rss_kb=rss_kb())
+    row = results[name]
+    rss = f"{row['rss_kb'] / 1024:>7.1f} MB" if row["rss_kb"] is not None else "      n/a"
+    print(f"  {name:<28} p50 {row['p50_ms']:>9.2f} ms  p90 {row['p90_ms']:>9.2f} ms  "
+          f"p99 {row['p99_ms']:>9.2f} ms  py heap peak {row['peak_traced_kb']:>9.1f} KB  rss {rss}")
+
+
+def load_frames(directory):
+    frames = {}
+    for name in sorted(os.listdir(directory)):
+        if name.lower().endswith((".png", ".jpg", ".jpeg", ".bmp")):
+            with Image.open(os.path.join(directory, name)) as image:
+                frames[os.path.splitext(name)[0]] = np.asarray(image.convert("RGB"))
+    return frames
+
+
+def run(frames, repeat, kinds):
+    # frames maps a label to a recorded frame array, or to a (width, height)
+    # for which synthetic frames of each kind are generated
+    sys.modules["pyautogui"] = noop_pyautogui()
+
+    import capture
+    import screenshot_pipeline
+    from frame_diff import FrameDiffer
+    from grid_overlay import draw_grid
+    from screenshot_pipeline import AdaptiveEncoder, encode_image
+    from ui_detect import UIElementDetector
+
+    # Settle polling would only measure the configured wait window
+    capture.settle_detector.timeout = 0
+
+    # Archive copies go to a scratch directory instead of ~/Desktop
+    scratch = tempfile.mkdtemp(prefix="bench_screenshots_")
+    screenshot_pipeline.screenshot_writer.directory = scratch
+
+    import remote_control_v1
+    import remote_control_with_grid
+
+    results = {}
+    for label, base in frames.items():
+        for kind in kinds:
+            frame = base if kind == "recorded" else synthetic_frame(*base, kind)
+            key = f"{label}/{kind}"
+            print(f"\n{key} ({frame.shape[1]}x{frame.shape[0]})")
+            stages = results[key] = {}
+            image = Image.fromarray(frame)
+            changed = Image.fromarray(small_change(frame, 1))
+            backend = capture.FakeCaptureBackend([image])
+            capture.set_capture_backend(backend)
+
+            bench_stage(stages, "capture", backend.grab, repeat)
+            scale = min(1568 / image.size[0], 1568 / image.size[1])
+            v1_size = (int(image.size[0] * scale), int(image.size[1] * scale))
+            bench_stage(stages, "resize_v1", lambda: image.resize(v1_size, Image.LANCZOS), repeat)
+            bench_stage(stages, "resize_grid", lambda: image.resize((1728, 1117), Image.LANCZOS), repeat)
+            resized = image.resize((1728, 1117), Image.LANCZOS)
+            bench_stage(stages, "grid_overlay", lambda: draw_grid(resized), repeat)
+
+            detector = UIElementDetector()
+            bench_stage(stages, "ui_detect_full", lambda: (detector.reset(), detector.detect(resized)), repeat)
+            detector.detect(resized)
+            bench_stage(stages, "ui_detect_unchanged", lambda: detector.detect(resized), repeat)
+            changed_resized = changed.resize((1728, 1117), Image.LANCZOS)
+            flip = iter(range(10 ** 9))
+            bench_stage(stages, "ui_detect_dirty_region",
+                        lambda: detector.detect(changed_resized if next(flip) % 2 else resized), repeat)
+            bench_stage(stages, "ui_detect_native", lambda: (detector.reset(), detector.detect(image)), repeat)
+            stages["ui_elements"] = {"count": len(detector.detect(resized))}
+
+            differ = FrameDiffer()
+            toggle = [resized, changed.resize((1728, 1117), Image.LANCZOS)]
+            differ.diff(toggle[0])
+            counter = iter(range(10 ** 9))
+            bench_stage(stages, "frame_diff", lambda: differ.diff(toggle[next(counter) % 2]), repeat)
+
+            bench_stage(stages, "encode_jpeg_q85", lambda: encode_image(resized), repeat)
+            encoder = AdaptiveEncoder()
+            bench_stage(stages, "encode_adaptive", lambda: encoder.encode(resized), repeat)
+            payload = encode_image(resized)
+            bench_stage(stages, "base64", lambda: base64.b64encode(payload).decode("utf-8"), repeat)
+            stages["payload_bytes"] = {"jpeg_q85": len(payload), "adaptive": encoder.encode(resized)["bytes"]}
+
+            remote_control_v1.frame_differ.reset()
+            remote_control_with_grid.frame_differ.reset()
+            bench_stage(stages, "take_screenshot_v1",
+                        lambda: remote_control_v1.take_screenshot("bench", full_frame=True), repeat)
+            bench_stage(stages, "take_screenshot_grid",
+                        lambda: remote_control_with_grid.take_screenshot("bench", full_frame=True), repeat)
+
+    # Tool dispatch is independent of frame size
+    print("\nexecute_tool dispatch (no-op input)")
+    dispatch = results["dispatch"] = {}
+    bench_stage(dispatch, "move_and_click", lambda: remote_control_v1.execute_tool(
+        "move_and_click", {"x": 100, "y": 100, "duration": 0}), repeat * 10)
+    bench_stage(dispatch, "type_text", lambda: remote_control_v1.execute_tool(
+        "type_text", {"text": "hello world", "interval": 0}), repeat * 10)
+
+    screenshot_pipeline.screenshot_writer.flush()
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(previous, current):
+    print(f"\nComparison against {previous['meta'].get('commit')} (p50, negative is faster)")
+    for key, stages in current["results"].items():
+        old_stages = previous["results"].get(key, {})
+        for stage, row in stages.items():
+            old = old_stages.get(stage)
+            if not old or "p50_ms" not in row or "p50_ms" not in old:
+                continue
+            change = (row["p50_ms"] - old["p50_ms"]) / old["p50_ms"] * 100 if old["p50_ms"] else 0.0
+            flag = "  REGRESSION" if change > 10 else ""
+            print(f"  {key + '/' + stage:<40} {old['p50_ms']:>9.2f} -> {row['p50_ms']:>9.2f} ms ({change:+.1f}%){flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline screenshot/input pipeline benchmarks")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--resolutions", default=",".join(RESOLUTIONS),
+                        help="Comma-separated subset of: " + ", ".join(RESOLUTIONS))
+    parser.add_argument("--frames", help="Directory of recorded frames to use instead of synthetic ones")
+    parser.add_argument("--kinds", default="ui,photo", help="Synthetic frame kinds: ui, photo")
+    parser.add_argument("--output", help="Write machine-readable results to this JSON file")
+    parser.add_argument("--compare", help="Previous JSON results to compare against")
+    args = parser.parse_args()
+
+    if args.frames:
+        frames, kinds = load_frames(args.frames), ["recorded"]
+    else:
+        frames = {name: RESOLUTIONS[name] for name in args.resolutions.split(",")}
+        kinds = args.kinds.split(",")
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+        },
+        "results": run(frames, args.repeat, kinds),
+    }
+    try:
+        import resource
+        results["meta"]["max_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except ImportError:
+        pass
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
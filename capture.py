@@ -0,0 +1,438 @@
+import ctypes
+import ctypes.util
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from frame_diff import frames_match
+from lazy_modules import lazy_import
+
+np = lazy_import("numpy")
+Image = lazy_import("PIL.Image")
+ImageGrab = lazy_import("PIL.ImageGrab")
+
+
+# Regions are (left, top, right, bottom) in screen pixels, like PIL's bbox.
+
+class CaptureBackend:
+    name = "base"
+
+    def grab(self, region=None):
+        raise NotImplementedError
+
+    def monitors(self):
+        # Returns the monitor rectangles; index 0 is the primary monitor
+        width, height = self.screen_size()
+        return [(0, 0, width, height)]
+
+    def grab_monitor(self, index=0):
+        return self.grab(self.monitors()[index])
+
+    def screen_size(self):
+        return self.grab().size
+
+    def close(self):
+        pass
+
+
+class ImageGrabBackend(CaptureBackend):
+    # PIL's ImageGrab. On Linux this opens a new X connection and copies the
+    # framebuffer on every call, but it works everywhere.
+    name = "imagegrab"
+
+    def __init__(self):
+        self._size = None
+
+    def grab(self, region=None):
+        image = ImageGrab.grab(bbox=region)
+        if region is None:
+            self._size = image.size
+        return image
+
+    def screen_size(self):
+        if self._size is None:
+            self._size = ImageGrab.grab().size
+        return self._size
+
+
+# Xlib structures used by the shared-memory backend
+
+class _XImage(ctypes.Structure):
+    _fields_ = [
+        ("width", ctypes.c_int),
+        ("height", ctypes.c_int),
+        ("xoffset", ctypes.c_int),
+        ("format", ctypes.c_int),
+        ("data", ctypes.c_void_p),
+        ("byte_order", ctypes.c_int),
+        ("bitmap_unit", ctypes.c_int),
+        ("bitmap_bit_order", ctypes.c_int),
+        ("bitmap_pad", ctypes.c_int),
+        ("depth", ctypes.c_int),
+        ("bytes_per_line", ctypes.c_int),
+        ("bits_per_pixel", ctypes.c_int),
+        ("red_mask", ctypes.c_ulong),
+        ("green_mask", ctypes.c_ulong),
+        ("blue_mask", ctypes.c_ulong),
+        ("obdata", ctypes.c_void_p),
+        ("funcs", ctypes.c_void_p * 6),
+    ]
+
+
+class _XShmSegmentInfo(ctypes.Structure):
+    _fields_ = [
+        ("shmseg", ctypes.c_ulong),
+        ("shmid", ctypes.c_int),
+        ("shmaddr", ctypes.c_void_p),
+        ("readOnly", ctypes.c_int),
+    ]
+
+
+class _XRRMonitorInfo(ctypes.Structure):
+    _fields_ = [
+        ("name", ctypes.c_ulong),
+        ("primary", ctypes.c_int),
+        ("automatic", ctypes.c_int),
+        ("noutput", ctypes.c_int),
+        ("x", ctypes.c_int),
+        ("y", ctypes.c_int),
+        ("width", ctypes.c_int),
+        ("height", ctypes.c_int),
+        ("mwidth", ctypes.c_int),
+        ("mheight", ctypes.c_int),
+        ("outputs", ctypes.c_void_p),
+    ]
+
+
+_ZPIXMAP = 2
+_ALL_PLANES = ctypes.c_ulong(-1)
+_IPC_PRIVATE = 0
+_IPC_CREAT = 0o1000
+_IPC_RMID = 0
+# shmat returns (void *) -1 on failure
+_SHMAT_FAILED = ctypes.c_void_p(-1).value
+
+
+def _load_library(name):
+    path = ctypes.util.find_library(name)
+    if path is None:
+        raise OSError(f"lib{name} not found")
+    return ctypes.CDLL(path)
+
+
+class XShmBackend(CaptureBackend):
+    # Captures through the X11 MIT-SHM extension. The display connection and
+    # the shared-memory segments are created once and reused, so a grab is a
+    # single XShmGetImage into memory the X server writes directly. Segments
+    # are kept per region size, so repeated crops of the same size are as cheap
+    # as full-screen grabs. Only the most recently used sizes are kept
+    # (CAPTURE_SHM_SEGMENTS, default 4); zooms and crops come in many sizes.
+    name = "xshm"
+
+    def __init__(self, display=None, max_segments=None):
+        self._x11 = _load_library("X11")
+        self._xext = _load_library("Xext")
+        self._libc = ctypes.CDLL(None, use_errno=True)
+        self._declare_functions()
+
+        display_name = (display or os.environ.get("DISPLAY", "")).encode() or None
+        self._display = self._x11.XOpenDisplay(display_name)
+        if not self._display:
+            raise OSError(f"Cannot open X display {display or os.environ.get('DISPLAY')}")
+        if not self._xext.XShmQueryExtension(self._display):
+            self._x11.XCloseDisplay(self._display)
+            raise OSError("X server does not support MIT-SHM")
+
+        screen = self._x11.XDefaultScreen(self._display)
+        self._root = self._x11.XRootWindow(self._display, screen)
+        self._visual = self._x11.XDefaultVisual(self._display, screen)
+        self._depth = self._x11.XDefaultDepth(self._display, screen)
+        self._size = (self._x11.XDisplayWidth(self._display, screen), self._x11.XDisplayHeight(self._display, screen))
+        self.max_segments = int(os.environ.get("CAPTURE_SHM_SEGMENTS", 4)) if max_segments is None else max_segments
+        self._segments = OrderedDict()  # (width, height) -> (image, info, size)
+        self._lock = threading.Lock()
+
+    def _declare_functions(self):
+        x11, xext, libc = self._x11, self._xext, self._libc
+        x11.XOpenDisplay.restype = ctypes.c_void_p
+        x11.XOpenDisplay.argtypes = [ctypes.c_char_p]
+        x11.XCloseDisplay.argtypes = [ctypes.c_void_p]
+        x11.XDefaultScreen.argtypes = [ctypes.c_void_p]
+        x11.XRootWindow.restype = ctypes.c_ulong
+        x11.XRootWindow.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XDefaultVisual.restype = ctypes.c_void_p
+        x11.XDefaultVisual.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XDefaultDepth.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XDisplayWidth.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XDisplayHeight.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XSync.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XDestroyImage.argtypes = [ctypes.POINTER(_XImage)]
+        xext.XShmQueryExtension.argtypes = [ctypes.c_void_p]
+        xext.XShmCreateImage.restype = ctypes.POINTER(_XImage)
+        xext.XShmCreateImage.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_void_p,
+                                         ctypes.POINTER(_XShmSegmentInfo), ctypes.c_uint, ctypes.c_uint]
+        xext.XShmAttach.argtypes = [ctypes.c_void_p, ctypes.POINTER(_XShmSegmentInfo)]
+        xext.XShmDetach.argtypes = [ctypes.c_void_p, ctypes.POINTER(_XShmSegmentInfo)]
+        xext.XShmGetImage.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.POINTER(_XImage), ctypes.c_int, ctypes.c_int,
+                                      ctypes.c_ulong]
+        libc.shmget.argtypes = [ctypes.c_int, ctypes.c_size_t, ctypes.c_int]
+        libc.shmat.restype = ctypes.c_void_p
+        libc.shmat.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int]
+        libc.shmdt.argtypes = [ctypes.c_void_p]
+        libc.shmctl.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_void_p]
+
+    def _segment(self, width, height):
+        key = (width, height)
+        if key in self._segments:
+            self._segments.move_to_end(key)
+            return self._segments[key]
+        while self._segments and len(self._segments) >= max(self.max_segments, 1):
+            self._release(*self._segments.popitem(last=False)[1])
+
+        info = _XShmSegmentInfo()
+        image = self._xext.XShmCreateImage(self._display, self._visual, self._depth, _ZPIXMAP, None,
+                                           ctypes.byref(info), width, height)
+        if not image:
+            raise OSError("XShmCreateImage failed")
+        size = image.contents.bytes_per_line * height
+        info.shmid = self._libc.shmget(_IPC_PRIVATE, size, _IPC_CREAT | 0o600)
+        if info.shmid < 0:
+            errno = ctypes.get_errno()
+            self._x11.XDestroyImage(image)
+            raise OSError(errno, "shmget failed")
+        address = self._libc.shmat(info.shmid, None, 0)
+        if address is None or address == _SHMAT_FAILED:
+            # XShmGetImage would write through the bad pointer and crash
+            errno = ctypes.get_errno()
+            self._libc.shmctl(info.shmid, _IPC_RMID, None)
+            self._x11.XDestroyImage(image)
+            raise OSError(errno, "shmat failed")
+        info.shmaddr = address
+        image.contents.data = address
+        info.readOnly = 0
+        self._xext.XShmAttach(self._display, ctypes.byref(info))
+        self._x11.XSync(self._display, 0)
+        # Marked for removal now; the kernel frees it once both sides detach,
+        # even if this process dies without cleaning up
+        self._libc.shmctl(info.shmid, _IPC_RMID, None)
+
+        self._segments[key] = (image, info, size)
+        return self._segments[key]
+
+    def _release(self, image, info, size):
+        # Detaches a segment from the X server and this process; it was
+        # already marked for removal, so the kernel frees it here
+        self._xext.XShmDetach(self._display, ctypes.byref(info))
+        self._x11.XSync(self._display, 0)
+        self._libc.shmdt(info.shmaddr)
+        image.contents.data = None
+        self._x11.XDestroyImage(image)
+
+    def grab(self, region=None):
+        left, top, right, bottom = region or (0, 0) + self._size
+        width, height = right - left, bottom - top
+        with self._lock:
+            image, info, size = self._segment(width, height)
+            if not self._xext.XShmGetImage(self._display, self._root, image, left, top, _ALL_PLANES):
+                raise OSError(f"XShmGetImage failed for region {region}")
+            ximage = image.contents
+            if ximage.bits_per_pixel != 32:
+                raise OSError(f"Unsupported X visual with {ximage.bits_per_pixel} bits per pixel")
+            buffer = (ctypes.c_char * size).from_address(ximage.data)
+            # Decoding BGRX into RGB copies out of the shared segment
+            return Image.frombuffer("RGB", (width, height), buffer, "raw", "BGRX", ximage.bytes_per_line, 1)
+
+    def screen_size(self):
+        return self._size
+
+    def monitors(self):
+        try:
+            xrandr = _load_library("Xrandr")
+        except OSError:
+            return super().monitors()
+        xrandr.XRRGetMonitors.restype = ctypes.POINTER(_XRRMonitorInfo)
+        xrandr.XRRGetMonitors.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.c_int, ctypes.POINTER(ctypes.c_int)]
+        xrandr.XRRFreeMonitors.argtypes = [ctypes.POINTER(_XRRMonitorInfo)]
+        count = ctypes.c_int()
+        with self._lock:
+            infos = xrandr.XRRGetMonitors(self._display, self._root, 1, ctypes.byref(count))
+        if not infos or count.value == 0:
+            return super().monitors()
+        monitors = sorted(
+            (not infos[i].primary, (infos[i].x, infos[i].y, infos[i].x + infos[i].width, infos[i].y + infos[i].height))
+            for i in range(count.value)
+        )
+        xrandr.XRRFreeMonitors(infos)
+        return [rect for _, rect in monitors]
+
+    def close(self):
+        with self._lock:
+            if self._display is None:
+                return
+            while self._segments:
+                self._release(*self._segments.popitem(last=False)[1])
+            self._x11.XCloseDisplay(self._display)
+            self._display = None
+
+
+class FakeCaptureBackend(CaptureBackend):
+    # Serves frames from memory or disk instead of the screen. Each grab
+    # returns the next frame and the last one repeats once they run out.
+    name = "fake"
+
+    def __init__(self, frames):
+        self.frames = [self._load(frame) for frame in frames]
+        self.grabs = 0
+
+    @classmethod
+    def from_directory(cls, directory):
+        names = sorted(n for n in os.listdir(directory) if n.lower().endswith((".png", ".jpg", ".jpeg", ".bmp")))
+        return cls([os.path.join(directory, n) for n in names])
+
+    @staticmethod
+    def _load(frame):
+        if isinstance(frame, Image.Image):
+            return frame.convert("RGB")
+        if isinstance(frame, np.ndarray):
+            return Image.fromarray(frame).convert("RGB")
+        with Image.open(frame) as image:
+            return image.convert("RGB")
+
+    def grab(self, region=None):
+        frame = self.frames[min(self.grabs, len(self.frames) - 1)]
+        self.grabs += 1
+        return frame.crop(region) if region is not None else frame.copy()
+
+    def screen_size(self):
+        return self.frames[0].size
+
+
+class CaptureCancelled(Exception):
+    # Raised by a settle wait whose caller no longer needs the frame
+    pass
+
+
+class SettleDetector:
+    # Polls heavily downscaled frames until the screen has stopped changing for
+    # stable_window seconds (or timeout expires), so screenshots don't catch
+    # animations or half-loaded pages. The last polled frame is returned as
+    # the capture, so no extra grab is needed once the screen is stable.
+
+    def __init__(self, stable_window=None, timeout=None, poll_interval=0.05, thumb_width=160, threshold=1.5):
+        self.stable_window = float(os.environ.get("SETTLE_WINDOW", 0.15)) if stable_window is None else stable_window
+        self.timeout = float(os.environ.get("SETTLE_TIMEOUT", 3.0)) if timeout is None else timeout
+        self.poll_interval = poll_interval
+        self.thumb_width = thumb_width
+        self.threshold = threshold
+
+    def _thumbnail(self, frame):
+        factor = max(frame.size[0] // self.thumb_width, 1)
+        return np.asarray(frame.convert("L").reduce(factor), dtype=np.int16)
+
+    def wait(self, backend, cancelled=None):
+        # Returns (frame, report); report has waited_s, polls and settled.
+        # Raises CaptureCancelled before any poll once cancelled() is true.
+        start = time.perf_counter()
+        previous = None
+        previous_at = None
+        stable_since = None
+        polls = 0
+        while True:
+            if cancelled is not None and cancelled():
+                raise CaptureCancelled()
+            frame = backend.grab()
+            polls += 1
+            now = time.perf_counter()
+            thumb = self._thumbnail(frame)
+            if previous is not None and previous.shape == thumb.shape and np.abs(thumb - previous).mean() <= self.threshold:
+                stable_since = stable_since or previous_at
+            else:
+                stable_since = None
+            settled = stable_since is not None and now - stable_since >= self.stable_window
+            if settled or now - start >= self.timeout or self.timeout <= 0:
+                return frame, {"waited_s": now - start, "polls": polls, "settled": settled}
+            previous, previous_at = thumb, now
+            time.sleep(self.poll_interval)
+
+
+def describe_settle(report):
+    state = "settled" if report["settled"] else "still changing at timeout"
+    return f"Waited {report['waited_s']:.2f} s for the screen to settle ({report['polls']} polls, {state})."
+
+
+def create_capture_backend(name=None):
+    # CAPTURE_BACKEND picks the backend: "imagegrab", "xshm" or
+    # "fake:<directory of frames>". By default the shared-memory backend is
+    # used on Linux when it is available.
+    name = name or os.environ.get("CAPTURE_BACKEND", "")
+    if name.startswith("fake:"):
+        return FakeCaptureBackend.from_directory(name[len("fake:"):])
+    if name == "imagegrab":
+        return ImageGrabBackend()
+    if name == "xshm" or (not name and sys.platform.startswith("linux") and os.environ.get("DISPLAY")):
+        try:
+            return XShmBackend()
+        except OSError as e:
+            if name == "xshm":
+                raise
+            print(f"X11 shared-memory capture unavailable ({str(e)}), falling back to ImageGrab")
+    return ImageGrabBackend()
+
+
+_capture_backend = None
+_capture_lock = threading.Lock()
+
+
+settle_detector = SettleDetector()
+
+# The last settled full-screen frame and the perf_counter time its settle
+# wait started, for callers that can reuse it instead of capturing again
+_last_settled = (None, 0.0)
+
+
+def capture_settled(region=None, cancelled=None):
+    # Waits for the screen to settle, then returns (frame, settle report). A
+    # region is captured after the full screen has settled. See
+    # SettleDetector.wait for cancelled.
+    global _last_settled
+    backend = get_capture_backend()
+    started = time.perf_counter()
+    frame, report = settle_detector.wait(backend, cancelled)
+    _last_settled = (frame, started)
+    if region is not None:
+        frame = backend.grab(region)
+    return frame, report
+
+
+def last_settled_frame(since):
+    # The last settled full-screen frame if every grab behind it came after
+    # since (a perf_counter time), else None
+    frame, started = _last_settled
+    return frame if frame is not None and started >= since else None
+
+
+def frame_matches_screen(frame):
+    # One grab to check that the screen still shows frame. This is the frame
+    # differ's exact tile test, not the settle detector's thumbnail mean, which
+    # averages a toggled checkbox or a new label away.
+    current = get_capture_backend().grab()
+    return frames_match(np.asarray(frame.convert("RGB"), dtype=np.uint8),
+                        np.asarray(current.convert("RGB"), dtype=np.uint8))
+
+
+def get_capture_backend():
+    global _capture_backend
+    with _capture_lock:
+        if _capture_backend is None:
+            _capture_backend = create_capture_backend()
+        return _capture_backend
+
+
+def set_capture_backend(backend):
+    global _capture_backend
+    with _capture_lock:
+        if _capture_backend is not None and _capture_backend is not backend:
+            _capture_backend.close()
+        _capture_backend = backend
@@ -0,0 +1,247 @@
+import argparse
+import json
+import os
+import socket
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+
+# The thin client below only needs the standard library, so a scripted call
+# starts in tens of milliseconds; the daemon keeps the capture backend, the
+# heavy imports and the API connection pool warm between calls.
+
+SOCKET_PATH = os.environ.get("AGENT_SOCKET") or os.path.join(tempfile.gettempdir(), f"remote_control-{os.getuid()}.sock")
+
+# Seconds `start` waits for a new daemon to accept connections
+START_TIMEOUT = 60
+
+
+def script_name(script):
+    # The module name, also when the script runs as __main__
+    return os.path.splitext(os.path.basename(script.__file__))[0]
+
+
+def send_message(sock, message):
+    sock.sendall((json.dumps(message) + "\n").encode())
+
+
+class SocketWriter:
+    # File-like stand-in for sys.stdout while a task runs: every write is
+    # sent to the client as an output message. Tools print from worker
+    # threads, so writes are serialised.
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def write(self, text):
+        if text and not self.closed:
+            with self.lock:
+                try:
+                    send_message(self.sock, {"output": text})
+                except OSError:
+                    # The client went away; the task still finishes
+                    self.closed = True
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+class AgentDaemon:
+    # Runs one script's agent in a long-lived process. Tasks run one at a
+    # time (there is one screen) on a single event loop, so the API client's
+    # connections are reused across calls.
+
+    def __init__(self, script):
+        import asyncio
+
+        self.script = script
+        self.started = time.time()
+        self.tasks = 0
+        self.busy = threading.Lock()
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name="daemon-loop", daemon=True).start()
+
+    def run(self, sock, instruction, new_session):
+        import asyncio
+
+        with self.busy:
+            started = time.perf_counter()
+            stdout = sys.stdout
+            sys.stdout = SocketWriter(sock)
+            try:
+                if new_session:
+                    self.script.reset_screen_state()
+                    self.script.session.reset()
+                future = asyncio.run_coroutine_threadsafe(self.script.chat_with_claude(instruction), self.loop)
+                response = future.result()
+            finally:
+                sys.stdout = stdout
+            self.tasks += 1
+        return {"done": True, "response": response, "seconds": time.perf_counter() - started}
+
+    def status(self):
+        return {"script": script_name(self.script), "pid": os.getpid(), "uptime_s": time.time() - self.started,
+                "tasks": self.tasks, "busy": self.busy.locked()}
+
+    def handle(self, sock, request):
+        command = request.get("command")
+        if command == "run":
+            return self.run(sock, request["instruction"], request.get("new_session", True))
+        if command == "status":
+            return self.status()
+        if command == "stop":
+            return {"stopping": True}
+        return {"error": f"Unknown command: {command!r}"}
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        try:
+            reply = self.server.agent.handle(self.connection, json.loads(line))
+        except Exception as e:
+            reply = {"error": f"{type(e).__name__}: {str(e)}"}
+        try:
+            send_message(self.connection, reply)
+        except OSError:
+            pass
+        if reply.get("stopping"):
+            threading.Thread(target=self.server.shutdown, daemon=True).start()
+
+
+def _socket_in_use(path):
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        probe.close()
+
+
+def serve(script, path=SOCKET_PATH):
+    # Warms everything up, then answers requests until told to stop
+    from startup import format_stages, warm_up
+
+    if os.path.exists(path):
+        if _socket_in_use(path):
+            raise RuntimeError(f"A daemon is already listening on {path}")
+        os.unlink(path)
+
+    print(f"Warming up {script_name(script)}...")
+    stages = warm_up(script)
+    print(format_stages(stages))
+
+    daemon = AgentDaemon(script)
+    # Only this user may connect: the daemon drives their mouse and keyboard
+    umask = os.umask(0o177)
+    try:
+        server = socketserver.ThreadingUnixStreamServer(path, _Handler)
+    finally:
+        os.umask(umask)
+    server.daemon_threads = True
+    server.agent = daemon
+    print(f"Listening on {path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.unlink(path)
+        daemon.loop.call_soon_threadsafe(daemon.loop.stop)
+        print(f"Daemon stopped after {daemon.tasks} task(s)")
+
+
+def request(message, path=SOCKET_PATH, on_output=None):
+    # Sends one request; returns the final reply. Output printed by the task
+    # is passed to on_output as it arrives.
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        send_message(sock, message)
+        with sock.makefile("r") as replies:
+            for line in replies:
+                reply = json.loads(line)
+                if "output" in reply:
+                    if on_output is not None:
+                        on_output(reply["output"])
+                    continue
+                return reply
+    raise ConnectionError("The daemon closed the connection without replying")
+
+
+def start(script, path=SOCKET_PATH, log_file=None):
+    # Starts `python <script>.py --daemon` in the background and waits until it listens
+    script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), f"{script}.py")
+    log = open(log_file, "a") if log_file else subprocess.DEVNULL
+    process = subprocess.Popen([sys.executable, script_path, "--daemon"], stdout=log, stderr=subprocess.STDOUT,
+                               stdin=subprocess.DEVNULL, start_new_session=True,
+                               env=dict(os.environ, AGENT_SOCKET=path))
+    deadline = time.monotonic() + START_TIMEOUT
+    while not _socket_in_use(path):
+        if process.poll() is not None:
+            raise RuntimeError(f"The daemon exited with code {process.returncode}" + (f"; see {log_file}" if log_file else ""))
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"The daemon did not start within {START_TIMEOUT} s")
+        time.sleep(0.1)
+    return process.pid
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Thin client for a warm agent daemon (start one with `python <script>.py --daemon`)")
+    parser.add_argument("--socket", default=SOCKET_PATH)
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="Run one instruction")
+    run.add_argument("instruction")
+    run.add_argument("--continue", dest="keep", action="store_true",
+                     help="Continue the daemon's current conversation instead of starting a new one")
+    run.add_argument("--quiet", action="store_true", help="Only print the final response")
+    start_command = commands.add_parser("start", help="Start a daemon in the background")
+    start_command.add_argument("--script", default="remote_control_v1", choices=("remote_control_v1", "remote_control_with_grid"))
+    start_command.add_argument("--log", help="Append the daemon's output to this file")
+    commands.add_parser("status", help="Show what the daemon is doing")
+    commands.add_parser("stop", help="Stop the daemon")
+    args = parser.parse_args()
+
+    if args.command == "start":
+        if _socket_in_use(args.socket):
+            print(f"A daemon is already listening on {args.socket}")
+            return 0
+        print(f"Daemon started (pid {start(args.script, args.socket, args.log)}) on {args.socket}")
+        return 0
+
+    if args.command == "run":
+        message = {"command": "run", "instruction": args.instruction, "new_session": not args.keep}
+    else:
+        message = {"command": args.command}
+    on_output = None if getattr(args, "quiet", False) else lambda text: print(text, end="", flush=True)
+    try:
+        reply = request(message, args.socket, on_output)
+    except (FileNotFoundError, ConnectionRefusedError):
+        print(f"No daemon is listening on {args.socket}. Start one with `python daemon.py start`.", file=sys.stderr)
+        return 1
+    if "error" in reply:
+        print(reply["error"], file=sys.stderr)
+        return 1
+    if args.command == "run":
+        if args.quiet:
+            print(reply["response"])
+        print(f"({reply['seconds']:.1f} s)", file=sys.stderr)
+    else:
+        print(json.dumps(reply, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+import threading
+from collections import OrderedDict
+
+from frame_diff import frames_match
+from lazy_modules import lazy_import
+
+np = lazy_import("numpy")
+
+
+def frame_hash(image, size=32):
+    # Difference hash over a size x size grey thumbnail: one bit per
+    # horizontally adjacent pixel pair. At 1024 bits it is coarse enough to
+    # ignore compression noise and a blinking caret; a changed label or
+    # toggled checkbox may flip only a bit or two, so it finds candidates but
+    # does not prove two frames equal.
+    thumb = np.asarray(image.convert("L").resize((size + 1, size)), dtype=np.int16)
+    bits = (thumb[:, 1:] > thumb[:, :-1]).flatten()
+    return int("".join("1" if b else "0" for b in bits), 2)
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class FrameCache:
+    # Remembers the full screenshots that are still in the conversation. When
+    # a new capture matches one of them the model can be pointed at the
+    # earlier image instead of receiving it again. The perceptual hash only
+    # picks candidates; a match is confirmed by the same tile comparison the
+    # frame differ uses, so a toggled checkbox or an edited label (which can
+    # leave the hash within a couple of bits) is always sent. Entries keep
+    # their pixels for that (a few MB each) and are dropped when the history
+    # manager evicts their image, and the least recently used entry goes when
+    # the cache is full.
+
+    def __init__(self, max_entries=8, max_distance=8):
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.next_number = 1
+        self.lookups = 0
+        self.hits = 0
+        self.bytes_saved = 0
+        self._entries = OrderedDict()  # number -> (hash, pixels, tag, image block, size)
+        self._lock = threading.Lock()
+
+    def lookup(self, image, tag=None):
+        # Returns (hit, key of the image); pass the key to add() if the image
+        # is sent after all. A hit is (screenshot number, size the image was
+        # sent at, its image block). Only entries with an equal tag match, so callers can
+        # include anything drawn onto the image in the key.
+        digest = frame_hash(image)
+        pixels = np.asarray(image.convert("RGB"), dtype=np.uint8)
+        with self._lock:
+            self.lookups += 1
+            candidates = sorted(
+                (hamming(digest, entry[0]), number) for number, entry in self._entries.items()
+                if entry[2] == tag and hamming(digest, entry[0]) <= self.max_distance
+            )
+            for _, number in candidates:
+                _, entry_pixels, _, block, size = self._entries[number]
+                if frames_match(pixels, entry_pixels):
+                    self._entries.move_to_end(number)
+                    self.hits += 1
+                    self.bytes_saved += len(block["source"]["data"])
+                    return (number, size, block), (digest, pixels)
+        return None, (digest, pixels)
+
+    def add(self, key, block, size, tag=None):
+        # Registers an image block that was just sent; returns its number
+        digest, pixels = key
+        with self._lock:
+            number = self.next_number
+            self.next_number += 1
+            self._entries[number] = (digest, pixels, tag, block, size)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return number
+
+    def clear(self):
+        # For a new conversation: none of the old screenshots are in it
+        with self._lock:
+            self._entries.clear()
+
+    def forget_blocks(self, blocks):
+        # Called by the history manager with the image blocks it evicted
+        evicted = {id(block) for block in blocks}
+        with self._lock:
+            for number in [n for n, entry in self._entries.items() if id(entry[3]) in evicted]:
+                del self._entries[number]
+
+    def stats(self):
+        rate = self.hits / self.lookups if self.lookups else 0.0
+        return (f"Screenshot cache: {self.hits}/{self.lookups} hits ({rate:.0%}), "
+                f"{self.bytes_saved} bytes of uploads saved")
@@ -0,0 +1,135 @@
+import threading
+
+from lazy_modules import lazy_import
+
+np = lazy_import("numpy")
+
+
+def changed_tiles(frame, reference, tile=32, threshold=24):
+    # Boolean grid of the tile x tile blocks in which any pixel channel of two
+    # equally sized HxWx3 uint8 frames differs by more than threshold.
+    # |a - b| is taken in uint8 without widening the frames, then the max over
+    # each tile in two passes that both reduce along contiguous memory: first
+    # over the rows of a tile band, then over each tile's columns and
+    # channels. A single max(axis=(1, 3)) on the 4-d view strides through the
+    # whole frame per element and is ~20x slower at 1080p.
+    height, width = frame.shape[:2]
+    delta = np.maximum(frame, reference)
+    delta -= np.minimum(frame, reference)
+    rows = -(-height // tile)
+    cols = -(-width // tile)
+    if rows * tile != height or cols * tile != width:
+        padded = np.zeros((rows * tile, cols * tile, 3), dtype=np.uint8)
+        padded[:height, :width] = delta
+        delta = padded
+    bands = delta.reshape(rows, tile, cols * tile * 3).max(axis=1)
+    return bands.reshape(rows, cols, tile * 3).max(axis=2) > threshold
+
+
+def frames_match(frame, reference, tile=32, threshold=24):
+    # True when no tile changed, i.e. the frame differ would have nothing to
+    # send. Unlike a perceptual hash this catches a toggled checkbox or a
+    # one-word label change.
+    return frame.shape == reference.shape and not changed_tiles(frame, reference, tile, threshold).any()
+
+
+class FrameDiffer:
+    # Keeps the last frame the model was sent and works out which parts of a
+    # new frame changed. Changes are found on a coarse tile grid, grouped into
+    # connected regions and returned as padded bounding boxes in pixel
+    # coordinates of the frame.
+
+    def __init__(self, tile=32, threshold=24, max_changed_fraction=0.35, max_regions=6, pad=8):
+        self.tile = tile
+        self.threshold = threshold
+        self.max_changed_fraction = max_changed_fraction
+        self.max_regions = max_regions
+        self.pad = pad
+        self.reference = None
+        self._lock = threading.Lock()
+
+    def reset(self):
+        self.reference = None
+
+    def rebase(self, image):
+        # Makes image the reference, e.g. when the model was pointed at an
+        # earlier screenshot of the same screen instead of sent a new one
+        frame = np.asarray(image.convert("RGB"), dtype=np.uint8)
+        with self._lock:
+            self.reference = frame.copy()
+
+    def diff(self, image):
+        # Returns None when a full frame should be sent, otherwise a (possibly
+        # empty) list of (left, top, right, bottom) boxes. Screenshots may be
+        # taken concurrently, so the reference frame is guarded by a lock.
+        frame = np.asarray(image.convert("RGB"), dtype=np.uint8)
+        with self._lock:
+            return self._diff(frame)
+
+    def _diff(self, frame):
+        if self.reference is None or self.reference.shape != frame.shape:
+            self.reference = frame.copy()
+            return None
+
+        changed = self._changed_tiles(frame)
+        if not changed.any():
+            return []
+
+        boxes = self._regions(changed, frame.shape[1], frame.shape[0])
+        changed_area = sum((r - l) * (b - t) for l, t, r, b in boxes)
+        if len(boxes) > self.max_regions or changed_area > self.max_changed_fraction * frame.shape[0] * frame.shape[1]:
+            self.reference = frame.copy()
+            return None
+
+        # Only the regions actually sent are folded into the reference, so
+        # small changes below the threshold keep accumulating until they show
+        for left, top, right, bottom in boxes:
+            self.reference[top:bottom, left:right] = frame[top:bottom, left:right]
+        return boxes
+
+    def _changed_tiles(self, frame):
+        return changed_tiles(frame, self.reference, self.tile, self.threshold)
+
+    def _regions(self, changed, width, height):
+        # Connected components over the tile grid (8-connectivity)
+        rows, cols = changed.shape
+        seen = np.zeros_like(changed)
+        boxes = []
+        for r, c in zip(*np.nonzero(changed)):
+            if seen[r, c]:
+                continue
+            stack = [(r, c)]
+            seen[r, c] = True
+            r0, r1, c0, c1 = r, r, c, c
+            while stack:
+                y, x = stack.pop()
+                r0, r1, c0, c1 = min(r0, y), max(r1, y), min(c0, x), max(c1, x)
+                for ny in range(max(y - 1, 0), min(y + 2, rows)):
+                    for nx in range(max(x - 1, 0), min(x + 2, cols)):
+                        if changed[ny, nx] and not seen[ny, nx]:
+                            seen[ny, nx] = True
+                            stack.append((ny, nx))
+            boxes.append((
+                max(int(c0) * self.tile - self.pad, 0),
+                max(int(r0) * self.tile - self.pad, 0),
+                min((int(c1) + 1) * self.tile + self.pad, width),
+                min((int(r1) + 1) * self.tile + self.pad, height),
+            ))
+        return _merge_overlapping(boxes)
+
+
+def _merge_overlapping(boxes):
+    merged = True
+    while merged:
+        merged = False
+        result = []
+        for box in boxes:
+            for i, other in enumerate(result):
+                if box[0] < other[2] and other[0] < box[2] and box[1] < other[3] and other[1] < box[3]:
+                    result[i] = (min(box[0], other[0]), min(box[1], other[1]), max(box[2], other[2]), max(box[3], other[3]))
+                    merged = True
+                    break
+            else:
+                result.append(box)
+        boxes = result
+    return boxes
@@ -0,0 +1,65 @@
+import math
+from functools import lru_cache
+
+from lazy_modules import lazy_import
+
+cv2 = lazy_import("cv2")
+np = lazy_import("numpy")
+Image = lazy_import("PIL.Image")
+
+
+GRID_SIZE = 75  # Default spacing between grid lines
+GRID_SIZES = (50, 75, 100, 150)  # Densities the model may ask for
+GRID_COLOR = (0, 255, 0)  # Green color for grid lines and labels (RGB)
+
+
+class GridOverlay:
+    # A grid rendered once into a boolean mask plus the colour to paint it
+    # with. Applying it is a single masked copy over the frame.
+
+    def __init__(self, mask, color):
+        self.mask = mask
+        self.color = np.array(color, dtype=np.uint8)
+
+    def apply(self, frame):
+        np.copyto(frame, self.color, where=self.mask[..., None])
+        return frame
+
+
+@lru_cache(maxsize=32)
+def grid_overlay(width, height, grid_size=GRID_SIZE, color=GRID_COLOR, origin=(0, 0), scale=1.0):
+    # Lines and labels use absolute screenshot coordinates, so a crop whose
+    # top-left corner is at origin still shows the positions the model should
+    # click. Full frames always share the origin=(0, 0) entry. scale is image
+    # pixels per screenshot coordinate, for crops shown enlarged.
+    origin_x, origin_y = origin
+    mask = np.zeros((height, width), dtype=np.uint8)
+    thickness = 1  # Thickness of the grid lines
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    font_scale = 1.2
+    font_thickness = 1
+
+    # Draw vertical lines and add x-coordinates
+    for x in range(-(-origin_x // grid_size) * grid_size, origin_x + math.ceil(width / scale), grid_size):
+        position = int(round((x - origin_x) * scale))
+        cv2.line(mask, (position, 0), (position, height), 255, thickness)
+        label = f"{x}"
+        (text_width, text_height), _ = cv2.getTextSize(label, font, font_scale, font_thickness)
+        cv2.putText(mask, label, (position - text_width//2, 20), font, 0.6, 255, font_thickness)
+
+    # Draw horizontal lines and add y-coordinates
+    for y in range(-(-origin_y // grid_size) * grid_size, origin_y + math.ceil(height / scale), grid_size):
+        position = int(round((y - origin_y) * scale))
+        cv2.line(mask, (0, position), (width, position), 255, thickness)
+        label = f"{y}"
+        (text_width, text_height), _ = cv2.getTextSize(label, font, font_scale, font_thickness)
+        cv2.putText(mask, label, (5, position + text_height//2), font, font_scale, 255, font_thickness)
+
+    return GridOverlay(mask.astype(bool), color)
+
+
+def draw_grid(image, origin=(0, 0), grid_size=GRID_SIZE, color=GRID_COLOR, scale=1.0):
+    width, height = image.size
+    frame = np.array(image.convert("RGB"))
+    grid_overlay(width, height, grid_size, color, tuple(origin), round(scale, 3)).apply(frame)
+    return Image.fromarray(frame)
@@ -0,0 +1,330 @@
+import json
+import os
+
+from agent_loop import block_field
+
+
+IMAGE_PLACEHOLDER = "[Older screenshot removed from the conversation to save space. Take a new screenshot with full_frame set if you need to see the whole screen again.]"
+
+# Evicting an image rewrites its message, so the prompt cache misses from
+# there on. Images are evicted only once this many are over the limit, so
+# the cached prefix is rebuilt once per batch instead of on every step.
+EVICT_BATCH = int(os.environ.get("IMAGE_EVICT_BATCH", 3))
+
+
+def _iter_image_slots(messages):
+    # Yields (container, index, block) for every base64 image in the history,
+    # newest first. Images live either directly in a user message or inside
+    # the content list of a tool_result block.
+    for message in reversed(messages):
+        content = message.get("content")
+        if not isinstance(content, list):
+            continue
+        for index in reversed(range(len(content))):
+            block = content[index]
+            if not isinstance(block, dict):
+                continue
+            if block.get("type") == "image":
+                yield content, index, block
+            elif block.get("type") == "tool_result" and isinstance(block.get("content"), list):
+                inner = block["content"]
+                for i in reversed(range(len(inner))):
+                    if isinstance(inner[i], dict) and inner[i].get("type") == "image":
+                        yield inner, i, inner[i]
+
+
+def image_size(block):
+    source = block.get("source", {})
+    return len(source.get("data", "")) if source.get("type") == "base64" else 0
+
+
+def _image_units(messages):
+    # Groups the image slots into what the model sees as one screenshot: all
+    # images of a tool_result (a full frame, or the crops of one delta) form
+    # a unit, an image placed directly in a user message is a unit of its own.
+    # Returns [(message index, [(container, index, block), ...])], newest first.
+    units = []
+    for position in reversed(range(len(messages))):
+        content = messages[position].get("content")
+        if not isinstance(content, list):
+            continue
+        for index in reversed(range(len(content))):
+            block = content[index]
+            if not isinstance(block, dict):
+                continue
+            if block.get("type") == "image":
+                units.append((position, [(content, index, block)]))
+            elif block.get("type") == "tool_result" and isinstance(block.get("content"), list):
+                inner = block["content"]
+                slots = [(inner, i, inner[i]) for i in range(len(inner))
+                         if isinstance(inner[i], dict) and inner[i].get("type") == "image"]
+                if slots:
+                    units.append((position, slots))
+    return units
+
+
+class ImageHistoryManager:
+    # Keeps the newest screenshots in the conversation and swaps older ones
+    # for a short text placeholder. max_images counts tool results with
+    # images, not image blocks, so a delta of several crops costs one slot
+    # like a full frame. Only image blocks themselves are replaced, so every
+    # tool_result stays in place and tool_use/tool_result pairing stays valid.
+    # Never evicted: the images of the newest user message (the model has not
+    # seen them yet) and delta_base, the full frame the scripts' delta crops
+    # are offsets into. Up to evict_batch - 1 screenshots beyond max_images
+    # are tolerated before they are evicted together (see EVICT_BATCH); the
+    # byte budget is always enforced right away.
+
+    def __init__(self, max_images=3, max_image_bytes=None, evict_batch=EVICT_BATCH):
+        self.max_images = max_images
+        self.max_image_bytes = max_image_bytes
+        self.evict_batch = max(evict_batch, 1)
+        self.delta_base = None
+        self.evicted_images = 0
+        self.evicted_bytes = 0
+        # Callbacks called with the list of evicted image blocks
+        self.on_evict = []
+
+    def evict(self, messages):
+        latest = max((i for i, m in enumerate(messages) if m.get("role") == "user"), default=None)
+        kept_units = 0
+        kept_bytes = 0
+        evicted_units = 0
+        forced = False
+        evictions = []
+        for position, slots in _image_units(messages):
+            size = sum(image_size(block) for _, _, block in slots)
+            protected = position == latest or any(block is self.delta_base for _, _, block in slots)
+            over_count = self.max_images is not None and kept_units >= self.max_images
+            over_bytes = self.max_image_bytes is not None and kept_bytes + size > self.max_image_bytes
+            if not protected and (over_count or over_bytes):
+                evictions.extend((container, index, image_size(block)) for container, index, block in slots)
+                evicted_units += 1
+                forced = forced or over_bytes
+            else:
+                kept_units += 1
+                kept_bytes += size
+        if evicted_units < self.evict_batch and not forced:
+            return 0
+
+        saved = 0
+        evicted_blocks = []
+        for container, index, size in evictions:
+            evicted_blocks.append(container[index])
+            container[index] = {"type": "text", "text": IMAGE_PLACEHOLDER}
+            saved += size
+        if evicted_blocks:
+            for callback in self.on_evict:
+                callback(evicted_blocks)
+
+        if evictions:
+            self.evicted_images += len(evictions)
+            self.evicted_bytes += saved
+            print(f"Evicted {len(evictions)} old image(s) from history, saved {saved} bytes ({self.evicted_bytes} bytes this session)")
+        return saved
+
+    def stable_message(self, messages):
+        # The last user message before any image the next evict() could
+        # replace. Everything up to it stays byte-identical until then, so a
+        # cache breakpoint there keeps hitting across steps and through the
+        # eviction itself. None when no image is evictable.
+        latest = max((i for i, m in enumerate(messages) if m.get("role") == "user"), default=None)
+        oldest = None
+        for position, slots in _image_units(messages):
+            if position != latest and not any(block is self.delta_base for _, _, block in slots):
+                oldest = position
+        if oldest is None:
+            return None
+        return next((messages[i] for i in reversed(range(oldest)) if messages[i].get("role") == "user"), None)
+
+
+# Estimated input tokens above which the history is compacted
+COMPACT_THRESHOLD = int(os.environ.get("COMPACT_TOKENS", 40000))
+
+# Rough token costs: text is about four characters per token, and a
+# full-size screenshot (about 1.1 MP at 750 pixels per token) about 1600
+CHARS_PER_TOKEN = 4
+IMAGE_TOKENS = 1600
+
+SUMMARY_HEADER = "Summary of earlier tasks in this session (details were removed to save space):"
+
+
+def estimate_tokens(content):
+    if isinstance(content, str):
+        return len(content) // CHARS_PER_TOKEN + 1
+    total = 0
+    for block in content or ():
+        kind = block_field(block, "type")
+        if kind == "text":
+            total += len(block_field(block, "text") or "") // CHARS_PER_TOKEN + 1
+        elif kind == "image":
+            total += IMAGE_TOKENS
+        elif kind == "tool_use":
+            total += (len(json.dumps(block_field(block, "input"))) + len(block_field(block, "name"))) // CHARS_PER_TOKEN + 8
+        elif kind == "tool_result":
+            total += estimate_tokens(block_field(block, "content")) + 8
+    return total
+
+
+def _is_task_start(message):
+    # A user message that is not a batch of tool results starts a new task
+    if message["role"] != "user":
+        return False
+    content = message["content"]
+    return isinstance(content, str) or not any(block_field(b, "type") == "tool_result" for b in content)
+
+
+def _message_text(message):
+    content = message["content"]
+    if isinstance(content, str):
+        return content
+    return " ".join(block_field(b, "text") or "" for b in content if block_field(b, "type") == "text")
+
+
+def _tool_calls(messages):
+    return [b for m in messages if m["role"] == "assistant" and not isinstance(m["content"], str)
+            for b in m["content"] if block_field(b, "type") == "tool_use"]
+
+
+def _describe_actions(messages):
+    counts = {}
+    for call in _tool_calls(messages):
+        name = block_field(call, "name")
+        counts[name] = counts.get(name, 0) + 1
+    return ", ".join(f"{name} x{count}" for name, count in counts.items()) or "no tools"
+
+
+def _shorten(text, limit):
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit - 3] + "..."
+
+
+def summarize_task(messages):
+    # One line per finished task: the instruction, the actions taken and the
+    # final answer. Built locally, so compaction costs no API call.
+    instruction = _shorten(_message_text(messages[0]), 200)
+    actions = _describe_actions(messages)
+    answers = [m for m in messages if m["role"] == "assistant" and _message_text(m).strip()]
+    outcome = _shorten(_message_text(answers[-1]), 300) if answers else "(no answer)"
+    return f"- {instruction} -> {actions}; answer: {outcome}"
+
+
+class HistoryCompactor:
+    # Keeps the estimated input size of the conversation under max_tokens.
+    # Finished tasks are folded into one summary message at the start of the
+    # history (a user/assistant pair, so roles keep alternating); if the
+    # current task alone is still too large, its oldest steps are dropped as
+    # whole tool_use/tool_result pairs. Estimates are cached per message and
+    # only recomputed for messages whose images were evicted since. The cache
+    # holds ids and counts for the messages of the last estimate only, and
+    # close() detaches from the history manager, which scripts share between
+    # sessions.
+
+    def __init__(self, history_manager, max_tokens=COMPACT_THRESHOLD, target_fraction=0.6, keep_steps=6, max_summary_lines=40):
+        self.history_manager = history_manager
+        self.max_tokens = max_tokens
+        self.target_tokens = int(max_tokens * target_fraction)
+        self.keep_steps = keep_steps
+        self.max_summary_lines = max_summary_lines
+        self.summary_lines = []
+        self.folded_tasks = 0
+        self.compactions = 0
+        self._summary = None
+        self._estimates = {}  # id(message) -> tokens
+        self._with_images = set()
+        history_manager.on_evict.append(self._images_evicted)
+
+    def reset(self):
+        # For a new conversation: forget the summary of the previous one
+        self.summary_lines = []
+        self.folded_tasks = 0
+        self._summary = None
+        self._estimates = {}
+        self._with_images = set()
+
+    def close(self):
+        if self._images_evicted in self.history_manager.on_evict:
+            self.history_manager.on_evict.remove(self._images_evicted)
+        self.reset()
+
+    def estimate(self, messages):
+        # Ids are only kept for messages that are in the history, so they
+        # cannot be reused by a new message while cached
+        total = 0
+        estimates = {}
+        for message in messages:
+            key = id(message)
+            tokens = self._estimates.get(key)
+            if tokens is None:
+                tokens = estimate_tokens(message["content"])
+                if not isinstance(message["content"], str) and any(True for _ in _iter_image_slots([message])):
+                    self._with_images.add(key)
+            estimates[key] = tokens
+            total += tokens
+        self._estimates = estimates
+        self._with_images &= estimates.keys()
+        return total
+
+    def _images_evicted(self, blocks):
+        # Placeholders replaced images in place; re-estimate those messages
+        for key in self._with_images:
+            self._estimates.pop(key, None)
+        self._with_images.clear()
+
+    def compact(self, messages):
+        # Compacts messages in place when needed; returns the estimated tokens saved
+        before = self.estimate(messages)
+        if before <= self.max_tokens:
+            return 0
+
+        start = 2 if self._summary is not None and messages and messages[0] is self._summary[0] else 0
+        task_starts = [i for i in range(start, len(messages)) if _is_task_start(messages[i])]
+        current = task_starts[-1] if task_starts else start
+        removed = []
+
+        if current > start:
+            bounds = [i for i in task_starts if i < current] + [current]
+            for begin, end in zip(bounds, bounds[1:]):
+                self.summary_lines.append(summarize_task(messages[begin:end]))
+                self.folded_tasks += 1
+            overflow = len(self.summary_lines) - self.max_summary_lines
+            if overflow > 0:
+                self.summary_lines = self.summary_lines[overflow:]
+            removed.extend(messages[:current])
+            messages[:current] = self._summary_pair()
+            current = 2
+
+        if self.estimate(messages) > self.target_tokens:
+            steps = (len(messages) - current - 1) // 2
+            drop = steps - self.keep_steps
+            if drop > 0:
+                dropped = messages[current + 1:current + 1 + 2 * drop]
+                removed.extend(dropped)
+                actions = _describe_actions(dropped)
+                task = messages[current]
+                content = [{"type": "text", "text": task["content"]}] if isinstance(task["content"], str) else list(task["content"])
+                content.append({"type": "text", "text": f"[{drop} earlier steps of this task were removed to save space. Actions taken: {actions}.]"})
+                messages[current:current + 1 + 2 * drop] = [dict(task, content=content)]
+
+        if not removed:
+            return 0
+        # Screenshots that left the history must not be referred to again
+        images = [block for _, _, block in _iter_image_slots(removed)]
+        if images:
+            for callback in self.history_manager.on_evict:
+                callback(images)
+        self.compactions += 1
+        after = self.estimate(messages)
+        print(f"Compacted history: about {before} -> {after} input tokens ({self.folded_tasks} tasks summarised this session)")
+        return before - after
+
+    def _summary_pair(self):
+        lines = self.summary_lines
+        header = SUMMARY_HEADER
+        if self.folded_tasks > len(lines):
+            header += f"\n({self.folded_tasks - len(lines)} older tasks are no longer listed.)"
+        self._summary = (
+            {"role": "user", "content": header + "\n" + "\n".join(lines)},
+            {"role": "assistant", "content": "Noted. I'll use this summary for context on earlier tasks."},
+        )
+        return list(self._summary)
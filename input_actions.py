@@ -0,0 +1,111 @@
+import os
+import sys
+import time
+
+from lazy_modules import lazy_import
+from tracing import tracer
+
+# pyautogui connects to the display on import, so it is loaded on first use
+pyautogui = lazy_import("pyautogui")
+
+
+CLICK_TYPES = ("single", "double", "right")
+
+# "instant" moves the cursor in one jump and bulk-inserts long text;
+# "animated" keeps the old human-like movement and per-key typing
+INPUT_MODE = os.environ.get("INPUT_MODE", "instant")
+
+ANIMATED_MOVE_DURATION = 2  # seconds
+ANIMATED_TYPE_INTERVAL = 0.1  # seconds between keystrokes
+
+# Text at least this long is pasted through the clipboard in instant mode
+PASTE_MIN_CHARS = 20
+
+PASTE_KEYS = ("command", "v") if sys.platform == "darwin" else ("ctrl", "v")
+
+
+class InputController:
+    # One place for all mouse and keyboard actuation. Every call returns the
+    # time it took, so tool results can report per-action latency.
+
+    def __init__(self, mode=INPUT_MODE, paste_min_chars=PASTE_MIN_CHARS, action_pause=0.01):
+        self.mode = mode
+        self.paste_min_chars = paste_min_chars
+        if mode == "instant":
+            # pyautogui sleeps 0.1 s after every call by default
+            pyautogui.PAUSE = action_pause
+
+    @property
+    def instant(self):
+        return self.mode == "instant"
+
+    def click(self, x, y, click="single", duration=None):
+        if click not in CLICK_TYPES:
+            raise ValueError(f"click must be one of {', '.join(CLICK_TYPES)}, not {click!r}")
+        if duration is None:
+            duration = 0 if self.instant else ANIMATED_MOVE_DURATION
+        start = time.perf_counter()
+        with tracer.span("input_actuation", action=f"{click}_click"):
+            pyautogui.moveTo(x, y, duration=duration)
+            if click == "double":
+                pyautogui.doubleClick()
+            elif click == "right":
+                pyautogui.rightClick()
+            else:
+                pyautogui.click()
+        return time.perf_counter() - start
+
+    def type(self, text, interval=None):
+        # An explicit interval always types key by key at that pace. Otherwise
+        # instant mode pastes long text and sends short text as one burst.
+        start = time.perf_counter()
+        with tracer.span("input_actuation", action="type_text", chars=len(text)) as span:
+            if interval is None and self.instant:
+                if len(text) >= self.paste_min_chars and self._paste(text):
+                    span["method"] = "paste"
+                else:
+                    span["method"] = "burst"
+                    pyautogui.write(text, interval=0)
+            else:
+                span["method"] = "keys"
+                pyautogui.write(text, interval=ANIMATED_TYPE_INTERVAL if interval is None else interval)
+        return time.perf_counter() - start
+
+    def hotkey(self, *keys):
+        start = time.perf_counter()
+        with tracer.span("input_actuation", action="hotkey"):
+            pyautogui.hotkey(*keys)
+        return time.perf_counter() - start
+
+    def scroll(self, amount, x=None, y=None):
+        start = time.perf_counter()
+        with tracer.span("input_actuation", action="scroll"):
+            pyautogui.scroll(amount, x=x, y=y)
+        return time.perf_counter() - start
+
+    def _paste(self, text):
+        # Returns False when no clipboard is available so the caller can fall
+        # back to typing. The previous clipboard content is restored.
+        try:
+            import pyperclip
+            previous = pyperclip.paste()
+            pyperclip.copy(text)
+        except Exception:
+            return False
+        try:
+            pyautogui.hotkey(*PASTE_KEYS)
+            # Give the target application a moment to read the clipboard
+            time.sleep(0.05)
+        finally:
+            try:
+                pyperclip.copy(previous)
+            except Exception:
+                pass
+        return True
+
+
+input_controller = InputController()
+
+
+def format_latency(seconds):
+    return f"{seconds * 1000:.0f} ms"
@@ -0,0 +1,87 @@
+import importlib
+import importlib.util
+import sys
+import threading
+import time
+import types
+
+
+# Heavy third-party modules (numpy, PIL, cv2, pyautogui, anthropic)
+# are imported on first use instead of at startup. pyautogui in particular
+# connects to the display as soon as it is imported.
+
+_lock = threading.RLock()
+
+# Module name -> LazyModule, for everything imported through lazy_import
+lazy = {}
+
+# Module name -> seconds its deferred import took
+load_times = {}
+
+
+class LazyModule(types.ModuleType):
+    # Stands in for a module until one of its attributes is used, then
+    # imports it (once, under a lock, so threads can race for it safely) and
+    # forwards to it. Attributes set before that are applied on import.
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        with _lock:
+            module = self.__dict__.get("_module")
+            if module is None:
+                self.__dict__.setdefault("_pending", {})[attr] = value
+                return
+        setattr(module, attr, value)
+
+    def __repr__(self):
+        state = "loaded" if self.loaded else "not loaded yet"
+        return f"<lazy module {self.__name__!r} ({state})>"
+
+    @property
+    def loaded(self):
+        return self.__dict__.get("_module") is not None
+
+    def _load(self):
+        module = self.__dict__.get("_module")
+        if module is not None:
+            return module
+        with _lock:
+            module = self.__dict__.get("_module")
+            if module is None:
+                started = time.perf_counter()
+                module = importlib.import_module(self.__name__)
+                load_times[self.__name__] = time.perf_counter() - started
+                for attr, value in self.__dict__.pop("_pending", {}).items():
+                    setattr(module, attr, value)
+                self.__dict__["_module"] = module
+        return module
+
+
+def lazy_import(name):
+    # Returns the module if it is already imported (or replaced, as bench.py
+    # does with pyautogui), else a LazyModule. A missing module still fails
+    # here, at import time, like a plain import would.
+    if name in sys.modules:
+        return sys.modules[name]
+    with _lock:
+        if name not in lazy:
+            if importlib.util.find_spec(name) is None:
+                raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+            lazy[name] = LazyModule(name)
+        return lazy[name]
+
+
+def load(name):
+    # Imports a lazily imported module now; returns the seconds it took
+    module = lazy.get(name)
+    if module is None or module.loaded:
+        return 0.0
+    module._load()
+    return load_times[name]
+
+
+def load_all():
+    # Imports every module registered so far; returns {name: seconds}
+    return {name: load(name) for name in list(lazy)}
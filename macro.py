@@ -0,0 +1,284 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+from agent_loop import SIDE_EFFECT_FREE_TOOLS
+from capture import capture_settled, last_settled_frame
+from frame_cache import frame_hash, hamming
+from tracing import tracer
+
+
+MACRO_DIR = os.environ.get("MACRO_DIR", "macros")
+
+# Set MACROS=1 to record runs and replay them for repeated instructions
+MACROS_ENABLED = os.environ.get("MACROS", "0") == "1"
+
+# Hash bits (of 1024) that may differ for a screen to still match a recorded
+# step; leaves room for a clock, a blinking caret or a notification badge
+MATCH_DISTANCE = 40
+
+# A macro that diverges this many times in a row is dropped
+MAX_FAILURES = 3
+
+# Tools report problems the model can work around (an unknown element ID, a
+# run_actions step that raised) as their result text instead of raising
+FAILED_RESULT_PREFIXES = ("Unknown ", "Take a screenshot first")
+FAILED_STEP_MARKER = ": FAILED ("
+
+
+def normalize_instruction(text):
+    return re.sub(r"\s+", " ", text.strip().lower()).rstrip(".!")
+
+
+def instruction_key(text):
+    return hashlib.sha1(normalize_instruction(text).encode("utf-8")).hexdigest()[:16]
+
+
+def screen_fingerprint():
+    screenshot, _ = capture_settled()
+    return frame_hash(screenshot)
+
+
+def result_failed(result):
+    # Whether a tool result (a string or a list of content blocks) reports
+    # an error
+    if isinstance(result, list):
+        result = "\n".join(block.get("text", "") for block in result if block.get("type") == "text")
+    return isinstance(result, str) and (result.startswith(FAILED_RESULT_PREFIXES) or FAILED_STEP_MARKER in result)
+
+
+class MacroRecorder:
+    # Stands in for execute_tool during a chat run and records every action
+    # tool call with the fingerprint of the screen it was made on. Tools that
+    # only look at the screen are passed through unrecorded. A run with any
+    # failed action is marked failed and is not worth saving.
+
+    def __init__(self, execute_tool, normalize=None):
+        self.execute_tool = execute_tool
+        # normalize(tool_name, tool_input) -> (tool_name, tool_input) rewrites
+        # calls that would not mean the same thing in a later session
+        self.normalize = normalize
+        self.steps = []
+        self.failed = False
+        self._last_action = time.perf_counter()
+
+    def __call__(self, tool_name, tool_input):
+        if tool_name in SIDE_EFFECT_FREE_TOOLS:
+            return self.execute_tool(tool_name, tool_input)
+        fingerprint = self._fingerprint()
+        name, recorded_input = self.normalize(tool_name, tool_input) if self.normalize else (tool_name, tool_input)
+        if name == "run_actions":
+            # Replays never show the model a screenshot
+            recorded_input = dict(recorded_input, screenshot=False)
+        try:
+            result = self.execute_tool(tool_name, tool_input)
+        except Exception:
+            self.failed = True
+            raise
+        finally:
+            self._last_action = time.perf_counter()
+        if result_failed(result):
+            self.failed = True
+        self.steps.append({"fingerprint": f"{fingerprint:x}", "tool": name, "input": recorded_input})
+        return result
+
+    def _fingerprint(self):
+        # The screenshot the model acted on (or the frame prefetched after the
+        # previous action) already shows this screen; only capture when no
+        # frame was settled since the previous action
+        frame = last_settled_frame(self._last_action)
+        return frame_hash(frame) if frame is not None else screen_fingerprint()
+
+
+class MacroStore:
+    # On-disk macros: one JSON file per macro plus index.json, which maps the
+    # normalised instruction to its macros and the fingerprint of the first
+    # step, so a lookup reads only the index and the one macro that matches.
+
+    def __init__(self, directory=MACRO_DIR, match_distance=MATCH_DISTANCE, max_failures=MAX_FAILURES):
+        self.directory = directory
+        self.match_distance = match_distance
+        self.max_failures = max_failures
+        self._index = None
+        self._lock = threading.Lock()
+
+    @property
+    def index_path(self):
+        return os.path.join(self.directory, "index.json")
+
+    def _load_index(self):
+        if self._index is None:
+            try:
+                with open(self.index_path) as f:
+                    self._index = json.load(f)
+            except (OSError, ValueError):
+                self._index = {}
+        return self._index
+
+    def _save_index(self):
+        os.makedirs(self.directory, exist_ok=True)
+        temporary = self.index_path + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump(self._index, f, indent=1)
+        os.replace(temporary, self.index_path)
+
+    def _macro_path(self, macro_id):
+        return os.path.join(self.directory, f"{macro_id}.json")
+
+    def find(self, instruction, fingerprint):
+        # The most reliable macro for this instruction whose first step was
+        # recorded on a matching screen, or None
+        with self._lock:
+            entries = self._load_index().get(instruction_key(instruction), [])
+            candidates = [e for e in entries if hamming(fingerprint, int(e["first"], 16)) <= self.match_distance]
+            if not candidates:
+                return None
+            entry = max(candidates, key=lambda e: (e["replays"] - e["failures"], e["created"]))
+            try:
+                with open(self._macro_path(entry["id"])) as f:
+                    return json.load(f)
+            except (OSError, ValueError):
+                self._remove(entry["id"])
+                self._save_index()
+                return None
+
+    def save(self, instruction, steps, response):
+        if not steps:
+            return None
+        key = instruction_key(instruction)
+        macro_id = f"{key}-{int(time.time() * 1000)}"
+        macro = {"id": macro_id, "instruction": instruction, "steps": steps, "response": response}
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self._macro_path(macro_id), "w") as f:
+                json.dump(macro, f)
+            # A new recording from the same starting screen supersedes the old one
+            first = int(steps[0]["fingerprint"], 16)
+            for entry in list(self._load_index().get(key, [])):
+                if hamming(first, int(entry["first"], 16)) <= self.match_distance:
+                    self._remove(entry["id"])
+            self._index.setdefault(key, []).append({
+                "id": macro_id,
+                "instruction": normalize_instruction(instruction),
+                "first": steps[0]["fingerprint"],
+                "steps": len(steps),
+                "created": time.time(),
+                "replays": 0,
+                "failures": 0,
+            })
+            self._save_index()
+        return macro_id
+
+    def record_outcome(self, macro_id, completed):
+        with self._lock:
+            for entries in self._load_index().values():
+                for entry in entries:
+                    if entry["id"] != macro_id:
+                        continue
+                    if completed:
+                        entry["replays"] += 1
+                        entry["failures"] = 0
+                    else:
+                        entry["failures"] += 1
+                        if entry["failures"] >= self.max_failures:
+                            self._remove(macro_id)
+                    self._save_index()
+                    return
+
+    def invalidate(self, instruction=None):
+        # Drops the macros for one instruction, or all of them. Returns the
+        # number of macros removed.
+        with self._lock:
+            index = self._load_index()
+            keys = [instruction_key(instruction)] if instruction is not None else list(index)
+            removed = 0
+            for key in keys:
+                for entry in list(index.get(key, [])):
+                    self._remove(entry["id"])
+                    removed += 1
+            self._save_index()
+            return removed
+
+    def entries(self):
+        with self._lock:
+            return [entry for entries in self._load_index().values() for entry in entries]
+
+    def _remove(self, macro_id):
+        for key, entries in list(self._index.items()):
+            self._index[key] = [e for e in entries if e["id"] != macro_id]
+            if not self._index[key]:
+                del self._index[key]
+        try:
+            os.remove(self._macro_path(macro_id))
+        except OSError:
+            pass
+
+    def replay(self, instruction, execute_tool):
+        # Replays a recorded macro for the instruction while the screen keeps
+        # matching the recording. Returns None when there is no macro for the
+        # current screen, otherwise a dict with the steps that ran, whether
+        # the whole macro completed, and a note for the model if it did not.
+        macro = self.find(instruction, screen_fingerprint())
+        if macro is None:
+            return None
+
+        done = []
+        reason = None
+        with tracer.span("macro_replay", macro=macro["id"], steps=len(macro["steps"])) as span:
+            for number, step in enumerate(macro["steps"], 1):
+                fingerprint = screen_fingerprint() if number > 1 else int(step["fingerprint"], 16)
+                distance = hamming(fingerprint, int(step["fingerprint"], 16))
+                if distance > self.match_distance:
+                    reason = f"the screen before step {number} did not match the recording"
+                    break
+                try:
+                    result = execute_tool(step["tool"], step["input"])
+                except Exception as e:
+                    reason = f"step {number} failed ({type(e).__name__}: {str(e)})"
+                    break
+                if result_failed(result):
+                    reason = f"step {number} reported an error"
+                    break
+                done.append(step)
+            span["replayed"] = len(done)
+
+        completed = reason is None
+        self.record_outcome(macro["id"], completed)
+        print(f"Replayed {len(done)} of {len(macro['steps'])} recorded steps" + ("" if completed else f"; stopped: {reason}"))
+
+        note = None
+        if not completed:
+            performed = "\n".join(f"- {step['tool']} {json.dumps(step['input'])}" for step in done) or "- (none)"
+            note = (f"A recorded macro for this task was replayed but stopped because {reason}. "
+                    f"These steps were already performed:\n{performed}\n"
+                    "Take a screenshot and continue the task from the current screen.")
+        return {"steps": done, "completed": completed, "response": macro["response"], "note": note}
+
+
+macro_store = MacroStore()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and invalidate recorded macros")
+    parser.add_argument("command", choices=("list", "forget", "clear"))
+    parser.add_argument("instruction", nargs="?", help="Instruction whose macros to forget")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        for entry in macro_store.entries():
+            print(f"{entry['id']}  {entry['steps']} steps, {entry['replays']} replays, "
+                  f"{entry['failures']} failures  {entry['instruction']}")
+    elif args.command == "forget":
+        if not args.instruction:
+            parser.error("forget needs the instruction")
+        print(f"Removed {macro_store.invalidate(args.instruction)} macro(s)")
+    else:
+        print(f"Removed {macro_store.invalidate()} macro(s)")
+
+
+if __name__ == "__main__":
+    main()
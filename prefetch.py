@@ -0,0 +1,95 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from capture import CaptureCancelled, frame_matches_screen
+
+
+# A prefetched frame older than this is never used, even if the screen
+# still looks the same
+PREFETCH_MAX_AGE = 10.0  # seconds
+
+
+class ScreenshotPrefetcher:
+    # Starts capturing (and whatever else prepare() does) in the background as
+    # soon as an input action finishes, while the model is still deciding what
+    # to do next. take() hands the result to the next screenshot if no tile
+    # of the screen changed since; otherwise the caller captures (and waits
+    # for the screen to settle) as usual.
+
+    def __init__(self, prepare, max_age=PREFETCH_MAX_AGE):
+        # prepare(cancelled) -> dict with at least "screenshot" (the captured
+        # frame). cancelled() turns true once the prefetch is outdated;
+        # prepare should then stop, e.g. by passing it to capture_settled.
+        self.prepare = prepare
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self._generation = 0
+        self._pending = None  # (generation, started_at, future)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+
+    def start(self):
+        with self._lock:
+            self._drop_pending()
+            self._generation += 1
+            generation = self._generation
+            self._pending = (generation, time.monotonic(), self._executor.submit(self._run, generation))
+
+    def cancel(self):
+        # Called before an input action: whatever is in flight will be outdated
+        with self._lock:
+            self._generation += 1
+            self._drop_pending()
+
+    def _drop_pending(self):
+        # A queued prefetch never starts; a running one stops at its next
+        # check of the generation, so stale captures neither hold up the
+        # one worker nor keep polling the screen during the next action
+        if self._pending is not None:
+            self._pending[2].cancel()
+            self._pending = None
+
+    def _run(self, generation):
+        def cancelled():
+            return self._generation != generation
+
+        if cancelled():
+            return None
+        try:
+            return self.prepare(cancelled)
+        except CaptureCancelled:
+            return None
+
+    def take(self):
+        # Returns the prefetched dict, or None on a miss or a stale frame. A
+        # prefetch is used at most once.
+        with self._lock:
+            pending, self._pending = self._pending, None
+            if pending is None or pending[0] != self._generation:
+                self.misses += 1
+                return None
+        _, started_at, future = pending
+        try:
+            prepared = future.result()
+        except Exception as e:
+            print(f"Screenshot prefetch failed: {str(e)}")
+            prepared = None
+        if prepared is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        fresh = time.monotonic() - started_at <= self.max_age and frame_matches_screen(prepared["screenshot"])
+        with self._lock:
+            if fresh:
+                self.hits += 1
+            else:
+                self.stale += 1
+        return prepared if fresh else None
+
+    def stats(self):
+        total = self.hits + self.misses + self.stale
+        rate = self.hits / total if total else 0.0
+        return f"Screenshot prefetch: {self.hits} hits, {self.misses} misses, {self.stale} stale ({rate:.0%} hit rate)"
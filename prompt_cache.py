@@ -0,0 +1,80 @@
+CACHE_CONTROL = {"type": "ephemeral"}
+
+# The API allows four cache breakpoints per request: one on the system prompt,
+# one on the tool definitions and the rest slide along the message history.
+HISTORY_BREAKPOINTS = 2
+
+
+def cached_system(system_prompt):
+    return [{"type": "text", "text": system_prompt, "cache_control": CACHE_CONTROL}]
+
+
+def cached_tools(tools):
+    # Tools are hashed as one prefix, so marking the last definition caches all of them
+    if not tools:
+        return tools
+    return tools[:-1] + [dict(tools[-1], cache_control=CACHE_CONTROL)]
+
+
+def _mark_last_block(message):
+    content = message["content"]
+    if isinstance(content, str):
+        content = [{"type": "text", "text": content}]
+    else:
+        content = list(content)
+    if not content or not isinstance(content[-1], dict):
+        return None
+    content[-1] = dict(content[-1], cache_control=CACHE_CONTROL)
+    return dict(message, content=content)
+
+
+def with_history_breakpoints(messages, breakpoints=HISTORY_BREAKPOINTS, stable=None):
+    # Returns a shallow copy of the history with cache breakpoints on the last
+    # few user messages. The stored history is never modified, so breakpoints
+    # do not pile up as the conversation grows. Each request then reads the
+    # prefix written by the previous one and writes a slightly longer one.
+    # stable is a message known not to change for a while (see
+    # ImageHistoryManager.stable_message); it takes the second breakpoint, so
+    # the prefix up to it is still read when an eviction rewrites what follows.
+    messages = list(messages)
+    users = [i for i in reversed(range(len(messages))) if messages[i]["role"] == "user"]
+    if stable is not None:
+        users = users[:1] + [i for i in users[1:] if messages[i] is stable] + [i for i in users[1:] if messages[i] is not stable]
+    placed = 0
+    for i in users:
+        if placed >= breakpoints:
+            break
+        marked = _mark_last_block(messages[i])
+        if marked is not None:
+            messages[i] = marked
+            placed += 1
+    return messages
+
+
+class CacheStats:
+    # Accumulates prompt cache hits and misses from response.usage
+
+    def __init__(self):
+        self.calls = 0
+        self.hits = 0
+        self.misses = 0
+        self.cache_read_tokens = 0
+        self.cache_write_tokens = 0
+        self.uncached_tokens = 0
+
+    def record(self, usage):
+        if usage is None:
+            return
+        read = getattr(usage, "cache_read_input_tokens", None) or 0
+        written = getattr(usage, "cache_creation_input_tokens", None) or 0
+        self.calls += 1
+        if read:
+            self.hits += 1
+        else:
+            self.misses += 1
+        self.cache_read_tokens += read
+        self.cache_write_tokens += written
+        uncached = getattr(usage, "input_tokens", 0) or 0
+        self.uncached_tokens += uncached
+        print(f"Prompt cache: read {read}, written {written}, uncached {uncached} input tokens "
+              f"({self.hits} hits / {self.misses} misses this session)")
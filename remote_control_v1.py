@@ -1,15 +1,35 @@
-from anthropic import Anthropic
+import asyncio
 import os
-from datetime import datetime
-from PIL import Image
+import sys
 import io
-import pyautogui
 import base64
 from colorama import init, Fore, Style
-import tempfile
-
-
-client = Anthropic(api_key=os.environ.get("API_KEY"))
+from capture import capture_settled, describe_settle
+from screenshot_pipeline import default_encoder, encode_screenshot, region_encoder
+from frame_diff import FrameDiffer
+from frame_cache import FrameCache
+from prefetch import ScreenshotPrefetcher
+from history import ImageHistoryManager
+from agent_loop import response_text
+from agent_core import AgentSession, ainput
+from api_client import create_client
+from tracing import tracer
+from action_sequence import RUN_ACTIONS_TOOL, run_action_sequence
+from zoom import ZOOM_REGION_TOOL, zoom_region
+from input_actions import CLICK_TYPES, format_latency, input_controller
+from macro import MACROS_ENABLED, MacroRecorder, macro_store
+from lazy_modules import lazy_import
+from startup import profile_startup
+from session_trace import SessionRecorder
+import daemon
+
+# Loaded on first use; pyautogui connects to the display when imported
+Image = lazy_import("PIL.Image")
+pyautogui = lazy_import("pyautogui")
+
+
+# Pooled connections, pacing and retries on 429/5xx; shared by all sessions
+client = create_client(api_key=os.environ.get("API_KEY"))
 
 # Initialize colorama
 init()
@@ -24,7 +44,15 @@ RESULT_COLOR = Fore.GREEN
 def print_colored(text, color):
     print(f"{color}{text}{Style.RESET_ALL}")
 
-conversation_history = []
+# Only the newest screenshots are re-sent; older ones become text placeholders
+history_manager = ImageHistoryManager(max_images=3)
+
+# Screens identical to a screenshot still in the history are not sent again
+frame_cache = FrameCache()
+history_manager.on_evict.append(frame_cache.forget_blocks)
+
+# Stream responses and start each tool as soon as its tool_use block is complete
+STREAM_RESPONSES = True
 
 system_prompt = '''
 You are Claude, an AI assistant that takes instructions from the user. 
@@ -50,15 +78,28 @@ You can do three operations
 #     except Exception as e:
 #         return f"Error encoding image: {str(e)}"
 
-from PIL import ImageGrab
-import io
-import os
-from datetime import datetime
-import base64
+# Remembers the last frame sent so later screenshots can send only what changed
+frame_differ = FrameDiffer()
+
+def forget_delta_base(blocks):
+    # Delta crops are offsets into the last full frame, which history eviction
+    # keeps; if compaction removes it anyway, the next screenshot is sent whole
+    if any(block is history_manager.delta_base for block in blocks):
+        history_manager.delta_base = None
+        frame_differ.reset()
+
+history_manager.on_evict.append(forget_delta_base)
 
-def take_screenshot(tool_id):
-    # Take a screenshot using PIL
-    screenshot = ImageGrab.grab()
+# Size of the last full screenshot sent to the model, used to map its coordinates back to the screen
+screenshot_size = None
+
+def capture_for_model(cancelled=None):
+    # Wait for animations and page loads to finish, then capture through the
+    # configured backend. cancelled is the prefetcher's check for an outdated
+    # capture.
+    with tracer.span("capture") as span:
+        screenshot, settle = capture_settled(cancelled=cancelled)
+        span.update(settle)
     
     # Define the maximum size
     max_size = 1568
@@ -78,42 +119,114 @@ def take_screenshot(tool_id):
         new_height = int(height * scale)
         
         # Resize the image
-        resized_screenshot = screenshot.resize((new_width, new_height), Image.LANCZOS)
+        with tracer.span("resize"):
+            resized_screenshot = screenshot.resize((new_width, new_height), Image.LANCZOS)
+    
+    return {"screenshot": screenshot, "resized": resized_screenshot, "settle": settle}
+
+def prefetch_screenshot(cancelled):
+    # Runs in the background after each input action: capture, resize and a
+    # speculative full-frame encode, ready for the screenshot the model is
+    # most likely to ask for next
+    prepared = capture_for_model(cancelled)
+    with tracer.span("encode", prefetch=True):
+        prepared["encoded"] = default_encoder.encode(prepared["resized"])
+    return prepared
+
+screenshot_prefetcher = ScreenshotPrefetcher(prefetch_screenshot)
+
+def take_screenshot(tool_id, full_frame=False):
+    # A frame prefetched after the last input action is used while the screen
+    # still matches it; otherwise capture now
+    prepared = screenshot_prefetcher.take() or capture_for_model()
+    screenshot, resized_screenshot, settle = prepared["screenshot"], prepared["resized"], prepared["settle"]
+    width, height = screenshot.size
     
-    # Create a directory to store screenshots if it doesn't exist
-    screenshot_dir = os.path.join(os.path.expanduser("~"), "Desktop", "Screenshots")
-    os.makedirs(screenshot_dir, exist_ok=True)
+    global screenshot_size
     
-    # Generate a unique filename based on the current timestamp
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"screenshot_{timestamp}.jpg"
-    filepath = os.path.join(screenshot_dir, filename)
+    # Point at an earlier screenshot of the same screen instead of re-sending it
+    cached, frame_key = frame_cache.lookup(resized_screenshot)
+    if cached is not None and not full_frame:
+        number, screenshot_size, block = cached
+        history_manager.delta_base = block
+        frame_differ.rebase(resized_screenshot)
+        print(f"Screen matches screenshot #{number}; not sending it again")
+        return [
+            {"type": "text", "text": f"Screen is unchanged from screenshot #{number}, which is still in the conversation above; no new image was sent."},
+            {"type": "text", "text": describe_settle(settle)}
+        ]
     
-    # Save the resized screenshot as JPEG
-    resized_screenshot = resized_screenshot.convert('RGB')  # Convert to RGB mode for JPEG
-    resized_screenshot.save(filepath, format='JPEG', quality=95)  # Save as JPEG with high quality
+    # Only send the changed regions when the change since the last frame is small
+    if full_frame:
+        frame_differ.reset()
+    boxes = frame_differ.diff(resized_screenshot)
+    if boxes is not None:
+        return delta_tool_result(resized_screenshot, boxes) + [{"type": "text", "text": describe_settle(settle)}]
     
-    # Encode the image to base64
-    with io.BytesIO() as buffer:
-        resized_screenshot.save(buffer, format="JPEG")
-        image_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
+    # Encode once to fit the payload budget; the same bytes go to the archive
+    # (written in the background) and into the API payload
+    encoded = encode_screenshot(resized_screenshot, encoded=prepared.get("encoded"))
+    
+    # The encoder may shrink the frame further; clicks are mapped from the size actually sent
+    screenshot_size = encoded["size"]
+    
+    image_block = {
+        "type": "image",
+        "source": {
+            "type": "base64",
+            "media_type": encoded["media_type"],
+            "data": encoded["data"]
+        }
+    }
+    number = frame_cache.add(frame_key, image_block, encoded["size"])
+    history_manager.delta_base = image_block
     
     tool_result_message = [
         {
             "type": "text",
-            "text": f"Screenshot captured {filename}. Original size: {width}x{height}, Resized to: {resized_screenshot.size[0]}x{resized_screenshot.size[1]}"
+            "text": f"Screenshot #{number} captured {encoded['filename']}. Original size: {width}x{height}, Resized to: {encoded['size'][0]}x{encoded['size'][1]}"
         },
+        image_block
+    ]
+    
+    print(f"Resized screenshot queued for: {encoded['filepath']}")
+    
+    tool_result_message.append({"type": "text", "text": describe_settle(settle)})
+    
+    return tool_result_message
+
+def delta_tool_result(screenshot, boxes):
+    if not boxes:
+        return [{"type": "text", "text": "Screen unchanged since the previous screenshot."}]
+    
+    tool_result_message = [
         {
+            "type": "text",
+            "text": f"Only {len(boxes)} region(s) changed since the previous screenshot. Each crop below is labelled with its offset in the previous full screenshot; add the offset to positions inside a crop to get screenshot coordinates."
+        }
+    ]
+    # Crops are scaled like the last full screenshot so offsets use the same coordinates
+    scale = screenshot_size[0] / screenshot.size[0] if screenshot_size is not None else 1.0
+    for box in boxes:
+        left, top, right, bottom = [int(v * scale) for v in box]
+        crop = screenshot.crop(box)
+        if scale != 1.0:
+            crop = crop.resize((max(right - left, 1), max(bottom - top, 1)), Image.LANCZOS)
+        encoded = encode_screenshot(crop, prefix="screenshot_delta", encoder=region_encoder)
+        tool_result_message.append({
+            "type": "text",
+            "text": f"Region at offset ({left}, {top}), size {right - left}x{bottom - top}"
+        })
+        tool_result_message.append({
             "type": "image",
             "source": {
                 "type": "base64",
-                "media_type": "image/jpeg",
-                "data": image_base64
+                "media_type": encoded["media_type"],
+                "data": encoded["data"]
             }
-        }
-    ]
+        })
     
-    print(f"Resized screenshot saved to: {filepath}")
+    print(f"Sent {len(boxes)} changed region(s) instead of a full screenshot")
     
     return tool_result_message
 
@@ -132,20 +245,46 @@ def encode_image_to_base64(image_path):
 
 
 
-def move_and_click(x, y, duration=2):
-    # Hard-coded scaling factor (adjust this based on your typical screenshot size)
-    scale_factor = 1.1  # This is an example value, adjust as needed
+def to_screen(x, y):
+    # Map screenshot coordinates back to screen coordinates. Before the first
+    # screenshot fall back to the hard-coded factor.
+    if screenshot_size is not None:
+        scale_factor = pyautogui.size()[0] / screenshot_size[0]
+    else:
+        scale_factor = 1.1  # This is an example value, adjust as needed
     
-    scaled_x = int(x * scale_factor)
-    scaled_y = int(y * scale_factor)
+    return int(x * scale_factor), int(y * scale_factor)
+
+def screen_position(x, y):
+    # For coordinates that are already on the screen
+    return int(x), int(y)
+
+def move_and_click(x, y, duration=None, click="single", mapping=to_screen):
+    scaled_x, scaled_y = mapping(x, y)
     
-    pyautogui.moveTo(scaled_x, scaled_y, duration=duration)
-    pyautogui.doubleClick()
-    return f"Moved to scaled coordinates ({scaled_x}, {scaled_y}) and clicked"
+    elapsed = input_controller.click(scaled_x, scaled_y, click, duration)
+    return f"Moved to scaled coordinates ({scaled_x}, {scaled_y}) and {click}-clicked in {format_latency(elapsed)}"
 
-def type_text(text, interval=0.1):
-    pyautogui.write(text, interval=interval)
-    return f"Typed: {text}"
+def macro_step(tool_name, tool_input):
+    # Screenshot coordinates depend on the size of the last screenshot, which
+    # a later session does not have before its first one; record the screen
+    # position instead and mark the call so execute_tool does not rescale it
+    if tool_name == "move_and_click":
+        x, y = to_screen(tool_input["x"], tool_input["y"])
+        return tool_name, dict(tool_input, x=x, y=y, coordinates="screen")
+    if tool_name == "run_actions":
+        actions = []
+        for step in tool_input["actions"]:
+            if "x" in step and "y" in step:
+                x, y = to_screen(step["x"], step["y"])
+                step = dict(step, x=x, y=y)
+            actions.append(step)
+        return tool_name, dict(tool_input, actions=actions, coordinates="screen")
+    return tool_name, tool_input
+
+def type_text(text, interval=None):
+    elapsed = input_controller.type(text, interval)
+    return f"Typed: {text} (took {format_latency(elapsed)})"
 
 tools = [
     {
@@ -164,7 +303,12 @@ tools = [
                 },
                 "duration": {
                     "type": "number",
-                    "description": "The duration of the movement in seconds (optional, default: 2)"
+                    "description": "The duration of the movement in seconds (optional, default: instant)"
+                },
+                "click": {
+                    "type": "string",
+                    "enum": list(CLICK_TYPES),
+                    "description": "Which click to perform (optional, default: single). Use double to open files or icons and right for context menus."
                 }
             },
             "required": ["x", "y"]
@@ -172,7 +316,7 @@ tools = [
     },
     {
         "name": "type_text",
-        "description": "Type the specified text with an optional interval between keystrokes.",
+        "description": "Type the specified text. By default the text is inserted at once; give an interval to type key by key.",
         "input_schema": {
             "type": "object",
             "properties": {
@@ -182,21 +326,27 @@ tools = [
                 },
                 "interval": {
                     "type": "number",
-                    "description": "The interval between keystrokes in seconds (optional, default: 0.1)"
+                    "description": "The interval between keystrokes in seconds (optional). Leave it out to insert the text at once."
                 }
             },
             "required": ["text"]
         }
     },
+    RUN_ACTIONS_TOOL,
+    ZOOM_REGION_TOOL,
         {
         "name": "take_screenshot",
-        "description": "Take a screenshot of the current screen and return both the file path and the image data for analysis. Send to claude before doing executing other tools",
+        "description": "Take a screenshot of the current screen and return both the file path and the image data for analysis. Send to claude before doing executing other tools. If only a small part of the screen changed since the previous screenshot, only the changed regions are returned together with their offsets.",
         "input_schema": {
             "type": "object",
               "properties": {
                 "tool_id": {
                     "type": "string",
                     "description": "tool id"
+                },
+                "full_frame": {
+                    "type": "boolean",
+                    "description": "Send the whole screen even if only a small part changed since the previous screenshot (optional, default: false)"
                 }
             },
             "required": ["tool_id"]
@@ -206,128 +356,132 @@ tools = [
 
 
 def execute_tool(tool_name, tool_input):
-    if tool_name == "move_and_click":
-        return move_and_click(tool_input["x"], tool_input["y"], tool_input.get("duration", 4))
-    elif tool_name == "type_text":
-        return type_text(tool_input["text"], tool_input.get("interval", 0.1))
-    elif tool_name == "take_screenshot":
-        return take_screenshot(tool_input["tool_id"])
-    else:
-        return f"Unknown tool: {tool_name}"
-
-
-def chat_with_claude(user_input, image_path=None):
-    global conversation_history
-
-    print(f"\n{'='*50}\nUser Message: {user_input}\n{'='*50}")
-
-    conversation_history.append({"role": "user", "content": user_input})
+    if tool_name == "take_screenshot":
+        return take_screenshot(tool_input["tool_id"], tool_input.get("full_frame", False))
+    if tool_name == "zoom_region":
+        if screenshot_size is None:
+            return "Take a screenshot first; zoom_region uses its coordinates."
+        return zoom_region((tool_input["left"], tool_input["top"], tool_input["right"], tool_input["bottom"]), screenshot_size)
     
-    messages = [msg for msg in conversation_history if msg.get('content')]
-
+    # Input changes the screen: drop any prefetched frame now and start
+    # capturing the next one as soon as the action is done
+    screenshot_prefetcher.cancel()
+    # Replayed macro steps carry screen coordinates (see macro_step)
+    mapping = screen_position if tool_input.get("coordinates") == "screen" else to_screen
     try:
-        response = client.messages.create(
-            model="claude-3-5-sonnet-20240620",
-            max_tokens=4000,
-            system=system_prompt,
-            messages=messages,
-            tools=tools,
-            tool_choice={"type": "auto"}
-        )
-    except Exception as e:
-        print(f"Error calling Claude API: {str(e)}")
-        return "I'm sorry, there was an error communicating with the AI. Please try again."
-
-    print(f"\nInitial Response:")
-    print(f"Stop Reason: {response.stop_reason}")
-    print(f"Content: {response.content}")
-
-    assistant_response = ""
-
-    while response.stop_reason == "tool_use":
-        tool_use = next(block for block in response.content if block.type == "tool_use")
-        tool_name = tool_use.name
-        tool_input = tool_use.input
-        tool_use_id = tool_use.id
+        if tool_name == "move_and_click":
+            return move_and_click(tool_input["x"], tool_input["y"], tool_input.get("duration"), tool_input.get("click", "single"), mapping)
+        elif tool_name == "type_text":
+            return type_text(tool_input["text"], tool_input.get("interval"))
+        elif tool_name == "run_actions":
+            return run_action_sequence(
+                tool_input["actions"],
+                mapping,
+                take_screenshot=lambda: take_screenshot("run_actions"),
+                screenshot=tool_input.get("screenshot", False)
+            )
+        else:
+            return f"Unknown tool: {tool_name}"
+    finally:
+        screenshot_prefetcher.start()
 
-        print(f"\nTool Used: {tool_name}")
-        # print(f"Tool Input:")
-        # print(json.dumps(tool_input, indent=2))
 
-        result = execute_tool(tool_name, tool_input)
+def reset_screen_state():
+    # Forget what earlier conversations were shown, before starting a new one
+    screenshot_prefetcher.cancel()
+    frame_differ.reset()
+    history_manager.delta_base = None
+    frame_cache.clear()
 
-        # print(f"\nTool Result:")
-        # print(json.dumps(result, indent=2))
-        print(f"\n", tool_use)
 
-        conversation_history.append({"role": "assistant", "content": [tool_use]})
-        conversation_history.append({
-            "role": "user",
-            "content": [
-                {
-                    "type": "tool_result",
-                    "tool_use_id": tool_use_id,
-                    "content": result
-                }
-            ]
-        })
+# The conversation lives in the session; the REPL below is a thin front end
+session = AgentSession(client, system_prompt, tools, execute_tool, history_manager=history_manager, stream=STREAM_RESPONSES)
 
-        try:
-            response = client.messages.create(
-                model="claude-3-5-sonnet-20240620",
-                max_tokens=4000,
-                system=system_prompt,
-                messages=[msg for msg in conversation_history if msg.get('content')],
-                tools=tools,
-                tool_choice={"type": "auto"}
-            )
+# RECORD_SESSION=<directory> records the session for offline replay with session_trace.py
+recorder = SessionRecorder.from_env(session, script=__file__)
 
-            # print(f"\nResponse:")
-            # print(f"Stop Reason: {response.stop_reason}")
-            print(f"Content: {response.content}")
 
-        except Exception as e:
-            print(f"Error in tool response: {str(e)}")
-            assistant_response += "\nI encountered an error while processing the tool result. Please try again."
-            break
-
-    final_response = next(
-        (block.text for block in response.content if hasattr(block, "text")),
-        None,
-    )
+async def chat_with_claude(user_input, image_path=None):
+    print(f"\n{'='*50}\nUser Message: {user_input}\n{'='*50}")
 
-    if final_response:
-        assistant_response += final_response
-        conversation_history.append({"role": "assistant", "content": final_response})
+    # Replay a recorded run of the same instruction while the screen matches
+    # it; the model only takes over where the screen diverges. Macros bypass
+    # the model, so they are off while a session is recorded or replayed.
+    instruction = user_input
+    run_tool = execute_tool
+    if MACROS_ENABLED and session.recorder is None:
+        run_tool = MacroRecorder(execute_tool, normalize=macro_step)
+        replay = await asyncio.to_thread(macro_store.replay, instruction, execute_tool)
+        if replay is not None:
+            run_tool.steps.extend(replay["steps"])
+            if replay["completed"]:
+                session.messages.append({"role": "user", "content": instruction})
+                session.messages.append({"role": "assistant", "content": replay["response"]})
+                print(f"\nFinal Response (replayed): {replay['response']}")
+                return replay["response"]
+            user_input = f"{user_input}\n\n{replay['note']}"
+
+    # Run every tool call of each response and send all results back together,
+    # until the model stops asking for tools
+    try:
+        response = await session.send(user_input, run_tool)
+    except Exception as e:
+        print(f"Error calling Claude API: {str(e)}")
+        return "I'm sorry, there was an error communicating with the AI. Please try again."
 
+    assistant_response = response_text(response.content)
     print(f"\nFinal Response: {assistant_response}")
 
+    if MACROS_ENABLED and session.recorder is None and not run_tool.failed:
+        macro_store.save(instruction, run_tool.steps, assistant_response)
+
     return assistant_response
 
 
 def main():
+    # --profile-startup reports where startup time goes and exits; --daemon
+    # keeps this process warm for `python daemon.py run "..."` calls
+    if "--profile-startup" in sys.argv[1:]:
+        print(profile_startup(sys.modules[__name__]))
+        return
+    if os.environ.get("METRICS_PORT"):
+        tracer.serve_metrics(int(os.environ["METRICS_PORT"]))
+    try:
+        if "--daemon" in sys.argv[1:]:
+            daemon.serve(sys.modules[__name__])
+        else:
+            asyncio.run(repl())
+    finally:
+        print_colored("\nWhere the time went this session:", CLAUDE_COLOR)
+        print(tracer.summary())
+        print(frame_cache.stats())
+        print(screenshot_prefetcher.stats())
+        tracer.close()
+
+
+async def repl():
     print_colored("Welcome anon", CLAUDE_COLOR)
     print_colored("Type 'exit' to end the conversation.", CLAUDE_COLOR)
     print_colored("To include an image, type 'image' and press enter. Then drag and drop the image into the terminal.", CLAUDE_COLOR)
     
     while True:
-        user_input = input(f"\n{USER_COLOR}You: {Style.RESET_ALL}")
+        user_input = await ainput(f"\n{USER_COLOR}You: {Style.RESET_ALL}")
         
         if user_input.lower() == 'exit':
             print_colored("Thanks, goodbye.", CLAUDE_COLOR)
             break
         
         if user_input.lower() == 'image':
-            image_path = input(f"{USER_COLOR}Drag and drop your image here: {Style.RESET_ALL}").strip().replace("'", "")
+            image_path = (await ainput(f"{USER_COLOR}Drag and drop your image here: {Style.RESET_ALL}")).strip().replace("'", "")
             
             if os.path.isfile(image_path):
-                user_input = input(f"{USER_COLOR}You (prompt for image): {Style.RESET_ALL}")
-                response = chat_with_claude(user_input, image_path)
+                user_input = await ainput(f"{USER_COLOR}You (prompt for image): {Style.RESET_ALL}")
+                response = await chat_with_claude(user_input, image_path)
             else:
                 print_colored("Invalid image path. Please try again.", CLAUDE_COLOR)
                 continue
         else:
-            response = chat_with_claude(user_input)
+            response = await chat_with_claude(user_input)
         
         if response.startswith("Error") or response.startswith("Sorry we encountered an error communicating with the AI."):
             print_colored(response, TOOL_COLOR)
@@ -1,15 +1,33 @@
-from anthropic import Anthropic
+import asyncio
 import os
-from datetime import datetime
-from PIL import Image, ImageGrab
-import io
-import pyautogui
-import base64
+import sys
 from colorama import init, Fore, Style
-import cv2
-import numpy as np
-
-client = Anthropic(api_key=os.environ.get("API_KEY"))
+from capture import capture_settled, describe_settle
+from screenshot_pipeline import encode_screenshot, region_encoder
+from frame_diff import FrameDiffer
+from frame_cache import FrameCache
+from prefetch import ScreenshotPrefetcher
+from grid_overlay import GRID_SIZE, GRID_SIZES, draw_grid
+from ui_detect import UIElementDetector, describe_elements, draw_marks
+from history import ImageHistoryManager
+from agent_loop import response_text
+from agent_core import AgentSession, ainput
+from api_client import create_client
+from tracing import tracer
+from action_sequence import RUN_ACTIONS_TOOL, run_action_sequence
+from zoom import ZOOM_REGION_TOOL, zoom_region
+from input_actions import CLICK_TYPES, format_latency, input_controller
+from macro import MACROS_ENABLED, MacroRecorder, macro_store
+from lazy_modules import lazy_import
+from startup import profile_startup
+from session_trace import SessionRecorder
+import daemon
+
+# Loaded on first use
+Image = lazy_import("PIL.Image")
+
+# Pooled connections, pacing and retries on 429/5xx; shared by all sessions
+client = create_client(api_key=os.environ.get("API_KEY"))
 
 
 # Initialize colorama
@@ -25,7 +43,15 @@ RESULT_COLOR = Fore.GREEN
 def print_colored(text, color):
     print(f"{color}{text}{Style.RESET_ALL}")
 
-messages = []
+# Only the newest screenshots are re-sent; older ones become text placeholders
+history_manager = ImageHistoryManager(max_images=3)
+
+# Screens identical to a screenshot still in the history are not sent again
+frame_cache = FrameCache()
+history_manager.on_evict.append(frame_cache.forget_blocks)
+
+# Stream responses and start each tool as soon as its tool_use block is complete
+STREAM_RESPONSES = True
 
 system_prompt = '''
 You are Claude, an AI assistant capable of controlling the user's computer through specific function calls. Your primary functions are:
@@ -58,90 +84,171 @@ Guidelines for operation:
 
 '''
 
-def take_screenshot(tool_id):
-    # Take a screenshot using PIL
-    screenshot = ImageGrab.grab()
+# Remembers the last frame sent so later screenshots can send only what changed
+frame_differ = FrameDiffer()
+
+def forget_delta_base(blocks):
+    # Delta crops are offsets into the last full frame, which history eviction
+    # keeps; if compaction removes it anyway, the next screenshot is sent whole
+    if any(block is history_manager.delta_base for block in blocks):
+        history_manager.delta_base = None
+        frame_differ.reset()
+
+history_manager.on_evict.append(forget_delta_base)
+
+# Local detection of clickable-looking elements, so the model can click by ID
+ui_detector = UIElementDetector()
+MARK_ELEMENTS = True
+
+def capture_for_model(cancelled=None):
+    # Wait for animations and page loads to finish, then capture through the
+    # configured backend. cancelled is the prefetcher's check for an outdated
+    # capture.
+    with tracer.span("capture") as span:
+        screenshot, settle = capture_settled(cancelled=cancelled)
+        span.update(settle)
     
     # Resize the image to match UI scaling
     target_width, target_height = 1728, 1117
-    screenshot = screenshot.resize((target_width, target_height), Image.LANCZOS)
-    
-    # Convert PIL image to numpy array for OpenCV processing
-    screenshot_np = np.array(screenshot)
-    screenshot_np = cv2.cvtColor(screenshot_np, cv2.COLOR_RGB2BGR)
-    
-    # Define grid properties
-    grid_size = 75  # Adjust this value to change the density of the grid
-    color = (0, 255, 0)  # Green color for grid lines and labels
-    thickness = 1  # Thickness of the grid lines
-    font = cv2.FONT_HERSHEY_SIMPLEX
-    font_scale = 1.2
-    font_thickness = 1
+    with tracer.span("resize"):
+        resized = screenshot.resize((target_width, target_height), Image.LANCZOS)
     
-    # Draw vertical lines and add x-coordinates
-    for x in range(0, target_width, grid_size):
-        cv2.line(screenshot_np, (x, 0), (x, target_height), color, thickness)
-        label = f"{x}"
-        (text_width, text_height), _ = cv2.getTextSize(label, font, font_scale, font_thickness)
-        cv2.putText(screenshot_np, label, (x - text_width//2, 20), font, 0.6, color, font_thickness)
+    return {"screenshot": screenshot, "resized": resized, "settle": settle}
+
+
+# Captures in the background after each input action. Element detection and
+# the overlay are left to take_screenshot: detection renumbers elements, and
+# click_element must keep resolving the IDs the model last saw.
+screenshot_prefetcher = ScreenshotPrefetcher(capture_for_model)
+
+
+def take_screenshot(tool_id, full_frame=False, grid_size=GRID_SIZE):
+    # A frame prefetched after the last input action is used while the screen
+    # still matches it; otherwise capture now
+    prepared = screenshot_prefetcher.take() or capture_for_model()
+    screenshot, settle = prepared["resized"], prepared["settle"]
     
-    # Draw horizontal lines and add y-coordinates
-    for y in range(0, target_height, grid_size):
-        cv2.line(screenshot_np, (0, y), (target_width, y), color, thickness)
-        label = f"{y}"
-        (text_width, text_height), _ = cv2.getTextSize(label, font, font_scale, font_thickness)
-        cv2.putText(screenshot_np, label, (5, y + text_height//2), font, font_scale, color, font_thickness)
+    # Only regions that changed since the previous frame are analysed again
+    with tracer.span("ui_detect") as span:
+        elements = ui_detector.detect(screenshot)
+        span["elements"] = len(elements)
     
-    # Convert back to PIL Image
-    screenshot_with_grid = Image.fromarray(cv2.cvtColor(screenshot_np, cv2.COLOR_BGR2RGB))
+    # Point at an earlier screenshot of the same screen instead of re-sending it.
+    # The grid and element marks are part of that image, so they must match too.
+    overlay = (grid_size, tuple((e["id"], e["box"]) for e in elements) if MARK_ELEMENTS else None)
+    cached, frame_key = frame_cache.lookup(screenshot, tag=overlay)
+    if cached is not None and not full_frame:
+        number, _, block = cached
+        history_manager.delta_base = block
+        frame_differ.rebase(screenshot)
+        print(f"Screen matches screenshot #{number}; not sending it again")
+        return [
+            {"type": "text", "text": f"Screen is unchanged from screenshot #{number}, which is still in the conversation above; its grid and element IDs are still valid. No new image was sent."},
+            {"type": "text", "text": describe_settle(settle)}
+        ]
     
-    # Create a directory to store screenshots if it doesn't exist
-    screenshot_dir = os.path.join(os.path.expanduser("~"), "Desktop", "Screenshots")
-    os.makedirs(screenshot_dir, exist_ok=True)
+    # Only send the changed regions when the change since the last frame is small.
+    # The diff runs on the frame without the grid; crops get their own labels.
+    if full_frame:
+        frame_differ.reset()
+    boxes = frame_differ.diff(screenshot)
+    if boxes is not None:
+        return delta_tool_result(screenshot, boxes, grid_size, elements) + [{"type": "text", "text": describe_settle(settle)}]
     
-    # Generate a unique filename based on the current timestamp
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"screenshot_with_grid_{timestamp}.jpg"
-    filepath = os.path.join(screenshot_dir, filename)
+    # The grid is rendered once per size/density and blended in with one masked copy
+    with tracer.span("grid_overlay"):
+        screenshot_with_grid = draw_grid(screenshot, grid_size=grid_size)
+        if MARK_ELEMENTS:
+            screenshot_with_grid = draw_marks(screenshot_with_grid, elements)
     
-    # Save the screenshot with grid as JPEG
-    screenshot_with_grid.save(filepath, format='JPEG', quality=95)
+    # Encode once to fit the payload budget; the same bytes go to the archive
+    # (written in the background) and into the API payload
+    encoded = encode_screenshot(screenshot_with_grid, prefix="screenshot_with_grid")
     
-    # Encode the image to base64
-    with io.BytesIO() as buffer:
-        screenshot_with_grid.save(buffer, format="JPEG")
-        image_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
+    image_block = {
+        "type": "image",
+        "source": {
+            "type": "base64",
+            "media_type": encoded["media_type"],
+            "data": encoded["data"]
+        }
+    }
+    number = frame_cache.add(frame_key, image_block, encoded["size"], tag=overlay)
+    history_manager.delta_base = image_block
     
     tool_result_message = [
         {
             "type": "text",
-            "text": f"I have provided you the screenshot with a coordinate grid overlay. The image resolution is 1728x1117, matching your UI scaling. The grid coordinates correspond to this resolution. Please analyze carefully."
+            "text": f"I have provided you screenshot #{number} with a coordinate grid overlay. The grid coordinates are in 1728x1117, matching your UI scaling (the image itself is {encoded['size'][0]}x{encoded['size'][1]}). Always use the grid labels, not image pixels. Please analyze carefully."
         },
+        image_block
+    ]
+    if elements:
+        tool_result_message.append({
+            "type": "text",
+            "text": "Detected UI elements (magenta boxes with ID tags; centers in grid coordinates). Prefer click_element with an ID when the target is one of these:\n" + describe_elements(elements)
+        })
+    
+    print(f"Screenshot with grid queued for: {encoded['filepath']}")
+    
+    tool_result_message.append({"type": "text", "text": describe_settle(settle)})
+    
+    return tool_result_message
+
+
+def delta_tool_result(screenshot, boxes, grid_size=GRID_SIZE, elements=()):
+    if not boxes:
+        return [{"type": "text", "text": "Screen unchanged since the previous screenshot."}]
+    
+    tool_result_message = [
         {
+            "type": "text",
+            "text": f"Only {len(boxes)} region(s) changed since the previous screenshot. Each crop below has its own coordinate grid overlay labelled in absolute 1728x1117 coordinates, so you can read click positions directly from it."
+        }
+    ]
+    for left, top, right, bottom in boxes:
+        crop = draw_grid(screenshot.crop((left, top, right, bottom)), origin=(left, top), grid_size=grid_size)
+        encoded = encode_screenshot(crop, prefix="screenshot_with_grid_delta", encoder=region_encoder)
+        tool_result_message.append({
+            "type": "text",
+            "text": f"Region from ({left}, {top}) to ({right}, {bottom})"
+        })
+        tool_result_message.append({
             "type": "image",
             "source": {
                 "type": "base64",
-                "media_type": "image/jpeg",
-                "data": image_base64
+                "media_type": encoded["media_type"],
+                "data": encoded["data"]
             }
-        }
-    ]
+        })
+    
+    changed_elements = [e for e in elements if any(
+        e["box"][0] < right and left < e["box"][2] and e["box"][1] < bottom and top < e["box"][3]
+        for left, top, right, bottom in boxes
+    )]
+    if changed_elements:
+        tool_result_message.append({
+            "type": "text",
+            "text": "Detected UI elements in the changed regions (IDs from earlier screenshots stay valid elsewhere):\n" + describe_elements(changed_elements)
+        })
     
-    print(f"Screenshot with grid saved to: {filepath}")
+    print(f"Sent {len(boxes)} changed region(s) instead of a full screenshot")
     
     return tool_result_message
 
 
-def move_and_click(x, y, duration=2):
+def to_screen(x, y):
     # Hard-coded scaling factor (adjust this based on your typical screenshot size)
     scale_factor = 1  # This is an example value, adjust as needed
     
-    scaled_x = int(x * scale_factor)
-    scaled_y = int(y * scale_factor)
+    return int(x * scale_factor), int(y * scale_factor)
+
+
+def move_and_click(x, y, duration=None, click="single"):
+    scaled_x, scaled_y = to_screen(x, y)
     
-    pyautogui.moveTo(scaled_x, scaled_y, duration=duration)
-    pyautogui.doubleClick()
-    return f"Moved to scaled coordinates ({scaled_x}, {scaled_y}) and clicked"
+    elapsed = input_controller.click(scaled_x, scaled_y, click, duration)
+    return f"Moved to scaled coordinates ({scaled_x}, {scaled_y}) and {click}-clicked in {format_latency(elapsed)}"
 
 
 # def move_and_click(x, y, duration=2):
@@ -167,9 +274,27 @@ def move_and_click(x, y, duration=2):
 #     return f"Moved to scaled coordinates ({scaled_x}, {scaled_y}) and clicked"
 
 
-def type_text(text, interval=0.1):
-    pyautogui.write(text, interval=interval)
-    return f"Typed: {text}"
+def click_element(element_id, duration=None, click="single"):
+    element = ui_detector.find(element_id)
+    if element is None:
+        return f"Unknown element ID {element_id}. Take a new screenshot to get current element IDs."
+    x, y = element["center"]
+    return f"Element {element_id}: " + move_and_click(x, y, duration, click)
+
+
+def macro_step(tool_name, tool_input):
+    # Element IDs are only meaningful in this session; record the position instead
+    if tool_name == "click_element":
+        element = ui_detector.find(tool_input["element_id"])
+        if element is not None:
+            x, y = element["center"]
+            return "move_and_click", {"x": x, "y": y, "click": tool_input.get("click", "single")}
+    return tool_name, tool_input
+
+
+def type_text(text, interval=None):
+    elapsed = input_controller.type(text, interval)
+    return f"Typed: {text} (took {format_latency(elapsed)})"
 
 tools = [
     {
@@ -188,15 +313,43 @@ tools = [
                 },
                 "duration": {
                     "type": "number",
-                    "description": "The duration of the movement in seconds (optional, default: 2)"
+                    "description": "The duration of the movement in seconds (optional, default: instant)"
+                },
+                "click": {
+                    "type": "string",
+                    "enum": list(CLICK_TYPES),
+                    "description": "Which click to perform (optional, default: single). Use double to open files or icons and right for context menus."
                 }
             },
             "required": ["x", "y"]
         }
     },
+    {
+        "name": "click_element",
+        "description": "Click the center of a UI element detected in the latest screenshot, by the ID shown in its magenta tag. More precise than estimating coordinates.",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "element_id": {
+                    "type": "integer",
+                    "description": "ID of the detected element"
+                },
+                "duration": {
+                    "type": "number",
+                    "description": "The duration of the movement in seconds (optional, default: instant)"
+                },
+                "click": {
+                    "type": "string",
+                    "enum": list(CLICK_TYPES),
+                    "description": "Which click to perform (optional, default: single)"
+                }
+            },
+            "required": ["element_id"]
+        }
+    },
     {
         "name": "type_text",
-        "description": "Type the specified text with an optional interval between keystrokes.",
+        "description": "Type the specified text. By default the text is inserted at once; give an interval to type key by key.",
         "input_schema": {
             "type": "object",
             "properties": {
@@ -206,21 +359,32 @@ tools = [
                 },
                 "interval": {
                     "type": "number",
-                    "description": "The interval between keystrokes in seconds (optional, default: 0.1)"
+                    "description": "The interval between keystrokes in seconds (optional). Leave it out to insert the text at once."
                 }
             },
             "required": ["text"]
         }
     },
+    RUN_ACTIONS_TOOL,
+    ZOOM_REGION_TOOL,
         {
         "name": "take_screenshot",
-        "description": "Take a screenshot of the current screen and return both the file path and the image data for analysis. Send to claude before doing executing other tools",
+        "description": "Take a screenshot of the current screen and return both the file path and the image data for analysis. Send to claude before doing executing other tools. If only a small part of the screen changed since the previous screenshot, only the changed regions are returned, each with its own grid in absolute coordinates.",
         "input_schema": {
             "type": "object",
               "properties": {
                 "tool_id": {
                     "type": "string",
                     "description": "tool id"
+                },
+                "full_frame": {
+                    "type": "boolean",
+                    "description": "Send the whole screen even if only a small part changed since the previous screenshot (optional, default: false)"
+                },
+                "grid_size": {
+                    "type": "integer",
+                    "enum": list(GRID_SIZES),
+                    "description": f"Spacing of the coordinate grid in pixels; smaller is denser (optional, default: {GRID_SIZE})"
                 }
             },
             "required": ["tool_id"]
@@ -230,153 +394,121 @@ tools = [
 
 
 def execute_tool(tool_name, tool_input):
-    if tool_name == "move_and_click":
-        return move_and_click(tool_input["x"], tool_input["y"], tool_input.get("duration", 4))
-    elif tool_name == "type_text":
-        return type_text(tool_input["text"], tool_input.get("interval", 0.1))
-    elif tool_name == "take_screenshot":
-        return take_screenshot(tool_input["tool_id"])
-    else:
-        return f"Unknown tool: {tool_name}"
-
-
-def chat_with_claude(user_input, image_path=None):
-    global messages
-
-    print(f"\n{'='*50}\nUser Message: {user_input}\n{'='*50}")
-
-    messages.append({"role": "user", "content": user_input})
+    if tool_name == "take_screenshot":
+        return take_screenshot(tool_input["tool_id"], tool_input.get("full_frame", False), tool_input.get("grid_size", GRID_SIZE))
+    if tool_name == "zoom_region":
+        return zoom_region((tool_input["left"], tool_input["top"], tool_input["right"], tool_input["bottom"]), (1728, 1117))
     
-
-    print("HERE")
+    # Input changes the screen: drop any prefetched frame now and start
+    # capturing the next one as soon as the action is done
+    screenshot_prefetcher.cancel()
     try:
-         response = client.messages.create(
-            model="claude-3-5-sonnet-20240620",
-            max_tokens=4000,
-            system=system_prompt,
-            messages=messages,
-            tools=tools,
-            tool_choice={"type": "auto"}
-        )
-    except Exception as e:
-        print(f"Error calling Claude API: {str(e)}")
-        return "I'm sorry, there was an error communicating with the AI. Please try again."
+        if tool_name == "move_and_click":
+            return move_and_click(tool_input["x"], tool_input["y"], tool_input.get("duration"), tool_input.get("click", "single"))
+        elif tool_name == "click_element":
+            return click_element(tool_input["element_id"], tool_input.get("duration"), tool_input.get("click", "single"))
+        elif tool_name == "type_text":
+            return type_text(tool_input["text"], tool_input.get("interval"))
+        elif tool_name == "run_actions":
+            return run_action_sequence(
+                tool_input["actions"],
+                to_screen,
+                take_screenshot=lambda: take_screenshot("run_actions"),
+                screenshot=tool_input.get("screenshot", False)
+            )
+        else:
+            return f"Unknown tool: {tool_name}"
+    finally:
+        screenshot_prefetcher.start()
 
-    print(f"\nInitial Response:")
 
-    print(response)
+def reset_screen_state():
+    # Forget what earlier conversations were shown, before starting a new one
+    screenshot_prefetcher.cancel()
+    frame_differ.reset()
+    history_manager.delta_base = None
+    frame_cache.clear()
+    ui_detector.reset()
 
 
-    # print(f"Stop Reason: {response.stop_reason}")
-    # print(f"Content: {response.content}")
+# The conversation lives in the session; the REPL below is a thin front end
+session = AgentSession(client, system_prompt, tools, execute_tool, history_manager=history_manager, stream=STREAM_RESPONSES)
 
-    assistant_response = ""
-    messages.append({"role": "assistant", "content": response.content})
+# RECORD_SESSION=<directory> records the session for offline replay with session_trace.py
+recorder = SessionRecorder.from_env(session, script=__file__)
 
-    for block in response.content:
 
+async def chat_with_claude(user_input, image_path=None):
+    print(f"\n{'='*50}\nUser Message: {user_input}\n{'='*50}")
 
-        if block.type == "text":
-            print(block)
-            # messages.append({"role": "assistant", "content": [block]})
-        
-        elif block.type == "tool_use":
-            tool_name = block.name
-            tool_input = block.input
-            tool_use_id = block.id
-            result = execute_tool(tool_name, tool_input)
+    # Replay a recorded run of the same instruction while the screen matches
+    # it; the model only takes over where the screen diverges. Macros bypass
+    # the model, so they are off while a session is recorded or replayed.
+    instruction = user_input
+    run_tool = execute_tool
+    if MACROS_ENABLED and session.recorder is None:
+        run_tool = MacroRecorder(execute_tool, normalize=macro_step)
+        replay = await asyncio.to_thread(macro_store.replay, instruction, execute_tool)
+        if replay is not None:
+            run_tool.steps.extend(replay["steps"])
+            if replay["completed"]:
+                session.messages.append({"role": "user", "content": instruction})
+                session.messages.append({"role": "assistant", "content": replay["response"]})
+                print(f"\nFinal Response (replayed): {replay['response']}")
+                return replay["response"]
+            user_input = f"{user_input}\n\n{replay['note']}"
+
+    # Run every tool call of each response and send all results back together,
+    # until the model stops asking for tools
+    try:
+        response = await session.send(user_input, run_tool)
+    except Exception as e:
+        print(f"Error calling Claude API: {str(e)}")
+        return "I'm sorry, there was an error communicating with the AI. Please try again."
 
+    assistant_response = response_text(response.content)
+    print(f"\nFinal Response: {assistant_response}")
 
-            print("here: ", tool_use_id)
+    if MACROS_ENABLED and session.recorder is None and not run_tool.failed:
+        macro_store.save(instruction, run_tool.steps, assistant_response)
 
-        
-            messages.append({
-                "role": "user",
-                "content": [
-                    {
-                        "type": "tool_result",
-                        "tool_use_id": tool_use_id,
-                        "content": result
-                    }
-                ]
-            })
-
-            
-
-            if tool_name == "take_screenshot":
-
-                print(f"Tool Used: {tool_name}")
-                print("*******************************")
-                # print(messages)
-                print("*******************************")
-
-                try:
-                
-                    second_response = response = client.messages.create(
-                                model="claude-3-5-sonnet-20240620",
-                                max_tokens=4000,
-                                system=system_prompt,
-                                messages=messages,
-                                tools=tools,
-                                tool_choice={"type": "auto"}
-                            )
-
-                    messages.append({"role": "assistant", "content": second_response.content})
-
-                    for block in second_response.content:
-                        if block.type == "text":
-          
-                            print(block)
-                        elif block.type == "tool_use":
-                            second_tool_name = block.name
-                            second_tool_input = block.input
-                            second_tool_use_id = block.id
-                            second_result = execute_tool(second_tool_name, second_tool_input)
-
-                            print("here: ", second_tool_use_id)
-
-                        
-                            messages.append({
-                                "role": "user",
-                                "content": [
-                                    {
-                                        "type": "tool_result",
-                                        "tool_use_id": second_tool_use_id,
-                                        "content": second_result
-                                    }
-                                ]
-                            })
-                            messages.append({"role": "assistant", "content": "I completed the operation."})
-
-                    print("*******************************")
-                    print(second_response.content)
-                    print("*******************************")
-
-                except Exception as e:
-                    print(f"Error calling Claude API: {str(e)}")
-                    return "I'm sorry, there was an error communicating with the AI. Please try again."
-                
-            else:
-                messages.append({"role": "assistant", "content": "I completed the operation."})
-                print(f"Tool Used: {tool_name}")
-
-    return "all fine"
+    return assistant_response
 
 
 def main():
+    # --profile-startup reports where startup time goes and exits; --daemon
+    # keeps this process warm for `python daemon.py run "..."` calls
+    if "--profile-startup" in sys.argv[1:]:
+        print(profile_startup(sys.modules[__name__]))
+        return
+    if os.environ.get("METRICS_PORT"):
+        tracer.serve_metrics(int(os.environ["METRICS_PORT"]))
+    try:
+        if "--daemon" in sys.argv[1:]:
+            daemon.serve(sys.modules[__name__])
+        else:
+            asyncio.run(repl())
+    finally:
+        print_colored("\nWhere the time went this session:", CLAUDE_COLOR)
+        print(tracer.summary())
+        print(frame_cache.stats())
+        print(screenshot_prefetcher.stats())
+        tracer.close()
+
+
+async def repl():
     print_colored("Welcome anon", CLAUDE_COLOR)
     print_colored("Type 'exit' to end the conversation.", CLAUDE_COLOR)
     print_colored("To include an image, type 'image' and press enter. Then drag and drop the image into the terminal.", CLAUDE_COLOR)
     
     while True:
-        user_input = input(f"\n{USER_COLOR}You: {Style.RESET_ALL}")
-        print("STUCK")
+        user_input = await ainput(f"\n{USER_COLOR}You: {Style.RESET_ALL}")
         if user_input.lower() == 'exit':
             print_colored("Thanks, goodbye.", CLAUDE_COLOR)
             break
         
         else:
-            response = chat_with_claude(user_input)
+            response = await chat_with_claude(user_input)
         
         if response.startswith("Error") or response.startswith("Sorry we encountered an error communicating with the AI."):
             print_colored(response, TOOL_COLOR)
@@ -0,0 +1,264 @@
+import atexit
+import base64
+import io
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from lazy_modules import lazy_import
+from tracing import tracer
+
+Image = lazy_import("PIL.Image")
+
+
+SCREENSHOT_DIR = os.path.join(os.path.expanduser("~"), "Desktop", "Screenshots")
+
+# Quality used when a frame is encoded directly rather than through the
+# adaptive encoder
+JPEG_QUALITY = 85
+
+
+MEDIA_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+EXTENSIONS = {"JPEG": "jpg", "WEBP": "webp", "PNG": "png"}
+
+# Default payload budget per screenshot
+MAX_PAYLOAD_BYTES = 250_000
+
+# The API charges roughly width * height / 750 tokens per image
+PIXELS_PER_TOKEN = 750
+
+
+def encode_image(image, format="JPEG", quality=JPEG_QUALITY):
+    # JPEG has no alpha channel, so grabs in RGBA/P mode must be converted first
+    if format in ("JPEG", "WEBP") and image.mode != "RGB":
+        image = image.convert("RGB")
+    with io.BytesIO() as buffer:
+        image.save(buffer, format=format, quality=quality)
+        return buffer.getvalue()
+
+
+def screenshot_filename(prefix="screenshot", extension="jpg"):
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    return f"{prefix}_{timestamp}.{extension}"
+
+
+class ScreenshotWriter:
+    # Write-behind archive for encoded screenshots. Writes happen on a daemon
+    # thread; the queue is bounded and, when full, the oldest pending write is
+    # dropped so the caller never blocks on the filesystem.
+
+    def __init__(self, directory=SCREENSHOT_DIR, max_pending=8):
+        self.directory = directory
+        self.written = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, filename, data):
+        self._ensure_started()
+        filepath = os.path.join(self.directory, filename)
+        while True:
+            try:
+                self._queue.put_nowait((filepath, data))
+                return filepath
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    self._queue.task_done()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def flush(self):
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self, timeout=5):
+        if self._thread is None:
+            return
+        self.flush()
+        self._queue.put((None, None))
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="screenshot-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        os.makedirs(self.directory, exist_ok=True)
+        while True:
+            filepath, data = self._queue.get()
+            try:
+                if filepath is None:
+                    return
+                with open(filepath, "wb") as f:
+                    f.write(data)
+                self.written += 1
+            except OSError as e:
+                print(f"Error saving screenshot {filepath}: {str(e)}")
+            finally:
+                self._queue.task_done()
+
+
+screenshot_writer = ScreenshotWriter()
+atexit.register(screenshot_writer.close)
+
+
+def content_kind(image, flat_colors=4096):
+    # Flat UI screens (text, solid panels) use few distinct colours and
+    # compress far better losslessly; photos and gradients do not
+    sample = image.convert("RGB")
+    sample.thumbnail((256, 256))
+    colors = sample.getcolors(maxcolors=flat_colors)
+    return "flat" if colors is not None else "photo"
+
+
+class AdaptiveEncoder:
+    # Picks resolution, format and quality so each frame fits a payload budget
+    # (bytes and/or estimated image tokens). The settings found for a screen
+    # geometry and content kind are cached and reused for later frames as long
+    # as they still land inside the budget, so the search normally runs only
+    # when the screen or its content changes character.
+
+    def __init__(self, max_bytes=MAX_PAYLOAD_BYTES, max_tokens=None, min_quality=40, max_quality=90,
+                 min_scale=0.5, cache_size=16):
+        self.max_bytes = max_bytes
+        self.max_tokens = max_tokens
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        self.min_scale = min_scale
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def encode(self, image):
+        start = time.perf_counter()
+        kind = content_kind(image)
+        key = (image.size, kind)
+        attempts = 0
+
+        with self._lock:
+            settings = self._cache.get(key)
+            if settings is not None:
+                self._cache.move_to_end(key)
+
+        data = None
+        if settings is not None:
+            data = self._encode(image, *settings)
+            attempts = 1
+            # Reuse only while the frame still fits and a lossy frame isn't far
+            # under budget (a higher quality would then fit)
+            lossy_headroom = (settings[2] is not None and settings[2] < self.max_quality
+                              and self.max_bytes and len(data) < self.max_bytes // 3)
+            if not self._fits(data) or lossy_headroom:
+                data = None
+
+        cached = data is not None
+        if data is None:
+            settings, data, attempts = self._search(image, kind)
+            with self._lock:
+                self._cache[key] = settings
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        format, scale, quality = settings
+        width, height = self._scaled_size(image, scale)
+        return {
+            "data": data,
+            "format": format,
+            "media_type": MEDIA_TYPES[format],
+            "quality": quality if format != "PNG" else None,
+            "size": (width, height),
+            "scale": scale,
+            "kind": kind,
+            "bytes": len(data),
+            "attempts": attempts,
+            "cached": cached,
+            "encode_ms": (time.perf_counter() - start) * 1000,
+        }
+
+    def _formats(self, kind):
+        return ("PNG", "WEBP") if kind == "flat" else ("JPEG",)
+
+    def _scaled_size(self, image, scale):
+        return max(int(image.size[0] * scale), 1), max(int(image.size[1] * scale), 1)
+
+    def _token_scale(self, image):
+        if not self.max_tokens:
+            return 1.0
+        pixels = image.size[0] * image.size[1]
+        return min(1.0, (self.max_tokens * PIXELS_PER_TOKEN / pixels) ** 0.5)
+
+    def _fits(self, data):
+        return not self.max_bytes or len(data) <= self.max_bytes
+
+    def _encode(self, image, format, scale, quality):
+        if scale < 1.0:
+            image = image.resize(self._scaled_size(image, scale), Image.LANCZOS)
+        return encode_image(image, format, quality)
+
+    def _search(self, image, kind):
+        # Highest quality that fits at full (token-limited) resolution; shrink
+        # the frame only when even the lowest quality is over budget
+        attempts = 0
+        scale = self._token_scale(image)
+        best = None
+        while True:
+            for format in self._formats(kind):
+                if format == "PNG":
+                    data = self._encode(image, format, scale, None)
+                    attempts += 1
+                    if self._fits(data):
+                        return (format, scale, None), data, attempts
+                    continue
+                low, high = self.min_quality, self.max_quality
+                while low <= high:
+                    quality = (low + high) // 2
+                    data = self._encode(image, format, scale, quality)
+                    attempts += 1
+                    if self._fits(data):
+                        best = ((format, scale, quality), data)
+                        low = quality + 5
+                    else:
+                        high = quality - 5
+                if best is not None:
+                    return best[0], best[1], attempts
+            if scale * 0.8 < self.min_scale:
+                # Nothing fits; send the smallest thing we tried
+                settings = (self._formats(kind)[-1], scale, self.min_quality)
+                return settings, self._encode(image, *settings), attempts + 1
+            scale *= 0.8
+
+
+default_encoder = AdaptiveEncoder()
+
+# For crops whose pixel offsets the model relies on: never resized
+region_encoder = AdaptiveEncoder(min_scale=1.0)
+
+
+def encode_screenshot(image, prefix="screenshot", writer=screenshot_writer, encoder=default_encoder, encoded=None):
+    # Compress once, queue the bytes for the archive and hand the same bytes
+    # back base64-encoded for the API payload. The encoder may shrink the
+    # frame to meet its budget; "size" and "scale" say what was actually sent.
+    # encoded may be a result of encoder.encode(image) computed ahead of time.
+    if encoded is None:
+        with tracer.span("encode") as span:
+            encoded = encoder.encode(image)
+            span.update(format=encoded["format"], bytes=encoded["bytes"])
+    encoded = dict(encoded)
+    data = encoded.pop("data")
+    filename = screenshot_filename(prefix, EXTENSIONS[encoded["format"]])
+    encoded["filename"] = filename
+    encoded["filepath"] = writer.submit(filename, data) if writer is not None else None
+    encoded["data"] = base64.b64encode(data).decode('utf-8')
+    print(f"Encoded {encoded['size'][0]}x{encoded['size'][1]} {encoded['kind']} frame as {encoded['format']}"
+          f" q={encoded['quality']}: {encoded['bytes']} bytes in {encoded['encode_ms']:.1f} ms"
+          f" ({'cached settings' if encoded['cached'] else str(encoded['attempts']) + ' attempts'})")
+    return encoded
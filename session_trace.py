@@ -0,0 +1,625 @@
+import argparse
+import asyncio
+import atexit
+import contextlib
+import copy
+import hashlib
+import importlib
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import capture
+import input_actions
+import screenshot_pipeline
+from agent_loop import SIDE_EFFECT_FREE_TOOLS, block_field
+from frame_cache import frame_hash
+from history import estimate_tokens
+from lazy_modules import lazy_import
+from streaming import FakeEventStream, fake_events
+from tracing import USAGE_FIELDS, tracer
+
+Image = lazy_import("PIL.Image")
+
+
+# Recording: RECORD_SESSION=<directory> makes the scripts write
+#   <directory>/trace.jsonl   one JSON line per task, API turn, tool call and frame
+#   <directory>/frames/       each distinct full-screen capture, once, as PNG
+# Replaying runs the recorded tasks through chat_with_claude offline, with
+# the recorded responses, the recorded frames and no-op input, under a
+# chosen latency profile:
+#
+#   python session_trace.py show traces/slow-run
+#   python session_trace.py replay traces/slow-run --profile recorded --profile instant
+
+TRACE_VERSION = 1
+RECORD_DIR = os.environ.get("RECORD_SESSION")
+
+# Tools that each count as one input action in the fake input latency
+SINGLE_ACTION_TOOLS = {"move_and_click", "click_element", "type_text"}
+
+
+def plain(value):
+    # SDK objects, SimpleNamespaces and dicts as JSON-ready data
+    if hasattr(value, "model_dump"):
+        return value.model_dump()
+    if isinstance(value, SimpleNamespace):
+        value = vars(value)
+    if isinstance(value, dict):
+        return {key: plain(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [plain(item) for item in value]
+    return value
+
+
+def compact_content(content):
+    # Tool output or message content with image data replaced by its size
+    # and hash; the frames themselves are recorded separately
+    if not isinstance(content, list):
+        return content
+    blocks = []
+    for block in content:
+        block = plain(block)
+        if block.get("type") == "image" and block.get("source", {}).get("type") == "base64":
+            data = block["source"]["data"]
+            block = {"type": "image", "media_type": block["source"].get("media_type"), "bytes": len(data),
+                     "sha1": hashlib.sha1(data.encode()).hexdigest()[:16]}
+        elif block.get("type") == "tool_result":
+            block = dict(block, content=compact_content(block.get("content")))
+        blocks.append(block)
+    return blocks
+
+
+def _image_sizes(content):
+    # Sizes of the base64 images in message content, including tool results
+    sizes = []
+    for block in content if isinstance(content, list) else ():
+        kind = block_field(block, "type")
+        if kind == "image":
+            sizes.append(len(block_field(block_field(block, "source") or {}, "data") or ""))
+        elif kind == "tool_result":
+            sizes.extend(_image_sizes(block_field(block, "content")))
+    return sizes
+
+
+def summarize_request(request):
+    # What a request carried, without the payload
+    messages = request.get("messages", [])
+    images = [size for message in messages for size in _image_sizes(message["content"])]
+    return {"messages": len(messages), "images": len(images), "image_bytes": sum(images),
+            "estimated_tokens": sum(estimate_tokens(message["content"]) for message in messages)}
+
+
+class RecordingBackend(capture.CaptureBackend):
+    # Wraps the real capture backend (created on first use) and hands every
+    # full-screen grab to the recorder
+    def __init__(self, recorder, backend=None):
+        self.recorder = recorder
+        self._backend = backend
+
+    @property
+    def name(self):
+        return f"recording:{self.backend.name}"
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = capture.create_capture_backend()
+        return self._backend
+
+    def grab(self, region=None):
+        started = time.perf_counter()
+        frame = self.backend.grab(region)
+        if region is None:
+            self.recorder.grabbed(frame, time.perf_counter() - started)
+        return frame
+
+    def monitors(self):
+        return self.backend.monitors()
+
+    def screen_size(self):
+        return self.backend.screen_size()
+
+    def close(self):
+        if self._backend is not None:
+            self._backend.close()
+
+
+class SessionRecorder:
+    # Sees every task, API turn and tool call of an AgentSession (through
+    # session.recorder) and every full-screen capture (through
+    # RecordingBackend). Frames are deduplicated by perceptual hash, so the
+    # settle polls of an unchanged screen cost one PNG, and written on a
+    # background thread.
+
+    def __init__(self, directory, script=None):
+        self.directory = directory
+        self.frames_dir = os.path.join(directory, "frames")
+        os.makedirs(self.frames_dir, exist_ok=True)
+        self.session = None
+        self.started = time.perf_counter()
+        self.tasks = 0
+        self.turns = 0
+        self.actions = 0
+        self._task_turns = 0
+        self._saved = set(os.listdir(self.frames_dir))
+        self._last_frame = None
+        self._lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="trace-writer")
+        self._file = open(os.path.join(directory, "trace.jsonl"), "a", buffering=1)
+        self._write({"kind": "session", "version": TRACE_VERSION, "script": script, "started": time.time()})
+        atexit.register(self.close)
+
+    @classmethod
+    def from_env(cls, session, script=None):
+        # A recorder attached to session when RECORD_SESSION is set, else None
+        if not RECORD_DIR:
+            return None
+        recorder = cls(RECORD_DIR, script=script and os.path.splitext(os.path.basename(script))[0])
+        recorder.attach(session)
+        print(f"Recording this session to {RECORD_DIR}")
+        return recorder
+
+    def attach(self, session):
+        self.session = session
+        session.recorder = self
+        capture.set_capture_backend(RecordingBackend(self))
+
+    def _write(self, entry):
+        with self._lock:
+            if self._file is not None:
+                self._file.write(json.dumps(entry, default=str) + "\n")
+
+    def _now(self):
+        return round(time.perf_counter() - self.started, 6)
+
+    def task(self, instruction):
+        self.tasks += 1
+        self._task_turns = 0
+        fresh = self.session is None or not self.session.messages
+        self._write({"kind": "task", "task": self.tasks, "t": self._now(), "fresh": fresh,
+                     "instruction": compact_content(instruction)})
+
+    def turn(self, request, response, seconds, first_event_s=None):
+        self.turns += 1
+        self._task_turns += 1
+        usage = {field: getattr(response.usage, field, None) or 0 for field in USAGE_FIELDS}
+        self._write({"kind": "turn", "task": self.tasks, "turn": self._task_turns, "t": self._now(),
+                     "seconds": round(seconds, 6),
+                     "first_event_s": None if first_event_s is None else round(first_event_s, 6),
+                     "request": summarize_request(request),
+                     "response": {"content": plain(response.content), "stop_reason": response.stop_reason, "usage": usage}})
+
+    def wrap_tool(self, execute_tool):
+        def recorded(tool_name, tool_input):
+            if tool_name not in SIDE_EFFECT_FREE_TOOLS:
+                with self._lock:
+                    self.actions += 1
+            action = self.actions
+            started = time.perf_counter()
+            output, error = None, None
+            try:
+                output = execute_tool(tool_name, tool_input)
+                return output
+            except Exception as e:
+                error = f"{type(e).__name__}: {str(e)}"
+                raise
+            finally:
+                self._write({"kind": "tool", "task": self.tasks, "action": action, "name": tool_name,
+                             "input": tool_input, "seconds": round(time.perf_counter() - started, 6),
+                             "output": compact_content(output), "error": error})
+        return recorded
+
+    def grabbed(self, frame, seconds):
+        digest = frame_hash(frame)
+        with self._lock:
+            if digest == self._last_frame:
+                return
+            self._last_frame = digest
+        ref = hashlib.sha1(digest.to_bytes(128, "big")).hexdigest()[:16] + ".png"
+        if ref not in self._saved:
+            self._saved.add(ref)
+            frame = frame.copy()
+            self._writer.submit(frame.save, os.path.join(self.frames_dir, ref), format="PNG", compress_level=1)
+        self._write({"kind": "frame", "ref": ref, "action": self.actions, "t": self._now(),
+                     "size": list(frame.size), "grab_s": round(seconds, 6)})
+
+    def close(self):
+        self._writer.shutdown(wait=True)
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def load_trace(directory):
+    # Groups trace.jsonl into tasks, each with its turns and tool calls
+    trace = {"directory": directory, "script": None, "tasks": [], "frames": []}
+    with open(os.path.join(directory, "trace.jsonl")) as f:
+        for line in f:
+            entry = json.loads(line)
+            kind = entry["kind"]
+            if kind == "session":
+                # A directory recorded twice holds two sessions; replay them in order
+                trace["script"] = trace["script"] or entry.get("script")
+            elif kind == "task":
+                trace["tasks"].append(dict(entry, turns=[], tools=[]))
+            elif kind == "frame":
+                trace["frames"].append(entry)
+            elif kind in ("turn", "tool") and trace["tasks"]:
+                trace["tasks"][-1]["turns" if kind == "turn" else "tools"].append(entry)
+    return trace
+
+
+def task_text(instruction):
+    if isinstance(instruction, str):
+        return instruction
+    return " ".join(block.get("text", "") for block in instruction if block.get("type") == "text")
+
+
+def recorded_wall(task):
+    # From the task's start to the end of its last API turn
+    return max([task["t"]] + [turn["t"] for turn in task["turns"]]) - task["t"]
+
+
+def describe_trace(trace):
+    turns = [turn for task in trace["tasks"] for turn in task["turns"]]
+    tools = [tool for task in trace["tasks"] for tool in task["tools"]]
+    lines = [f"{len(trace['tasks'])} task(s), {len(turns)} API turns, {len(tools)} tool calls, "
+             f"{len({frame['ref'] for frame in trace['frames']})} distinct frames ({trace['script'] or 'unknown script'})"]
+    for index, task in enumerate(trace["tasks"]):
+        api = sum(turn["seconds"] for turn in task["turns"])
+        tool_time = sum(tool["seconds"] for tool in task["tools"])
+        lines.append(f"  {index + 1}. {task_text(task['instruction'])[:60]!r}: {recorded_wall(task):.1f} s wall, "
+                     f"{len(task['turns'])} turns ({api:.1f} s API), {len(task['tools'])} tools ({tool_time:.1f} s)")
+    return "\n".join(lines)
+
+
+class LatencyProfile:
+    # Simulated latencies, in seconds. api=None uses each turn's recorded
+    # time and first_event=None its recorded time to the first event;
+    # capture and input None use the median recorded grab and input action.
+    # With settle off the settle detector doesn't wait. speed divides all.
+
+    def __init__(self, name, api=None, first_event=None, capture=None, input=None, settle=True, speed=1.0):
+        self.name = name
+        self.api = api
+        self.first_event = first_event
+        self.capture = capture
+        self.input = input
+        self.settle = settle
+        self.speed = speed
+
+    def resolve(self, trace):
+        # Fills recorded values from the trace
+        grabs = [frame["grab_s"] for frame in trace["frames"]]
+        actions = [tool["seconds"] for task in trace["tasks"] for tool in task["tools"]
+                   if tool["name"] in SINGLE_ACTION_TOOLS and tool["error"] is None]
+        if self.capture is None:
+            self.capture = statistics.median(grabs) if grabs else 0.0
+        if self.input is None:
+            self.input = statistics.median(actions) if actions else 0.0
+        return self
+
+    def api_latency(self, turn):
+        # (seconds to the first event, seconds for the whole response)
+        total = turn["seconds"] if self.api is None else self.api
+        first = self.first_event if self.first_event is not None else turn.get("first_event_s")
+        first = min(total, first if first is not None else total)
+        return first / self.speed, total / self.speed
+
+
+PROFILES = {
+    # As fast as possible, for regression tests
+    "instant": dict(api=0.0, first_event=0.0, capture=0.0, input=0.0, settle=False),
+    # What the recorded session saw
+    "recorded": dict(),
+    "fast-api": dict(api=1.5, first_event=0.4, capture=0.03, input=0.02),
+    "slow-api": dict(api=8.0, first_event=2.5, capture=0.03, input=0.02),
+}
+
+
+def load_profile(name, speed=1.0):
+    # A name from PROFILES or a JSON file with the LatencyProfile arguments
+    if name in PROFILES:
+        return LatencyProfile(name, speed=speed, **PROFILES[name])
+    with open(name) as f:
+        return LatencyProfile(os.path.splitext(os.path.basename(name))[0], speed=speed, **json.load(f))
+
+
+class ReplayDivergence(Exception):
+    pass
+
+
+class PacedEventStream(FakeEventStream):
+    # Spreads the events of a streamed response over duration seconds
+    def __init__(self, events, duration):
+        super().__init__(events)
+        self.duration = duration
+
+    async def __aiter__(self):
+        gap = self.duration / max(len(self.events) - 1, 1)
+        for index, event in enumerate(self.events):
+            if index and gap:
+                await asyncio.sleep(gap)
+            yield event
+
+
+class ReplayClient:
+    # Stands in for the API client: serves the current task's recorded
+    # responses in order, after the profile's latency
+    def __init__(self, trace, profile):
+        self.trace = trace
+        self.profile = profile
+        self.turns = []
+        self.requests = []
+        self.divergence = None
+        self.messages = SimpleNamespace(create=self.create)
+
+    def start_task(self, index):
+        self.turns = list(self.trace["tasks"][index]["turns"])
+        self.requests = []
+        self.divergence = None
+
+    async def create(self, stream=False, **request):
+        if not self.turns:
+            self.divergence = "the loop asked for more API turns than were recorded"
+            raise ReplayDivergence(self.divergence)
+        turn = self.turns.pop(0)
+        self.requests.append(summarize_request(request))
+        first, total = self.profile.api_latency(turn)
+        content = copy.deepcopy(turn["response"]["content"])
+        stop_reason = turn["response"]["stop_reason"]
+        usage = turn["response"]["usage"]
+        await asyncio.sleep(first if stream else total)
+        if stream:
+            return PacedEventStream(fake_events(content, stop_reason, input_tokens=usage["input_tokens"]), total - first)
+        return SimpleNamespace(content=content, stop_reason=stop_reason, usage=SimpleNamespace(**usage))
+
+
+class ReplayScreen:
+    # The recorded screen: after input action k it shows the last frame
+    # recorded while action k was the latest one
+    def __init__(self, trace):
+        self.directory = os.path.join(trace["directory"], "frames")
+        self.by_action = {}
+        for frame in trace["frames"]:
+            self.by_action[frame["action"]] = frame["ref"]
+        first = trace["frames"][0] if trace["frames"] else None
+        self.size = tuple(first["size"]) if first else (1920, 1080)
+        self.action = 0
+        self._images = {}
+        self._lock = threading.Lock()
+
+    def advance(self):
+        with self._lock:
+            self.action += 1
+
+    def frame(self):
+        with self._lock:
+            shown = [action for action in self.by_action if action <= self.action]
+            if not shown:
+                return Image.new("RGB", self.size, (236, 236, 236))
+            ref = self.by_action[max(shown)]
+            if ref not in self._images:
+                with Image.open(os.path.join(self.directory, ref)) as image:
+                    self._images[ref] = image.convert("RGB")
+            return self._images[ref]
+
+
+class ReplayCaptureBackend(capture.CaptureBackend):
+    name = "replay"
+
+    def __init__(self, screen, latency=0.0):
+        self.screen = screen
+        self.latency = latency
+        self.grabs = 0
+
+    def grab(self, region=None):
+        if self.latency:
+            time.sleep(self.latency)
+        self.grabs += 1
+        frame = self.screen.frame()
+        return frame.crop(region) if region is not None else frame.copy()
+
+    def screen_size(self):
+        return self.screen.size
+
+
+def fake_pyautogui(screen_size, latency=0.0):
+    # No-op input; each click, typed string, hotkey or scroll takes latency
+    module = types.ModuleType("pyautogui")
+    module.FAILSAFE = False
+    module.PAUSE = 0
+    module.size = lambda: screen_size
+    module.position = lambda: (0, 0)
+
+    def act(*args, **kwargs):
+        if latency:
+            time.sleep(latency)
+
+    for name in ("moveTo", "mouseDown", "mouseUp", "keyDown", "keyUp"):
+        setattr(module, name, lambda *args, **kwargs: None)
+    for name in ("click", "doubleClick", "rightClick", "write", "typewrite", "press", "hotkey", "scroll"):
+        setattr(module, name, act)
+    return module
+
+
+class ReplayDriver:
+    # Takes the recorder's place on the session: advances the screen when an
+    # input action starts, the way the recorder counted actions
+    def __init__(self, screen):
+        self.screen = screen
+        self.tool_calls = 0
+        self.tools = []
+
+    def task(self, instruction):
+        pass
+
+    def turn(self, request, response, seconds, first_event_s=None):
+        pass
+
+    def wrap_tool(self, execute_tool):
+        def replayed(tool_name, tool_input):
+            self.tool_calls += 1
+            self.tools.append(tool_name)
+            if tool_name not in SIDE_EFFECT_FREE_TOOLS:
+                self.screen.advance()
+            return execute_tool(tool_name, tool_input)
+        return replayed
+
+
+@contextlib.contextmanager
+def replay_environment(script, screen, profile, client, driver, quiet=True):
+    # Swaps in the fake client, capture and input for the duration of a
+    # replay and restores everything afterwards
+    saved_backend = capture._capture_backend
+    detector = capture.settle_detector
+    saved_settle = detector.timeout
+    saved_gui = input_actions.pyautogui
+    saved_script_gui = getattr(script, "pyautogui", None)
+    saved_paste = input_actions.input_controller.paste_min_chars
+    saved_directory = screenshot_pipeline.screenshot_writer.directory
+    saved_client, saved_recorder = script.session.client, script.session.recorder
+
+    gui = fake_pyautogui(screen.size, profile.input / profile.speed)
+    capture.set_capture_backend(ReplayCaptureBackend(screen, profile.capture / profile.speed))
+    if not profile.settle:
+        detector.timeout = 0
+    input_actions.pyautogui = gui
+    if saved_script_gui is not None:
+        script.pyautogui = gui
+    # Never touch the real clipboard
+    input_actions.input_controller.paste_min_chars = float("inf")
+    screenshot_pipeline.screenshot_writer.directory = tempfile.mkdtemp(prefix="replay_screenshots_")
+    script.session.client, script.session.recorder = client, driver
+    script.reset_screen_state()
+    script.session.reset()
+    tracer.reset()
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull if quiet else sys.stdout):
+            yield
+    finally:
+        script.reset_screen_state()
+        screenshot_pipeline.screenshot_writer.flush()
+        script.session.client, script.session.recorder = saved_client, saved_recorder
+        screenshot_pipeline.screenshot_writer.directory = saved_directory
+        input_actions.input_controller.paste_min_chars = saved_paste
+        if saved_script_gui is not None:
+            script.pyautogui = saved_script_gui
+        input_actions.pyautogui = saved_gui
+        detector.timeout = saved_settle
+        capture.set_capture_backend(saved_backend)
+
+
+async def _replay_tasks(script, trace, client):
+    results = []
+    for index, task in enumerate(trace["tasks"]):
+        if index and task.get("fresh"):
+            script.reset_screen_state()
+            script.session.reset()
+        client.start_task(index)
+        started = time.perf_counter()
+        response = await script.chat_with_claude(task_text(task["instruction"]))
+        divergence = client.divergence or (f"{len(client.turns)} recorded turns were not used" if client.turns else None)
+        results.append({"task": index + 1, "wall_s": time.perf_counter() - started,
+                        "recorded_wall_s": recorded_wall(task), "turns": len(client.requests),
+                        "request_tokens": sum(r["estimated_tokens"] for r in client.requests),
+                        "divergence": divergence, "response": response})
+    return results
+
+
+def simulate(trace_dir, profile="instant", script_name=None, speed=1.0, quiet=True):
+    # Replays a recorded session; returns a report dict. Fully offline and
+    # deterministic apart from timing, so it can run in regression tests.
+    trace = load_trace(trace_dir)
+    script = importlib.import_module(script_name or trace["script"] or "remote_control_v1")
+    if isinstance(profile, str):
+        profile = load_profile(profile, speed)
+    profile.resolve(trace)
+    screen = ReplayScreen(trace)
+    client = ReplayClient(trace, profile)
+    driver = ReplayDriver(screen)
+
+    started = time.perf_counter()
+    with replay_environment(script, screen, profile, client, driver, quiet):
+        tasks = asyncio.run(_replay_tasks(script, trace, client))
+    wall_s = time.perf_counter() - started
+    return {
+        "trace": trace_dir,
+        "script": script.__name__,
+        "profile": dict(vars(profile)),
+        "wall_s": wall_s,
+        "recorded_wall_s": sum(task["recorded_wall_s"] for task in tasks),
+        "tool_calls": driver.tool_calls,
+        "tools": driver.tools,
+        "divergences": sum(1 for task in tasks if task["divergence"]),
+        "tasks": tasks,
+        "stages": {name: {key: round(value, 6) if isinstance(value, float) else value for key, value in row.items()}
+                   for name, row in tracer.stats().items()},
+    }
+
+
+def format_report(report, baseline=None):
+    profile = report["profile"]
+    lines = [f"Replay of {report['trace']} with {report['script']}, profile {profile['name']!r} "
+             f"(speed x{profile['speed']:g}): {report['wall_s']:.2f} s wall, "
+             f"{report['recorded_wall_s']:.2f} s when recorded, {report['divergences']} divergence(s)"]
+    if baseline is not None:
+        change = report["wall_s"] - baseline["wall_s"]
+        lines.append(f"  vs baseline: {baseline['wall_s']:.2f} s -> {report['wall_s']:.2f} s ({change:+.2f} s, "
+                     f"{change / baseline['wall_s'] * 100 if baseline['wall_s'] else 0.0:+.1f}%)")
+    for task in report["tasks"]:
+        note = f"  DIVERGED: {task['divergence']}" if task["divergence"] else ""
+        lines.append(f"  task {task['task']}: {task['wall_s']:.2f} s ({task['turns']} turns, "
+                     f"~{task['request_tokens']} input tokens sent){note}")
+    lines.append(f"  {'stage':<22} {'count':>6} {'total s':>9} {'p50 ms':>9}")
+    for name, row in sorted(report["stages"].items(), key=lambda item: item[1]["total"], reverse=True):
+        lines.append(f"  {name:<22} {row['count']:>6} {row['total']:>9.3f} {row['p50'] * 1000:>9.1f}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and replay sessions recorded with RECORD_SESSION")
+    commands = parser.add_subparsers(dest="command", required=True)
+    show = commands.add_parser("show", help="Summarise a recorded session")
+    show.add_argument("trace")
+    replay = commands.add_parser("replay", help="Replay a recorded session offline")
+    replay.add_argument("trace")
+    replay.add_argument("--profile", action="append",
+                        help=f"Latency profile: {', '.join(PROFILES)} or a JSON file (repeat to compare; default instant)")
+    replay.add_argument("--speed", type=float, default=1.0, help="Divide every simulated latency by this")
+    replay.add_argument("--script", choices=("remote_control_v1", "remote_control_with_grid"),
+                        help="Script to replay through (default: the recorded one)")
+    replay.add_argument("--verbose", action="store_true", help="Show the scripts' output")
+    replay.add_argument("--baseline", help="Earlier --output JSON to compare wall time against")
+    replay.add_argument("--output", help="Write the reports as JSON to this file")
+    args = parser.parse_args()
+
+    if args.command == "show":
+        print(describe_trace(load_trace(args.trace)))
+        return
+
+    baselines = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baselines = {report["profile"]["name"]: report for report in json.load(f)}
+    reports = []
+    for name in args.profile or ["instant"]:
+        report = simulate(args.trace, name, args.script, args.speed, quiet=not args.verbose)
+        reports.append(report)
+        print(format_report(report, baselines.get(report["profile"]["name"])))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(reports, f, indent=2, default=str)
+
+
+if __name__ == "__main__":
+    main()
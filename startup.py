@@ -0,0 +1,106 @@
+import os
+import subprocess
+import sys
+import time
+
+from lazy_modules import lazy, load
+
+
+# Number of the script's imports listed in the startup profile
+SLOWEST_IMPORTS = 8
+
+
+def _timed(stages, name, fn):
+    started = time.perf_counter()
+    try:
+        fn()
+        error = None
+    except Exception as e:
+        error = f"{type(e).__name__}: {str(e)}"
+    stages.append((name, time.perf_counter() - started, error))
+
+
+def warm_up(script):
+    # Pays the costs that startup defers to first use: the heavy imports, the
+    # capture backend and one capture, and the API client's connection pool.
+    # Returns [(stage, seconds, error or None)]; a failed stage doesn't stop
+    # the others.
+    from capture import get_capture_backend
+
+    stages = []
+    for name in sorted(lazy):
+        _timed(stages, f"import {name}", lambda name=name: load(name))
+    _timed(stages, "capture backend", get_capture_backend)
+    _timed(stages, "first capture", lambda: get_capture_backend().grab())
+    _timed(stages, "API client", lambda: script.client.client)
+    return stages
+
+
+def format_stages(stages):
+    return "\n".join(f"  {name:<28} {seconds:7.3f} s" + (f"  (failed: {error})" if error else "")
+                     for name, seconds, error in stages)
+
+
+def _import_times(output):
+    # Parses python -X importtime output into [(module, cumulative seconds, depth)]
+    rows = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(cumulative) / 1e6, depth))
+    return rows
+
+
+def direct_imports(rows, module_name):
+    # The modules module_name imported itself. importtime lists modules
+    # after everything they import, one level deeper.
+    children = []
+    for name, seconds, depth in rows:
+        if depth == 0:
+            if name == module_name:
+                return children
+            children = []
+        elif depth == 1:
+            children.append((name, seconds))
+    return []
+
+
+def cold_start(module_name, cwd):
+    # Starts fresh interpreters: one that does nothing and one that imports
+    # the script, which is everything that runs before the first prompt
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"], check=True)
+    interpreter = time.perf_counter() - started
+
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module_name}"],
+                            cwd=cwd, capture_output=True, text=True)
+    total = time.perf_counter() - started
+    if result.returncode != 0:
+        lines = result.stderr.strip().splitlines()
+        raise RuntimeError(f"Importing {module_name} failed: {lines[-1] if lines else result.returncode}")
+    return interpreter, total, _import_times(result.stderr)
+
+
+def profile_startup(script):
+    # The report printed by --profile-startup
+    module_name = os.path.splitext(os.path.basename(script.__file__))[0]
+    interpreter, total, imports = cold_start(module_name, os.path.dirname(os.path.abspath(script.__file__)))
+    slowest = sorted(direct_imports(imports, module_name), key=lambda row: row[1], reverse=True)
+    eager = sorted({name for name, _, _ in imports if name in lazy})
+
+    lines = [f"Startup profile for {module_name}",
+             f"  {'python interpreter':<28} {interpreter:7.3f} s",
+             f"  {'start and import script':<28} {total:7.3f} s  (time to the first prompt)",
+             f"  Slowest imports of {module_name}:"]
+    lines += [f"    {name:<26} {seconds:7.3f} s" for name, seconds in slowest[:SLOWEST_IMPORTS]]
+    lines.append(f"  Heavy modules imported eagerly: {', '.join(eager) or 'none'}")
+
+    # Measured in this process, which has imported the script but not used it
+    stages = warm_up(script)
+    deferred = sum(seconds for _, seconds, _ in stages)
+    lines += ["Deferred to first use (a daemon pays this once, at start):", format_stages(stages),
+              f"  {'total':<28} {deferred:7.3f} s"]
+    return "\n".join(lines)
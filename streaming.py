@@ -0,0 +1,181 @@
+import json
+from concurrent.futures import ThreadPoolExecutor, wait
+from types import SimpleNamespace
+
+from agent_loop import SIDE_EFFECT_FREE_TOOLS, cut_off_result, tool_result, traced_tool
+
+
+def print_text_delta(text):
+    print(text, end="", flush=True)
+
+
+class StreamingTurn:
+    # Consumes the raw server-sent events of one streamed response. Text deltas
+    # go to on_text as they arrive and each tool_use block is handed to
+    # execute_tool the moment its input JSON is complete, while the rest of the
+    # response is still being generated. As in run_tool_calls_async,
+    # consecutive side-effect-free tools run together and everything else
+    # strictly in order: a tool with side effects waits for all tools before
+    # it, and the tools after it wait for it. A tool_use whose input never
+    # completed (the response hit max_tokens) is not run; it gets an error
+    # result so every tool_use is still answered.
+
+    def __init__(self, execute_tool, on_text=print_text_delta, concurrent_tools=SIDE_EFFECT_FREE_TOOLS, max_workers=4):
+        self.execute_tool = execute_tool
+        self.on_text = on_text
+        self.concurrent_tools = concurrent_tools
+        self.content = []
+        self.stop_reason = None
+        self.usage = None
+        # Seconds from sending the request to the first event, when streamed
+        # by AgentSession
+        self.first_event_s = None
+        self._blocks = {}
+        self._partial_json = {}
+        self._pending = {}  # tool_use id -> future of its tool_result
+        self._barrier = []  # the last tool with side effects
+        self._batch = []  # side-effect-free tools dispatched since then
+        # Tools only wait on tools submitted before them, which a FIFO pool
+        # has already started, so a waiting worker cannot starve them
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tool")
+
+    def handle(self, event):
+        # Feeds a single event
+        handler = getattr(self, f"_on_{event.type}", None)
+        if handler is not None:
+            handler(event)
+
+    def finish(self):
+        self.content = [self._blocks[i] for i in sorted(self._blocks)]
+        return self
+
+    def tool_results(self):
+        # Blocks until every dispatched tool has finished; one result per
+        # tool_use block, in the order the model emitted them
+        results = []
+        for index in sorted(self._blocks):
+            block = self._blocks[index]
+            if block["type"] != "tool_use":
+                continue
+            future = self._pending.get(block["id"])
+            results.append(future.result() if future is not None else cut_off_result(block["id"]))
+        self._executor.shutdown(wait=False)
+        return results
+
+    def _on_message_start(self, event):
+        self.usage = event.message.usage
+
+    def _on_content_block_start(self, event):
+        block = event.content_block
+        if block.type == "text":
+            self._blocks[event.index] = {"type": "text", "text": block.text or ""}
+        elif block.type == "tool_use":
+            self._blocks[event.index] = {"type": "tool_use", "id": block.id, "name": block.name, "input": {}}
+            self._partial_json[event.index] = []
+
+    def _on_content_block_delta(self, event):
+        delta = event.delta
+        if delta.type == "text_delta":
+            self._blocks[event.index]["text"] += delta.text
+            self.on_text(delta.text)
+        elif delta.type == "input_json_delta":
+            self._partial_json[event.index].append(delta.partial_json)
+
+    def _on_content_block_stop(self, event):
+        block = self._blocks.get(event.index)
+        if block is None or block["type"] != "tool_use":
+            return
+        raw = "".join(self._partial_json.pop(event.index))
+        try:
+            block["input"] = json.loads(raw) if raw else {}
+        except ValueError:
+            # Cut off mid-input at max_tokens; answered in tool_results()
+            return
+        print(f"\nTool Used: {block['name']}")
+        self._dispatch(block)
+
+    def _dispatch(self, block):
+        if block["name"] in self.concurrent_tools:
+            waits = list(self._barrier)
+        else:
+            waits = self._barrier + self._batch
+        future = self._executor.submit(self._run_tool, block, waits)
+        if block["name"] in self.concurrent_tools:
+            self._batch.append(future)
+        else:
+            self._barrier, self._batch = [future], []
+        self._pending[block["id"]] = future
+
+    def _run_tool(self, block, waits):
+        wait(waits)
+        return tool_result(block["id"], lambda: traced_tool(self.execute_tool, block["name"], block["input"]))
+
+    def _on_message_delta(self, event):
+        self.stop_reason = event.delta.stop_reason
+        if self.usage is not None and getattr(event, "usage", None) is not None:
+            self.usage.output_tokens = event.usage.output_tokens
+
+
+# Fake streams, for exercising the loop without the network
+
+def fake_events(content, stop_reason="end_turn", chunk_size=12, input_tokens=0):
+    # Turns a list of content block dicts into the raw event sequence the API
+    # would stream for them
+    yield SimpleNamespace(type="message_start", message=SimpleNamespace(
+        usage=SimpleNamespace(input_tokens=input_tokens, output_tokens=0,
+                              cache_read_input_tokens=0, cache_creation_input_tokens=0)))
+    for index, block in enumerate(content):
+        if block["type"] == "text":
+            yield SimpleNamespace(type="content_block_start", index=index,
+                                  content_block=SimpleNamespace(type="text", text=""))
+            pieces = [block["text"][i:i + chunk_size] for i in range(0, len(block["text"]), chunk_size)]
+            for piece in pieces:
+                yield SimpleNamespace(type="content_block_delta", index=index,
+                                      delta=SimpleNamespace(type="text_delta", text=piece))
+        else:
+            yield SimpleNamespace(type="content_block_start", index=index,
+                                  content_block=SimpleNamespace(type="tool_use", id=block["id"], name=block["name"], input={}))
+            raw = json.dumps(block["input"])
+            for i in range(0, len(raw), chunk_size):
+                yield SimpleNamespace(type="content_block_delta", index=index,
+                                      delta=SimpleNamespace(type="input_json_delta", partial_json=raw[i:i + chunk_size]))
+        yield SimpleNamespace(type="content_block_stop", index=index)
+    yield SimpleNamespace(type="message_delta", delta=SimpleNamespace(stop_reason=stop_reason),
+                          usage=SimpleNamespace(output_tokens=0))
+    yield SimpleNamespace(type="message_stop")
+
+
+class FakeEventStream:
+    # Replays a fixed list of events; usable wherever a streamed response
+    # (an async context manager yielding events) is expected
+
+    def __init__(self, events):
+        self.events = list(events)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def __aiter__(self):
+        for event in self.events:
+            yield event
+
+
+class FakeAsyncClient:
+    # Stands in for AsyncAnthropic: client.messages.create returns the next
+    # scripted (content, stop_reason) response, streamed when stream=True
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+        self.messages = SimpleNamespace(create=self._create)
+
+    async def _create(self, stream=False, **request):
+        self.requests.append(request)
+        content, stop_reason = self.responses.pop(0)
+        if stream:
+            return FakeEventStream(fake_events(content, stop_reason))
+        usage = SimpleNamespace(input_tokens=0, output_tokens=0, cache_read_input_tokens=0, cache_creation_input_tokens=0)
+        return SimpleNamespace(content=content, stop_reason=stop_reason, usage=usage)
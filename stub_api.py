@@ -0,0 +1,164 @@
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+MODEL = "stub-model"
+
+
+def scripted_response(request, steps):
+    # Plays a fixed task: alternately take a screenshot and click, for steps
+    # tool calls, then finish. The step is inferred from the number of tool
+    # results in the request, so the server itself is stateless.
+    step = sum(1 for message in request.get("messages", [])
+               if message["role"] == "user" and isinstance(message["content"], list)
+               and any(block.get("type") == "tool_result" for block in message["content"]))
+    if step >= steps:
+        return [{"type": "text", "text": f"Done after {steps} steps."}], "end_turn"
+    if step % 2 == 0:
+        tool = {"name": "take_screenshot", "input": {"tool_id": f"stub-{step}"}}
+    else:
+        tool = {"name": "move_and_click", "input": {"x": 100 + step * 10, "y": 100}}
+    content = [
+        {"type": "text", "text": f"Step {step + 1}."},
+        {"type": "tool_use", "id": f"toolu_{uuid.uuid4().hex[:24]}", **tool},
+    ]
+    return content, "tool_use"
+
+
+def usage(request):
+    # Rough input size so token accounting has something to show
+    return {"input_tokens": len(json.dumps(request)) // 4, "output_tokens": 20,
+            "cache_creation_input_tokens": 0, "cache_read_input_tokens": 0}
+
+
+def message_body(content, stop_reason, request):
+    return {
+        "id": f"msg_{uuid.uuid4().hex[:24]}",
+        "type": "message",
+        "role": "assistant",
+        "model": request.get("model", MODEL),
+        "content": content,
+        "stop_reason": stop_reason,
+        "stop_sequence": None,
+        "usage": usage(request),
+    }
+
+
+def stream_events(content, stop_reason, request, chunk_size=16):
+    # The server-sent event sequence the real API produces for this content
+    message = message_body([], None, request)
+    message["usage"]["output_tokens"] = 1
+    yield "message_start", {"type": "message_start", "message": message}
+    for index, block in enumerate(content):
+        if block["type"] == "text":
+            yield "content_block_start", {"type": "content_block_start", "index": index,
+                                          "content_block": {"type": "text", "text": ""}}
+            for i in range(0, len(block["text"]), chunk_size):
+                yield "content_block_delta", {"type": "content_block_delta", "index": index,
+                                              "delta": {"type": "text_delta", "text": block["text"][i:i + chunk_size]}}
+        else:
+            yield "content_block_start", {"type": "content_block_start", "index": index,
+                                          "content_block": {"type": "tool_use", "id": block["id"], "name": block["name"], "input": {}}}
+            raw = json.dumps(block["input"])
+            for i in range(0, len(raw), chunk_size):
+                yield "content_block_delta", {"type": "content_block_delta", "index": index,
+                                              "delta": {"type": "input_json_delta", "partial_json": raw[i:i + chunk_size]}}
+        yield "content_block_stop", {"type": "content_block_stop", "index": index}
+    yield "message_delta", {"type": "message_delta", "delta": {"stop_reason": stop_reason, "stop_sequence": None},
+                            "usage": {"output_tokens": 20}}
+    yield "message_stop", {"type": "message_stop"}
+
+
+# Injected failures: status -> error type in the response body
+FAILURES = {429: "rate_limit_error", 500: "api_error", 529: "overloaded_error"}
+
+
+class StubAPIHandler(BaseHTTPRequestHandler):
+    # Answers POST /v1/messages like the Messages API, after a fixed latency
+    # plus jitter. A fraction of requests fails with a 429, 500 or 529.
+    steps = 4
+    latency = 0.5  # seconds before the response starts
+    jitter = 0.0  # extra random latency, up to this many seconds
+    failure_rate = 0.0
+    retry_after = 1  # seconds, sent with 429 and 529 failures
+    rng = random.Random()
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/v1/messages":
+            self.send_error(404)
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        time.sleep(self.latency + self.rng.uniform(0, self.jitter))
+        if self.rng.random() < self.failure_rate:
+            self.send_failure(self.rng.choice(sorted(FAILURES)))
+            return
+        content, stop_reason = scripted_response(request, self.steps)
+        if request.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            for event, data in stream_events(content, stop_reason, request):
+                self.wfile.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode())
+                self.wfile.flush()
+            self.close_connection = True
+        else:
+            body = json.dumps(message_body(content, stop_reason, request)).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    def send_failure(self, status):
+        body = json.dumps({"type": "error", "error": {"type": FAILURES[status], "message": "Injected by the stub"}}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if status in (429, 529):
+            self.send_header("retry-after", str(self.retry_after))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port=0, steps=4, latency=0.5, jitter=0.0, failure_rate=0.0, retry_after=1, seed=None):
+    # Starts the stub in a daemon thread; returns the server (its base URL is
+    # f"http://127.0.0.1:{server.server_port}")
+    handler = type("Handler", (StubAPIHandler,), {
+        "steps": steps, "latency": latency, "jitter": jitter, "failure_rate": failure_rate,
+        "retry_after": retry_after, "rng": random.Random(seed),
+    })
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="stub-api", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Messages API")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--steps", type=int, default=4, help="Tool calls per task before the model finishes")
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds before each response starts")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Extra random latency, up to this many seconds")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of requests answered with 429/500/529")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry-after seconds sent with 429 and 529")
+    parser.add_argument("--seed", type=int, help="Seed for jitter and failures")
+    args = parser.parse_args()
+    server = serve(args.port, args.steps, args.latency, args.jitter, args.failure_rate, args.retry_after, args.seed)
+    print(f"Stub API listening on http://127.0.0.1:{server.server_port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
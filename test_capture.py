@@ -0,0 +1,85 @@
+import ctypes
+import shutil
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("PIL")
+
+if shutil.which("Xvfb") is None:
+    pytest.skip("Xvfb is not installed", allow_module_level=True)
+
+from capture import XShmBackend
+from xvfb_runner import start_xvfb
+
+
+DISPLAY_NUMBER = 97
+WIDTH, HEIGHT = 640, 480
+
+_IPC_STAT = 2
+
+
+@pytest.fixture(scope="module")
+def display():
+    process = start_xvfb(DISPLAY_NUMBER, f"{WIDTH}x{HEIGHT}x24")
+    yield f":{DISPLAY_NUMBER}"
+    process.terminate()
+    process.wait()
+
+
+@pytest.fixture
+def backend(display):
+    backend = XShmBackend(display=display, max_segments=2)
+    yield backend
+    backend.close()
+
+
+def segment_exists(shmid):
+    # IPC_STAT fails once the kernel has freed the segment
+    libc = ctypes.CDLL(None, use_errno=True)
+    buffer = ctypes.create_string_buffer(512)
+    return libc.shmctl(ctypes.c_int(shmid), ctypes.c_int(_IPC_STAT), buffer) == 0
+
+
+def test_grab_returns_the_whole_screen(backend):
+    frame = backend.grab()
+    assert frame.mode == "RGB"
+    assert frame.size == (WIDTH, HEIGHT) == backend.screen_size()
+
+
+def test_region_grab_matches_a_crop_of_the_screen(backend):
+    region = (10, 20, 110, 70)
+    full = backend.grab()
+    crop = backend.grab(region)
+    assert crop.size == (100, 50)
+    assert np.array_equal(np.asarray(crop), np.asarray(full.crop(region)))
+
+
+def test_monitors_cover_the_screen(backend):
+    monitors = backend.monitors()
+    assert monitors[0] == (0, 0, WIDTH, HEIGHT)
+    assert backend.grab_monitor(0).size == (WIDTH, HEIGHT)
+
+
+def test_evicted_segments_are_freed(backend):
+    backend.grab((0, 0, 100, 100))
+    first = backend._segments[(100, 100)][1].shmid
+    assert segment_exists(first)
+
+    backend.grab((0, 0, 200, 100))
+    backend.grab((0, 0, 300, 100))
+    assert list(backend._segments) == [(200, 100), (300, 100)]
+    assert not segment_exists(first)
+
+    # An evicted size gets a new segment on its next grab
+    assert backend.grab((0, 0, 100, 100)).size == (100, 100)
+    assert list(backend._segments) == [(300, 100), (100, 100)]
+
+
+def test_close_frees_every_segment(display):
+    backend = XShmBackend(display=display, max_segments=2)
+    backend.grab()
+    backend.grab((0, 0, 50, 50))
+    shmids = [info.shmid for _, info, _ in backend._segments.values()]
+    backend.close()
+    assert not any(segment_exists(shmid) for shmid in shmids)
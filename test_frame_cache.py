@@ -0,0 +1,60 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+Image = pytest.importorskip("PIL.Image")
+
+from frame_cache import FrameCache, frame_hash, hamming
+
+
+def screen(checked=False):
+    # A light window with a dark title bar and a checkbox in the middle
+    frame = np.full((600, 800, 3), 236, dtype=np.uint8)
+    frame[:30] = (48, 48, 52)
+    frame[280:300, 390:410] = (120, 120, 120)
+    frame[283:297, 393:407] = 255
+    if checked:
+        frame[287:293, 397:403] = 20
+    return Image.fromarray(frame)
+
+
+def block():
+    return {"type": "image", "source": {"type": "base64", "media_type": "image/png", "data": "x" * 100}}
+
+
+def sent(cache, image, tag=None):
+    _, key = cache.lookup(image, tag)
+    image_block = block()
+    number = cache.add(key, image_block, image.size, tag)
+    return number, image_block
+
+
+def test_an_identical_frame_is_a_hit():
+    cache = FrameCache()
+    number, image_block = sent(cache, screen())
+
+    hit, _ = cache.lookup(screen())
+    assert hit == (number, (800, 600), image_block)
+    assert cache.bytes_saved == 100
+
+
+def test_a_hash_collision_with_a_changed_tile_is_not_a_hit():
+    cache = FrameCache()
+    sent(cache, screen())
+
+    # The toggled checkbox is invisible to the hash ...
+    assert hamming(frame_hash(screen()), frame_hash(screen(checked=True))) <= cache.max_distance
+    # ... but not to the tile comparison that confirms a candidate
+    hit, _ = cache.lookup(screen(checked=True))
+    assert hit is None
+    assert cache.hits == 0
+
+
+def test_entries_only_match_their_own_tag_and_go_with_their_image():
+    cache = FrameCache()
+    _, image_block = sent(cache, screen(), tag="grid=10")
+
+    assert cache.lookup(screen(), tag="grid=20")[0] is None
+    assert cache.lookup(screen(), tag="grid=10")[0] is not None
+
+    cache.forget_blocks([image_block])
+    assert cache.lookup(screen(), tag="grid=10")[0] is None
@@ -0,0 +1,140 @@
+from history import IMAGE_PLACEHOLDER, SUMMARY_HEADER, HistoryCompactor, ImageHistoryManager
+
+
+def image(data="x" * 1000):
+    return {"type": "image", "source": {"type": "base64", "media_type": "image/png", "data": data}}
+
+
+def conversation(results, task="Do the task", answer=None):
+    # A task followed by one screenshot step per entry of results, each a
+    # list of image blocks (one full frame, or the crops of a delta), and the
+    # final answer if the task is finished
+    messages = [{"role": "user", "content": task}]
+    for step, images in enumerate(results):
+        messages.append({"role": "assistant", "content": [
+            {"type": "tool_use", "id": f"{task}/tool_{step}", "name": "take_screenshot", "input": {}}]})
+        messages.append({"role": "user", "content": [
+            {"type": "tool_result", "tool_use_id": f"{task}/tool_{step}",
+             "content": [{"type": "text", "text": f"Screenshot {step}"}] + images}]})
+    if answer is not None:
+        messages.append({"role": "assistant", "content": [{"type": "text", "text": answer}]})
+    return messages
+
+
+def images_in(messages):
+    return [block for m in messages if isinstance(m["content"], list)
+            for b in m["content"] if b["type"] == "tool_result"
+            for block in b["content"] if block["type"] == "image"]
+
+
+def assert_pairs_intact(messages):
+    for message, reply in zip(messages, messages[1:]):
+        if message["role"] == "assistant" and isinstance(message["content"], list):
+            asked = [b["id"] for b in message["content"] if b["type"] == "tool_use"]
+            answered = [b["tool_use_id"] for b in reply["content"] if b["type"] == "tool_result"]
+            assert answered == asked
+
+
+def test_the_base_of_the_deltas_is_never_evicted():
+    base = image()
+    crops = [image("c" * 100) for _ in range(3)]
+    messages = conversation([[base], [image()], crops, [image()], [image()], [image()]])
+    manager = ImageHistoryManager(max_images=2, evict_batch=1)
+    manager.delta_base = base
+    evicted = []
+    manager.on_evict.append(evicted.extend)
+
+    manager.evict(messages)
+
+    kept = images_in(messages)
+    assert any(block is base for block in kept)
+    assert all(block is not base for block in evicted)
+    # Besides the base, the two newest screenshots stay
+    assert len(kept) == 3
+    # The delta went as a whole, all of its crops at once
+    assert all(any(block is crop for block in evicted) for crop in crops)
+    assert_pairs_intact(messages)
+
+
+def test_the_newest_screenshot_survives_the_byte_budget():
+    newest = image("n" * 5000)
+    messages = conversation([[image()], [image()], [newest]])
+    manager = ImageHistoryManager(max_images=3, max_image_bytes=100)
+
+    manager.evict(messages)
+
+    assert [block is newest for block in images_in(messages)] == [True]
+    placeholders = [b for m in messages if isinstance(m["content"], list) for r in m["content"]
+                    if r["type"] == "tool_result" for b in r["content"] if b.get("text") == IMAGE_PLACEHOLDER]
+    assert len(placeholders) == 2
+    assert_pairs_intact(messages)
+
+
+def test_eviction_waits_for_a_full_batch():
+    messages = conversation([[image()] for _ in range(5)])
+    manager = ImageHistoryManager(max_images=3, evict_batch=3)
+    assert manager.evict(messages) == 0
+    assert len(images_in(messages)) == 5
+
+    messages = conversation([[image()] for _ in range(6)])
+    assert manager.evict(messages) > 0
+    assert len(images_in(messages)) == 3
+
+
+def test_stable_message_is_before_the_oldest_evictable_screenshot():
+    base = image()
+    messages = conversation([[base], [image()], [image()], [image()]])
+    manager = ImageHistoryManager(max_images=2, evict_batch=3)
+    manager.delta_base = base
+    # messages[2] holds the protected base; the oldest evictable image is in
+    # messages[4], so everything up to messages[2] stays unchanged
+    assert manager.stable_message(messages) is messages[2]
+
+
+def assert_roles_alternate(messages):
+    assert [m["role"] for m in messages] == ["user", "assistant"] * (len(messages) // 2) + ["user"] * (len(messages) % 2)
+
+
+def test_compaction_folds_finished_tasks_into_a_summary_within_budget():
+    messages = []
+    for number in range(3):
+        messages += conversation([[image()] for _ in range(3)], task=f"Task {number}", answer=f"Finished {number}.")
+    messages += conversation([[image()] for _ in range(2)], task="Current task")
+    compactor = HistoryCompactor(ImageHistoryManager(max_images=None), max_tokens=8000)
+    assert compactor.estimate(messages) > compactor.max_tokens
+
+    assert compactor.compact(messages) > 0
+
+    assert compactor.estimate(messages) <= compactor.max_tokens
+    assert messages[0]["content"].startswith(SUMMARY_HEADER)
+    assert [line.split(" ->")[0] for line in compactor.summary_lines] == ["- Task 0", "- Task 1", "- Task 2"]
+    # The current task is untouched
+    assert messages[2:] == conversation([[image()] for _ in range(2)], task="Current task")
+    assert_roles_alternate(messages)
+    assert_pairs_intact(messages)
+
+
+def test_compaction_drops_the_oldest_steps_of_a_long_task_as_whole_pairs():
+    messages = conversation([[image()] for _ in range(10)], task="Long task")
+    compactor = HistoryCompactor(ImageHistoryManager(max_images=None), max_tokens=8000, keep_steps=2)
+    removed = []
+    compactor.history_manager.on_evict.append(removed.extend)
+
+    compactor.compact(messages)
+
+    assert compactor.estimate(messages) <= compactor.max_tokens
+    assert len(messages) == 1 + 2 * 2
+    assert "8 earlier steps of this task were removed" in messages[0]["content"][-1]["text"]
+    assert [b["id"] for m in messages[1::2] for b in m["content"]] == ["Long task/tool_8", "Long task/tool_9"]
+    # The screenshots that left the history are reported like evictions
+    assert len(removed) == 8
+    assert_roles_alternate(messages)
+    assert_pairs_intact(messages)
+
+
+def test_closed_compactor_stops_listening_to_the_shared_manager():
+    manager = ImageHistoryManager()
+    compactor = HistoryCompactor(manager)
+    assert compactor._images_evicted in manager.on_evict
+    compactor.close()
+    assert compactor._images_evicted not in manager.on_evict
@@ -0,0 +1,76 @@
+import time
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("PIL")
+
+import prefetch
+from capture import CaptureCancelled
+
+
+# How long one capture takes to settle
+PREPARE_SECONDS = 0.5
+
+
+class SlowPrepare:
+    # Stands in for capture_for_model. A cooperative prepare checks
+    # cancelled between polls like a settle wait does; the other one blocks
+    # like a single slow grab.
+
+    def __init__(self, cooperative=True):
+        self.cooperative = cooperative
+        self.started = 0
+        self.finished = 0
+
+    def __call__(self, cancelled):
+        self.started += 1
+        end = time.perf_counter() + PREPARE_SECONDS
+        while time.perf_counter() < end:
+            if self.cooperative and cancelled():
+                raise CaptureCancelled()
+            time.sleep(0.01)
+        self.finished += 1
+        return {"screenshot": None}
+
+
+def make_prefetcher(monkeypatch, prepare):
+    monkeypatch.setattr(prefetch, "frame_matches_screen", lambda frame: True)
+    return prefetch.ScreenshotPrefetcher(prepare)
+
+
+def back_to_back_actions(prefetcher, actions=5):
+    for _ in range(actions):
+        prefetcher.cancel()
+        time.sleep(0.02)  # the input action
+        prefetcher.start()
+
+
+def timed_take(prefetcher):
+    start = time.perf_counter()
+    prepared = prefetcher.take()
+    return prepared, time.perf_counter() - start
+
+
+def test_take_after_back_to_back_actions_waits_for_one_capture(monkeypatch):
+    prepare = SlowPrepare()
+    prefetcher = make_prefetcher(monkeypatch, prepare)
+    back_to_back_actions(prefetcher)
+    prepared, waited = timed_take(prefetcher)
+
+    assert prepared is not None
+    assert waited < PREPARE_SECONDS + 0.2
+    # The outdated captures stopped instead of settling
+    assert prepare.finished == 1
+
+
+def test_queued_captures_are_dropped_behind_a_blocking_one(monkeypatch):
+    prepare = SlowPrepare(cooperative=False)
+    prefetcher = make_prefetcher(monkeypatch, prepare)
+    back_to_back_actions(prefetcher)
+    prepared, waited = timed_take(prefetcher)
+
+    assert prepared is not None
+    # At most the capture already running when the actions started is waited for
+    assert waited < 2 * PREPARE_SECONDS + 0.2
+    assert prepare.started == 2
@@ -0,0 +1,130 @@
+import asyncio
+import copy
+import json
+
+from agent_core import AgentSession
+from history import ImageHistoryManager
+from streaming import FakeAsyncClient
+
+
+# The API looks for earlier cache entries up to this many content blocks
+# before each breakpoint
+LOOKBACK_BLOCKS = 20
+
+
+class SnapshotClient(FakeAsyncClient):
+    # Eviction later rewrites the stored history in place; keep each request
+    # exactly as it was sent
+
+    async def _create(self, stream=False, **request):
+        response = await super()._create(stream=stream, **request)
+        self.requests[-1] = copy.deepcopy(request)
+        return response
+
+
+def strip_cache_control(value):
+    if isinstance(value, dict):
+        return {k: strip_cache_control(v) for k, v in value.items() if k != "cache_control"}
+    if isinstance(value, list):
+        return [strip_cache_control(v) for v in value]
+    return value
+
+
+def prefix_key(messages, end):
+    # The API reads string content as a single text block
+    prefix = [dict(m, content=[{"type": "text", "text": m["content"]}]) if isinstance(m["content"], str) else m
+              for m in messages[:end + 1]]
+    return json.dumps(strip_cache_control(prefix), sort_keys=True)
+
+
+def breakpoints(messages):
+    return [i for i, m in enumerate(messages)
+            if isinstance(m["content"], list) and "cache_control" in m["content"][-1]]
+
+
+def count_images(messages):
+    return sum(1 for m in messages if isinstance(m["content"], list)
+               for b in m["content"] if b.get("type") == "tool_result"
+               for inner in b["content"] if inner.get("type") == "image")
+
+
+def screenshot_tool(name, tool_input):
+    return [{"type": "text", "text": "Screenshot"},
+            {"type": "image", "source": {"type": "base64", "media_type": "image/png", "data": "x" * 4000}}]
+
+
+def run_session(steps, history_manager):
+    responses = [([{"type": "tool_use", "id": f"tool_{i}", "name": "take_screenshot", "input": {}}], "tool_use")
+                 for i in range(steps)]
+    responses.append(([{"type": "text", "text": "Done."}], "end_turn"))
+    client = SnapshotClient(responses)
+    session = AgentSession(client, "system", [{"name": "take_screenshot", "input_schema": {"type": "object"}}],
+                           screenshot_tool, history_manager=history_manager, on_text=lambda text: None)
+    asyncio.run(session.send("Check the screen repeatedly"))
+    return client.requests
+
+
+def simulate_cache(requests):
+    # Returns, per request, the index of the last message read from cache
+    # (-1 for none). Entries are written at every breakpoint; a breakpoint
+    # reads the longest entry at or up to LOOKBACK_BLOCKS blocks before it.
+    written = set()
+    reads = []
+    for request in requests:
+        messages = request["messages"]
+        read = -1
+        for point in breakpoints(messages):
+            blocks = 0
+            for end in reversed(range(point + 1)):
+                if prefix_key(messages, end) in written:
+                    read = max(read, end)
+                    break
+                blocks += len(messages[end]["content"]) if isinstance(messages[end]["content"], list) else 1
+                if blocks > LOOKBACK_BLOCKS:
+                    break
+        written.update(prefix_key(messages, point) for point in breakpoints(messages))
+        reads.append(read)
+    return reads
+
+
+def test_breakpoints_stay_within_the_api_limit():
+    for request in run_session(12, ImageHistoryManager(max_images=3, evict_batch=3)):
+        system = sum("cache_control" in block for block in request["system"])
+        tools = sum("cache_control" in tool for tool in request["tools"])
+        assert system + tools + len(breakpoints(request["messages"])) <= 4
+        assert breakpoints(request["messages"])[-1] == len(request["messages"]) - 1
+
+
+def test_images_are_evicted_in_batches():
+    requests = run_session(12, ImageHistoryManager(max_images=3, evict_batch=3))
+    counts = [count_images(request["messages"]) for request in requests]
+    assert max(counts) == 3 + 3 - 1
+    assert counts[-1] >= 3
+    # Most steps leave the history untouched; evictions come every third step
+    evicting = [i for i in range(1, len(counts)) if counts[i] < counts[i - 1] + 1]
+    assert len(evicting) <= len(counts) // 3
+
+
+def test_steps_without_eviction_only_send_the_newest_turn_uncached():
+    requests = run_session(12, ImageHistoryManager(max_images=3, evict_batch=3))
+    reads = simulate_cache(requests)
+    for previous, request, read in zip(requests, requests[1:], reads[1:]):
+        if count_images(request["messages"]) > count_images(previous["messages"]):
+            # The assistant turn and the tool results added since the last request
+            assert len(request["messages"]) - 1 - read <= 2
+
+
+def test_eviction_still_reads_up_to_the_stable_breakpoint():
+    requests = run_session(12, ImageHistoryManager(max_images=3, evict_batch=3))
+    reads = simulate_cache(requests)
+    evictions = 0
+    for previous, request, read in zip(requests, requests[1:], reads[1:]):
+        if count_images(request["messages"]) <= count_images(previous["messages"]):
+            evictions += 1
+            messages = request["messages"]
+            # The stable breakpoint was placed (and written) by the requests
+            # before the eviction, so the prefix up to it is read
+            assert read == breakpoints(messages)[0]
+            # Only the kept screenshots and the evicted batch are re-read
+            assert len(messages) - 1 - read <= 2 * (3 + 3) + 2
+    assert evictions == 3
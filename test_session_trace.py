@@ -0,0 +1,42 @@
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("PIL")
+pytest.importorskip("anthropic")
+
+from bench import noop_pyautogui
+
+# As in bench.py: replay swaps in no-op input anyway, and the real
+# pyautogui connects to a display as soon as it is imported
+sys.modules["pyautogui"] = noop_pyautogui()
+
+from session_trace import load_trace, simulate
+
+
+# Two fresh tasks of remote_control_v1 against stub_api.py (screenshot,
+# click, screenshot, click, done), recorded with the fake capture backend
+TRACE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_traces", "stub_v1")
+
+EXPECTED_TOOLS = ["take_screenshot", "move_and_click"] * 4
+
+
+def test_recorded_trace_replays_without_divergence():
+    report = simulate(TRACE, "instant")
+
+    assert report["script"] == "remote_control_v1"
+    assert report["divergences"] == 0
+    assert [task["turns"] for task in report["tasks"]] == [5, 5]
+    assert report["tools"] == EXPECTED_TOOLS
+    assert [task["response"] for task in report["tasks"]] == ["Done after 4 steps."] * 2
+    # Fast enough to run on every change
+    assert report["wall_s"] < 5
+
+
+def test_fixture_matches_the_expected_recording():
+    trace = load_trace(TRACE)
+    assert [tool["name"] for task in trace["tasks"] for tool in task["tools"]] == EXPECTED_TOOLS
+    assert [task["fresh"] for task in trace["tasks"]] == [True, True]
+    assert all(os.path.exists(os.path.join(TRACE, "frames", frame["ref"])) for frame in trace["frames"])
@@ -0,0 +1,104 @@
+import asyncio
+import threading
+import time
+
+from agent_core import AgentSession
+from streaming import FakeAsyncClient, FakeEventStream, fake_events
+
+
+TOOLS = [{"name": name, "input_schema": {"type": "object"}} for name in ("take_screenshot", "click")]
+
+
+def tool_use(tool_id, name, **tool_input):
+    return {"type": "tool_use", "id": tool_id, "name": name, "input": tool_input}
+
+
+class TruncatingClient(FakeAsyncClient):
+    # Streams the first response as if it hit max_tokens in the middle of its
+    # last tool_use: the input JSON of that block never completes
+
+    async def _create(self, stream=False, **request):
+        if not stream or len(self.requests) > 0:
+            return await super()._create(stream=stream, **request)
+        self.requests.append(request)
+        content, stop_reason = self.responses.pop(0)
+        events = list(fake_events(content, stop_reason, chunk_size=4))
+        last = len(content) - 1
+        deltas = [e for e in events if e.type == "content_block_delta" and e.index == last]
+        events = [e for e in events if e is not deltas[-1]]
+        return FakeEventStream(events)
+
+
+class ToolLog:
+    def __init__(self, screenshot_delay=0.0):
+        self.screenshot_delay = screenshot_delay
+        self.events = []
+        self._lock = threading.Lock()
+
+    def __call__(self, name, tool_input):
+        with self._lock:
+            self.events.append(("start", name, tool_input.get("n"), time.perf_counter()))
+        if name == "take_screenshot":
+            time.sleep(self.screenshot_delay)
+        with self._lock:
+            self.events.append(("end", name, tool_input.get("n"), time.perf_counter()))
+        return f"{name} done"
+
+    def time_of(self, kind, name, n):
+        return next(t for k, tool, number, t in self.events if (k, tool, number) == (kind, name, n))
+
+
+def assert_every_tool_use_answered(messages):
+    for message, reply in zip(messages, messages[1:]):
+        if message["role"] != "assistant" or isinstance(message["content"], str):
+            continue
+        asked = [block["id"] for block in message["content"] if block["type"] == "tool_use"]
+        answered = [block["tool_use_id"] for block in reply["content"]
+                    if isinstance(reply["content"], list) and block["type"] == "tool_result"]
+        assert answered == asked
+
+
+def run(client, execute_tool, stream=True):
+    session = AgentSession(client, "system", TOOLS, execute_tool, stream=stream, on_text=lambda text: None)
+    asyncio.run(session.send("Click the button"))
+    return session
+
+
+def test_max_tokens_after_dispatched_tools_still_answers_them():
+    for stream, client_type in ((True, TruncatingClient), (False, FakeAsyncClient)):
+        log = ToolLog()
+        client = client_type([
+            ([{"type": "text", "text": "Looking first."}, tool_use("a", "take_screenshot"),
+              tool_use("b", "click", x=10, y=20)], "max_tokens"),
+            ([{"type": "text", "text": "Done."}], "end_turn"),
+        ])
+        session = run(client, log, stream=stream)
+
+        # The loop went on to a second request instead of stopping with
+        # unanswered tool_use blocks
+        assert len(client.requests) == 2
+        assert_every_tool_use_answered(client.requests[1]["messages"])
+        results = {r["tool_use_id"]: r for r in session.messages[2]["content"]}
+        assert results["a"]["content"] == "take_screenshot done"
+        # The cut-off click was never run
+        assert results["b"]["is_error"]
+        assert [name for kind, name, _, _ in log.events if kind == "start"] == ["take_screenshot"]
+
+
+def test_streamed_screenshots_run_concurrently_and_in_order_with_actions():
+    log = ToolLog(screenshot_delay=0.2)
+    client = FakeAsyncClient([
+        ([tool_use("s1", "take_screenshot", n=1), tool_use("s2", "take_screenshot", n=2),
+          tool_use("c", "click", n=3), tool_use("s3", "take_screenshot", n=4)], "tool_use"),
+        ([{"type": "text", "text": "Done."}], "end_turn"),
+    ])
+    session = run(client, log)
+
+    assert_every_tool_use_answered(session.messages)
+    assert [r["tool_use_id"] for r in session.messages[2]["content"]] == ["s1", "s2", "c", "s3"]
+    # The two screenshots overlap
+    assert log.time_of("start", "take_screenshot", 2) < log.time_of("end", "take_screenshot", 1)
+    # The click waits for both, and the screenshot after it waits for the click
+    assert log.time_of("start", "click", 3) >= log.time_of("end", "take_screenshot", 2)
+    assert log.time_of("start", "click", 3) >= log.time_of("end", "take_screenshot", 1)
+    assert log.time_of("start", "take_screenshot", 4) >= log.time_of("end", "click", 3)
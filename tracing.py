@@ -0,0 +1,165 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Stage names used across the scripts, in pipeline order
+STAGES = ("capture", "resize", "ui_detect", "grid_overlay", "encode", "api_round_trip", "tool_execution", "input_actuation")
+
+USAGE_FIELDS = ("input_tokens", "output_tokens", "cache_read_input_tokens", "cache_creation_input_tokens")
+
+
+class Tracer:
+    # Times named spans and tags each with the current agent step. Finished
+    # spans are appended to a JSONL file (when configured) and folded into
+    # per-stage aggregates for the Prometheus endpoint and the session summary.
+
+    def __init__(self, trace_path=None, keep_samples=10000):
+        self.trace_path = trace_path
+        self.step = 0
+        self.tokens = defaultdict(int)
+        self._counts = defaultdict(int)
+        self._totals = defaultdict(float)
+        self._samples = defaultdict(lambda: deque(maxlen=keep_samples))
+        self._lock = threading.Lock()
+        self._file = None
+
+    def next_step(self):
+        with self._lock:
+            self.step += 1
+            return self.step
+
+    @contextmanager
+    def span(self, name, **tags):
+        # The yielded dict can be filled with extra tags inside the block
+        start = time.perf_counter()
+        started_at = time.time()
+        step = self.step
+        try:
+            yield tags
+        finally:
+            duration = time.perf_counter() - start
+            self._record(name, step, started_at, duration, tags)
+
+    def record_usage(self, tags, usage):
+        # Copies token counts from response.usage onto a span and the totals
+        if usage is None:
+            return
+        with self._lock:
+            for field in USAGE_FIELDS:
+                value = getattr(usage, field, None) or 0
+                tags[field] = value
+                self.tokens[field] += value
+
+    def _record(self, name, step, started_at, duration, tags):
+        with self._lock:
+            self._counts[name] += 1
+            self._totals[name] += duration
+            self._samples[name].append(duration)
+            if self.trace_path is None:
+                return
+            if self._file is None:
+                self._file = open(self.trace_path, "a", buffering=1)
+            entry = {"ts": round(started_at, 6), "step": step, "span": name,
+                     "duration_ms": round(duration * 1000, 3), "thread": threading.current_thread().name}
+            entry.update(tags)
+            self._file.write(json.dumps(entry, default=str) + "\n")
+
+    def reset(self):
+        # Clears the aggregates (not the trace file), e.g. between replays
+        with self._lock:
+            self.step = 0
+            self.tokens.clear()
+            self._counts.clear()
+            self._totals.clear()
+            self._samples.clear()
+
+    def stats(self):
+        with self._lock:
+            rows = {}
+            for name, count in self._counts.items():
+                ordered = sorted(self._samples[name])
+                rows[name] = {
+                    "count": count,
+                    "total": self._totals[name],
+                    "p50": ordered[len(ordered) // 2],
+                    "p95": ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)],
+                }
+            return rows
+
+    def render_prometheus(self):
+        lines = [
+            "# HELP agent_stage_seconds Time spent per agent loop stage",
+            "# TYPE agent_stage_seconds summary",
+        ]
+        for name, row in sorted(self.stats().items()):
+            lines.append(f'agent_stage_seconds{{stage="{name}",quantile="0.5"}} {row["p50"]:.6f}')
+            lines.append(f'agent_stage_seconds{{stage="{name}",quantile="0.95"}} {row["p95"]:.6f}')
+            lines.append(f'agent_stage_seconds_sum{{stage="{name}"}} {row["total"]:.6f}')
+            lines.append(f'agent_stage_seconds_count{{stage="{name}"}} {row["count"]}')
+        lines += [
+            "# HELP agent_tokens_total Tokens reported in response.usage",
+            "# TYPE agent_tokens_total counter",
+        ]
+        for field in USAGE_FIELDS:
+            lines.append(f'agent_tokens_total{{kind="{field}"}} {self.tokens[field]}')
+        lines += ["# HELP agent_steps_total Agent loop steps", "# TYPE agent_steps_total counter",
+                  f"agent_steps_total {self.step}"]
+        return "\n".join(lines) + "\n"
+
+    def serve_metrics(self, port, host="127.0.0.1"):
+        tracer = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = tracer.render_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+        print(f"Metrics served at http://{host}:{server.server_address[1]}/metrics")
+        return server
+
+    def summary(self):
+        rows = self.stats()
+        if not rows:
+            return "No spans recorded."
+        # Overlapping spans (tools running during a streamed response) can make
+        # shares add up to more than 100%
+        wall = sum(row["total"] for name, row in rows.items() if name in ("api_round_trip", "tool_execution")) or 1.0
+        order = [name for name in STAGES if name in rows] + sorted(set(rows) - set(STAGES))
+        lines = [f"{'stage':<18}{'count':>7}{'total s':>10}{'p50 ms':>10}{'p95 ms':>10}{'share':>8}"]
+        for name in order:
+            row = rows[name]
+            lines.append(f"{name:<18}{row['count']:>7}{row['total']:>10.2f}{row['p50'] * 1000:>10.1f}"
+                         f"{row['p95'] * 1000:>10.1f}{row['total'] / wall:>8.0%}")
+        # tool_execution contains capture/encode/input spans, so it is not a candidate
+        candidates = [name for name in rows if name != "tool_execution"] or list(rows)
+        dominant = max(candidates, key=lambda name: rows[name]["total"])
+        lines.append(f"Steps: {self.step}. Tokens: " + ", ".join(f"{k}={self.tokens[k]}" for k in USAGE_FIELDS))
+        lines.append(f"Dominant stage: {dominant}")
+        return "\n".join(lines)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+# TRACE_FILE enables the JSONL trace; METRICS_PORT starts the /metrics endpoint
+tracer = Tracer(trace_path=os.environ.get("TRACE_FILE"))
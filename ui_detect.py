@@ -0,0 +1,182 @@
+import threading
+
+from lazy_modules import lazy_import
+
+cv2 = lazy_import("cv2")
+np = lazy_import("numpy")
+Image = lazy_import("PIL.Image")
+
+
+MARK_COLOR = (255, 0, 255)  # Magenta boxes and ID tags (RGB)
+
+
+class UIElementDetector:
+    # Finds clickable-looking rectangles (buttons, fields, icons, list rows)
+    # with edge detection, a morphological close and connected-component /
+    # contour analysis on a downscaled grey frame. Results are cached: on the
+    # next frame only the area that changed is analysed again, and elements
+    # outside it keep their boxes and IDs.
+
+    def __init__(self, work_width=1152, min_size=12, max_size_fraction=0.5, max_elements=120,
+                 change_threshold=18, tile=32):
+        self.work_width = work_width
+        self.min_size = min_size
+        self.max_size_fraction = max_size_fraction
+        self.max_elements = max_elements
+        self.change_threshold = change_threshold
+        self.tile = tile
+        self.elements = []
+        self._previous = None
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self.elements = []
+            self._previous = None
+
+    def detect(self, image):
+        # Returns elements as dicts with id, box (left, top, right, bottom) and
+        # center, all in the coordinates of the image passed in
+        width, height = image.size
+        scale = min(self.work_width / width, 1.0)
+        work = image.convert("L")
+        if scale < 1.0:
+            work = work.resize((int(width * scale), int(height * scale)), Image.BILINEAR)
+        gray = np.asarray(work)
+
+        with self._lock:
+            dirty = self._dirty_box(gray)
+            if dirty is None:
+                return list(self.elements)
+
+            left, top, right, bottom = dirty
+            found, scores = self._find_boxes(gray[top:bottom, left:right])
+            found = np.rint((found + (left, top, left, top)) / scale).astype(int)
+
+            full_dirty = tuple(int(round(v / scale)) for v in dirty)
+            kept = [e for e in self.elements if not _intersects(e["box"], full_dirty)]
+            for box, score in zip(found.tolist(), scores.tolist()):
+                kept.append({
+                    "id": self._next_id,
+                    "box": tuple(box),
+                    "center": ((box[0] + box[2]) // 2, (box[1] + box[3]) // 2),
+                    "score": round(score, 3),
+                })
+                self._next_id += 1
+            # Over the cap, the least element-like boxes go, wherever they are
+            if len(kept) > self.max_elements:
+                kept = sorted(kept, key=lambda e: -e["score"])[:self.max_elements]
+            kept.sort(key=lambda e: (e["box"][1] // 16, e["box"][0]))
+            self.elements = kept
+            self._previous = gray
+            return list(self.elements)
+
+    def find(self, element_id):
+        with self._lock:
+            return next((e for e in self.elements if e["id"] == element_id), None)
+
+    def _dirty_box(self, gray):
+        # The whole frame on the first call or a size change, None when nothing
+        # changed, otherwise the bounding box of the changed tiles
+        height, width = gray.shape
+        if self._previous is None or self._previous.shape != gray.shape:
+            self.elements = []
+            return (0, 0, width, height)
+        delta = cv2.absdiff(gray, self._previous)
+        rows, cols = -(-height // self.tile), -(-width // self.tile)
+        if rows * self.tile != height or cols * self.tile != width:
+            padded = np.zeros((rows * self.tile, cols * self.tile), dtype=np.uint8)
+            padded[:height, :width] = delta
+            delta = padded
+        # Tile maxima in two contiguous passes, as in frame_diff.changed_tiles
+        bands = delta.reshape(rows, self.tile, cols * self.tile).max(axis=1)
+        changed = bands.reshape(rows, cols, self.tile).max(axis=2) > self.change_threshold
+        if not changed.any():
+            return None
+        ys, xs = np.nonzero(changed)
+        # One tile of margin so elements straddling the edge are re-detected whole
+        return (max((xs.min() - 1) * self.tile, 0), max((ys.min() - 1) * self.tile, 0),
+                min((xs.max() + 2) * self.tile, width), min((ys.max() + 2) * self.tile, height))
+
+    def _find_boxes(self, gray):
+        # Returns (boxes, scores): an N x 4 array of (left, top, right, bottom)
+        # and each box's edge density, the fraction of its pixels on an edge.
+        # Labelled buttons, icons and outlined fields score high, bare
+        # containers and background regions low.
+        height, width = gray.shape
+        if height < self.min_size or width < self.min_size:
+            return np.zeros((0, 4), dtype=int), np.zeros(0)
+        edges = cv2.Canny(gray, 40, 120)
+        # Close small gaps so a button's border and label become one component
+        closed = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (9, 5)))
+
+        _, _, stats, _ = cv2.connectedComponentsWithStats(closed, connectivity=8)
+        x, y, w, h = (stats[1:, i] for i in range(4))
+        candidates = [np.stack([x, y, x + w, y + h], axis=1)]
+
+        # Outlined rectangles (text fields, cards) whose interior is empty.
+        # Most contours are glyph fragments; the polygon fit only runs on the
+        # ones big enough to pass the size filter below.
+        contours, _ = cv2.findContours(edges, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+        bounding_rect, arc_length, approx_poly, is_convex = cv2.boundingRect, cv2.arcLength, cv2.approxPolyDP, cv2.isContourConvex
+        outlined = []
+        for contour in contours:
+            _, _, w, h = bounding_rect(contour)
+            if w < self.min_size or h < self.min_size * 0.75:
+                continue
+            approx = approx_poly(contour, 0.02 * arc_length(contour, True), True)
+            if len(approx) == 4 and is_convex(approx):
+                x, y, w, h = bounding_rect(approx)
+                outlined.append((x, y, x + w, y + h))
+        if outlined:
+            candidates.append(np.array(outlined))
+
+        boxes = np.concatenate(candidates).astype(int)
+        w, h = boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1]
+        plausible = ((w >= self.min_size) & (h >= self.min_size * 0.75)
+                     & (w <= width * self.max_size_fraction) & (h <= height * self.max_size_fraction)
+                     & (w <= 25 * h) & (h <= 6 * w))
+        boxes = _suppress_overlaps(boxes[plausible])
+
+        integral = cv2.integral((edges > 0).astype(np.uint8))
+        l, t, r, b = boxes.T
+        on_edges = integral[b, r] - integral[t, r] - integral[b, l] + integral[t, l]
+        return boxes, on_edges / ((r - l) * (b - t))
+
+
+def _intersects(a, b):
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def _suppress_overlaps(boxes, threshold=0.6):
+    # Keeps the smaller box of heavily overlapping pairs: the tighter box is
+    # usually the control itself rather than its container. OpenCV's greedy
+    # NMS does this when smaller boxes score higher.
+    boxes = np.unique(boxes.reshape(-1, 4), axis=0)
+    if not len(boxes):
+        return boxes
+    sizes = boxes[:, 2:] - boxes[:, :2]
+    rects = np.hstack([boxes[:, :2], sizes]).tolist()
+    keep = cv2.dnn.NMSBoxes(rects, (1.0 / sizes.prod(axis=1)).tolist(), 0.0, threshold)
+    return boxes[np.asarray(keep, dtype=int).reshape(-1)]
+
+
+def draw_marks(image, elements, color=MARK_COLOR):
+    frame = np.array(image.convert("RGB"))
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    for element in elements:
+        left, top, right, bottom = element["box"]
+        cv2.rectangle(frame, (left, top), (right, bottom), color, 1)
+        label = str(element["id"])
+        (text_width, text_height), _ = cv2.getTextSize(label, font, 0.4, 1)
+        cv2.rectangle(frame, (left, top), (left + text_width + 4, top + text_height + 4), color, -1)
+        cv2.putText(frame, label, (left + 2, top + text_height + 2), font, 0.4, (255, 255, 255), 1)
+    return Image.fromarray(frame)
+
+
+def describe_elements(elements):
+    return "\n".join(
+        f"[{e['id']}] center ({e['center'][0]}, {e['center'][1]}), size {e['box'][2] - e['box'][0]}x{e['box'][3] - e['box'][1]}"
+        for e in elements
+    )
@@ -0,0 +1,220 @@
+import argparse
+import asyncio
+import importlib
+import json
+import multiprocessing
+import os
+import queue
+import shutil
+import statistics
+import subprocess
+import time
+
+
+SCREEN = "1920x1080x24"
+
+# Seconds to wait for an Xvfb server to accept connections
+XVFB_START_TIMEOUT = 10
+
+
+def start_xvfb(display_number, screen=SCREEN):
+    # Starts one Xvfb server and waits until its socket exists
+    if shutil.which("Xvfb") is None:
+        raise RuntimeError("Xvfb is not installed")
+    process = subprocess.Popen(["Xvfb", f":{display_number}", "-screen", "0", screen, "-nolisten", "tcp"],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    socket_path = f"/tmp/.X11-unix/X{display_number}"
+    deadline = time.monotonic() + XVFB_START_TIMEOUT
+    while not os.path.exists(socket_path):
+        if process.poll() is not None:
+            raise RuntimeError(f"Xvfb :{display_number} exited with code {process.returncode}")
+        if time.monotonic() > deadline:
+            process.terminate()
+            raise RuntimeError(f"Xvfb :{display_number} did not start within {XVFB_START_TIMEOUT} s")
+        time.sleep(0.05)
+    return process
+
+
+def worker_main(display, script_name, api_url, stream, tasks, results):
+    # Runs in its own process, so pyautogui and the capture backend connect
+    # to this worker's display only. They read DISPLAY on import.
+    os.environ["DISPLAY"] = display
+    script = importlib.import_module(script_name)
+    asyncio.run(_work(display, script, api_url, stream, tasks, results))
+
+
+async def _work(display, script, api_url, stream, tasks, results):
+    from agent_core import AgentSession
+    from api_client import create_client
+
+    client = create_client(api_key=os.environ.get("API_KEY") or "stub", base_url=api_url)
+    while True:
+        task = await asyncio.to_thread(tasks.get)
+        if task is None:
+            break
+        started = time.time()
+        # Every task is a separate conversation on a clean screen state
+        script.reset_screen_state()
+        session = AgentSession(client, script.system_prompt, script.tools, script.execute_tool,
+                               history_manager=script.history_manager, stream=stream,
+                               on_text=lambda text: None, name=f"{display}/{task['id']}")
+        error = None
+        retries, retry_wait = client.retries, client.retry_wait
+        try:
+            await session.send(task["instruction"])
+        except Exception as e:
+            error = f"{type(e).__name__}: {str(e)}"
+        finally:
+            session.close()
+        results.put({
+            "id": task["id"],
+            "display": display,
+            "queue_wait_s": started - task["enqueued_at"],
+            "duration_s": time.time() - started,
+            "steps": len(session.step_latencies),
+            "step_latencies_s": session.step_latencies,
+            "retries": client.retries - retries,
+            "retry_wait_s": client.retry_wait - retry_wait,
+            "error": error,
+        })
+
+
+def load_tasks(path, repeat):
+    # One instruction per line, or JSON lines with an "instruction" field
+    instructions = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            instructions.append(json.loads(line)["instruction"] if line.startswith("{") else line)
+    return instructions * repeat
+
+
+def percentiles(values):
+    if not values:
+        return {"p50": None, "p95": None, "max": None}
+    ordered = sorted(values)
+    return {
+        "p50": statistics.median(ordered),
+        "p95": ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)],
+        "max": ordered[-1],
+    }
+
+
+def report(outcomes, wall_s):
+    ok = [o for o in outcomes if o["error"] is None]
+    steps = [latency for o in outcomes for latency in o["step_latencies_s"]]
+    per_display = {}
+    for o in outcomes:
+        row = per_display.setdefault(o["display"], {"tasks": 0, "errors": 0, "steps": []})
+        row["tasks"] += 1
+        row["errors"] += o["error"] is not None
+        row["steps"].extend(o["step_latencies_s"])
+    return {
+        "tasks": len(outcomes),
+        "errors": len(outcomes) - len(ok),
+        "wall_s": wall_s,
+        "retries": sum(o["retries"] for o in outcomes),
+        "retry_wait_s": sum(o["retry_wait_s"] for o in outcomes),
+        "throughput_tasks_per_min": len(ok) / wall_s * 60 if wall_s else 0.0,
+        "queue_wait_s": percentiles([o["queue_wait_s"] for o in outcomes]),
+        "task_duration_s": percentiles([o["duration_s"] for o in outcomes]),
+        "step_latency_s": percentiles(steps),
+        "per_display": {display: {"tasks": row["tasks"], "errors": row["errors"],
+                                  "step_latency_s": percentiles(row["steps"])}
+                        for display, row in sorted(per_display.items())},
+    }
+
+
+def print_report(summary):
+    def fmt(p):
+        return " / ".join("-" if p[k] is None else f"{p[k]:.2f}" for k in ("p50", "p95", "max"))
+    print(f"\n{summary['tasks']} tasks ({summary['errors']} failed) in {summary['wall_s']:.1f} s: "
+          f"{summary['throughput_tasks_per_min']:.1f} tasks/min")
+    print(f"API retries: {summary['retries']}, {summary['retry_wait_s']:.1f} s spent waiting to retry")
+    print(f"{'':<22} p50 / p95 / max (s)")
+    print(f"{'queue wait':<22} {fmt(summary['queue_wait_s'])}")
+    print(f"{'task duration':<22} {fmt(summary['task_duration_s'])}")
+    print(f"{'step latency':<22} {fmt(summary['step_latency_s'])}")
+    for display, row in summary["per_display"].items():
+        print(f"{'  ' + display + ' steps':<22} {fmt(row['step_latency_s'])}  ({row['tasks']} tasks, {row['errors']} failed)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run desktop-automation tasks in parallel on Xvfb displays")
+    parser.add_argument("tasks", help="File with one instruction per line (or JSON lines with 'instruction')")
+    parser.add_argument("--workers", type=int, default=4, help="Number of Xvfb displays / worker processes")
+    parser.add_argument("--first-display", type=int, default=99)
+    parser.add_argument("--screen", default=SCREEN, help="Xvfb screen geometry, WxHxDEPTH")
+    parser.add_argument("--script", default="remote_control_v1", choices=("remote_control_v1", "remote_control_with_grid"))
+    parser.add_argument("--repeat", type=int, default=1, help="Run the task list this many times")
+    parser.add_argument("--api-url", help="Base URL of the Messages API (e.g. a stub_api.py server)")
+    parser.add_argument("--stub", action="store_true", help="Start a local stub API server and use it")
+    parser.add_argument("--stub-steps", type=int, default=4)
+    parser.add_argument("--stub-latency", type=float, default=0.5)
+    parser.add_argument("--stub-failure-rate", type=float, default=0.0, help="Fraction of stub responses that fail")
+    parser.add_argument("--no-stream", action="store_true")
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    args = parser.parse_args()
+
+    api_url = args.api_url
+    if args.stub:
+        import stub_api
+        server = stub_api.serve(steps=args.stub_steps, latency=args.stub_latency, failure_rate=args.stub_failure_rate)
+        api_url = f"http://127.0.0.1:{server.server_port}"
+        print(f"Stub API at {api_url}")
+
+    # Workers are spawned, not forked: each imports pyautogui with its own DISPLAY
+    context = multiprocessing.get_context("spawn")
+    tasks, results = context.Queue(), context.Queue()
+    instructions = load_tasks(args.tasks, args.repeat)
+
+    servers, workers = [], []
+    try:
+        for i in range(args.workers):
+            number = args.first_display + i
+            servers.append(start_xvfb(number, args.screen))
+            worker = context.Process(target=worker_main, name=f"worker:{number}",
+                                     args=(f":{number}", args.script, api_url, not args.no_stream, tasks, results))
+            worker.start()
+            workers.append(worker)
+
+        start = time.time()
+        for index, instruction in enumerate(instructions):
+            tasks.put({"id": index, "instruction": instruction, "enqueued_at": time.time()})
+        for _ in workers:
+            tasks.put(None)
+
+        outcomes = []
+        while len(outcomes) < len(instructions):
+            try:
+                outcome = results.get(timeout=1)
+            except queue.Empty:
+                if not any(worker.is_alive() for worker in workers):
+                    print("All workers exited before the queue was drained")
+                    break
+                continue
+            outcomes.append(outcome)
+            status = "ok" if outcome["error"] is None else outcome["error"]
+            print(f"task {outcome['id']} on {outcome['display']}: {outcome['steps']} steps, "
+                  f"{outcome['duration_s']:.1f} s, {status}")
+        wall_s = time.time() - start
+    finally:
+        for worker in workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+        for server in servers:
+            server.terminate()
+            server.wait()
+
+    summary = report(outcomes, wall_s)
+    print_report(summary)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
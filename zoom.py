@@ -0,0 +1,91 @@
+from capture import capture_settled, get_capture_backend
+from grid_overlay import draw_grid
+from lazy_modules import lazy_import
+from screenshot_pipeline import encode_screenshot, region_encoder
+
+Image = lazy_import("PIL.Image")
+
+
+# Longest side of the returned image: small regions are enlarged so the grid
+# labels fit, large ones are shrunk to keep the upload small
+MIN_ZOOM_SIDE = 400
+MAX_ZOOM_SIDE = 1024
+
+# Grid spacings, in screenshot coordinates, for the zoomed image
+ZOOM_GRID_STEPS = (5, 10, 20, 25, 50, 100, 200)
+
+# Minimum distance between grid lines in the zoomed image, in pixels
+MIN_GRID_SPACING = 60
+
+ZOOM_REGION_TOOL = {
+    "name": "zoom_region",
+    "description": "Look closer at part of the screen. Captures the given rectangle (in screenshot coordinates) at the "
+                   "screen's native resolution and returns it enlarged, with a fine grid labelled in screenshot "
+                   "coordinates, so the labels can be passed to move_and_click directly. Much cheaper than a new "
+                   "screenshot; use it when unsure exactly where a small control is.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "left": {"type": "integer", "description": "Left edge, in screenshot coordinates"},
+            "top": {"type": "integer", "description": "Top edge, in screenshot coordinates"},
+            "right": {"type": "integer", "description": "Right edge, in screenshot coordinates"},
+            "bottom": {"type": "integer", "description": "Bottom edge, in screenshot coordinates"}
+        },
+        "required": ["left", "top", "right", "bottom"]
+    }
+}
+
+
+def grid_step(scale):
+    # The finest spacing whose lines are at least MIN_GRID_SPACING pixels apart
+    return next((step for step in ZOOM_GRID_STEPS if step * scale >= MIN_GRID_SPACING), ZOOM_GRID_STEPS[-1])
+
+
+def zoom_region(box, screenshot_size):
+    # box is (left, top, right, bottom) in the coordinates of screenshots
+    # sent at screenshot_size. Returns tool result content blocks.
+    width, height = screenshot_size
+    left, top = max(int(box[0]), 0), max(int(box[1]), 0)
+    right, bottom = min(int(box[2]), width), min(int(box[3]), height)
+    if right - left < 2 or bottom - top < 2:
+        raise ValueError(f"Region {tuple(box)} is empty or outside the {width}x{height} screenshot")
+
+    # Screenshot coordinates to capture pixels (the native resolution)
+    screen_width, screen_height = get_capture_backend().screen_size()
+    factor_x, factor_y = screen_width / width, screen_height / height
+    region = (int(left * factor_x), int(top * factor_y),
+              min(round(right * factor_x), screen_width), min(round(bottom * factor_y), screen_height))
+    crop, settle = capture_settled(region)
+
+    longest = max(crop.size)
+    fit = min(max(MIN_ZOOM_SIDE / longest, 1.0), MAX_ZOOM_SIDE / longest)
+    if fit != 1.0:
+        crop = crop.resize((max(int(crop.size[0] * fit), 1), max(int(crop.size[1] * fit), 1)), Image.LANCZOS)
+    # Image pixels per screenshot coordinate
+    scale = crop.size[0] / (right - left)
+    step = grid_step(scale)
+    zoomed = draw_grid(crop, origin=(left, top), grid_size=step, scale=scale)
+    encoded = encode_screenshot(zoomed, prefix="zoom", encoder=region_encoder)
+
+    native = "native resolution" if fit == 1.0 else f"{fit:.2f}x native resolution"
+    return [
+        {
+            "type": "text",
+            "text": f"Zoomed into ({left}, {top}) to ({right}, {bottom}) of the screenshot, shown at {native} "
+                    f"({scale:.2f} image pixels per screenshot coordinate). Grid lines every {step} are labelled "
+                    "in screenshot coordinates: pass them to move_and_click as they are."
+        },
+        {
+            "type": "image",
+            "source": {
+                "type": "base64",
+                "media_type": encoded["media_type"],
+                "data": encoded["data"]
+            }
+        },
+        {
+            "type": "text",
+            "text": f"For a point at pixel (u, v) of this image, click x = {left} + u / {scale:.3f}, "
+                    f"y = {top} + v / {scale:.3f}. On the physical screen the region is {region}."
+        }
+    ]